@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ExpensesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'expenses'
+
+    def ready(self):
+        # Connect the signal handlers that keep group counters up to date
+        from . import signals  # noqa: F401
+        # Register the system checks
+        from . import checks  # noqa: F401
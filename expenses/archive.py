@@ -0,0 +1,143 @@
+"""
+Cold storage for old settlement history.
+
+archive_settled_history moves payments older than a cutoff into
+PaymentArchive, and the splits of old expenses in groups that have since been
+settled up into SplitArchive. Balances don't change: the ledger already has
+every payment and split folded in, and rebuild_ledger reads both tables.
+
+Pages that list a user's expenses go through the helpers here, which only
+look at the archive when their date range reaches back past archive_horizon().
+Editing or deleting an archived expense moves its splits back first.
+"""
+from datetime import datetime, time
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from .models import Expense, Split, Debt, Payment, PaymentArchive, SplitArchive, LedgerQueueEntry
+
+# Rows moved per transaction, so the hot tables are never locked for long
+ARCHIVE_BATCH_SIZE = 1000
+
+
+def archive_payments(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move payments made before `cutoff` into the archive in batches. Returns the number moved."""
+    moved = 0
+    while True:
+        with transaction.atomic():
+            payments = list(
+                Payment.objects.select_for_update().filter(created_at__lt=cutoff).order_by('id')[:batch_size]
+            )
+            if not payments:
+                return moved
+            PaymentArchive.objects.bulk_create([
+                PaymentArchive(
+                    id=payment.id, payer_id=payment.payer_id, payee_id=payment.payee_id,
+                    group_id=payment.group_id, amount=payment.amount, created_at=payment.created_at
+                )
+                for payment in payments
+            ])
+            Payment.objects.filter(pk__in=[payment.pk for payment in payments]).delete()
+        moved += len(payments)
+
+def settled_expenses(cutoff):
+    """
+    Expenses created before `cutoff` that still have live splits, in groups with
+    no open debts and nothing queued. Every balance in such a group has been paid,
+    so everything the group spent up to now is fully settled.
+    """
+    open_groups = Debt.objects.filter(is_settled=False, group__isnull=False).values('group_id')
+    queued_groups = LedgerQueueEntry.objects.values('group_id')
+    return Expense.objects.filter(
+        Exists(Split.objects.filter(expense=OuterRef('pk'))),
+        created_at__lt=cutoff,
+    ).exclude(group_id__in=open_groups).exclude(group_id__in=queued_groups)
+
+def archive_settled_splits(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move the splits of fully settled expenses older than `cutoff` into the archive. Returns the number moved."""
+    moved = 0
+    while True:
+        with transaction.atomic():
+            # Locked so an edit can't change the splits while they are being moved
+            expenses = dict(
+                settled_expenses(cutoff).select_for_update().order_by('id').values_list('id', 'created_at')[:batch_size]
+            )
+            if not expenses:
+                return moved
+            splits = list(Split.objects.filter(expense_id__in=expenses))
+            SplitArchive.objects.bulk_create([
+                SplitArchive(
+                    id=split.id, expense_id=split.expense_id, user_id=split.user_id,
+                    amount_owed=split.amount_owed, percentage=split.percentage,
+                    created_at=expenses[split.expense_id]
+                )
+                for split in splits
+            ], batch_size=1000)
+            Split.objects.filter(expense_id__in=expenses).delete()
+        moved += len(splits)
+
+def restore_expense_splits(expense_id):
+    """
+    Move an expense's archived splits back into the live table, so it can be
+    edited or deleted like any other. Run it inside the edit's transaction.
+    """
+    archived = list(SplitArchive.objects.filter(expense_id=expense_id))
+    if not archived:
+        return
+    Split.objects.bulk_create([
+        Split(
+            id=split.id, expense_id=split.expense_id, user_id=split.user_id,
+            amount_owed=split.amount_owed, percentage=split.percentage
+        )
+        for split in archived
+    ])
+    SplitArchive.objects.filter(expense_id=expense_id).delete()
+
+def expense_splits(expense):
+    """An expense's splits, from the live table or the archive."""
+    return list(expense.splits.all()) or list(expense.archived_splits.all())
+
+def archive_horizon():
+    """Creation time of the newest archived row, or None while nothing is archived."""
+    latest = [
+        model.objects.order_by('-created_at').values_list('created_at', flat=True).first()
+        for model in (PaymentArchive, SplitArchive)
+    ]
+    latest = [moment for moment in latest if moment is not None]
+    return max(latest) if latest else None
+
+def reaches_archive(date_from):
+    """Whether a date range starting at `date_from` (None for open-ended) can include archived rows."""
+    if date_from is None:
+        return archive_horizon() is not None
+    if not isinstance(date_from, datetime):
+        date_from = datetime.combine(date_from, time.min)
+    if timezone.is_naive(date_from):
+        date_from = timezone.make_aware(date_from)
+    horizon = archive_horizon()
+    return horizon is not None and date_from <= horizon
+
+def user_expenses_filter(user, include_archive=True):
+    """
+    Q for expenses the user paid for or has a share in.
+    IN subqueries rather than joins, so no DISTINCT is needed.
+    """
+    shared = Q(pk__in=Split.objects.filter(user=user).values('expense_id'))
+    if include_archive:
+        shared |= Q(pk__in=SplitArchive.objects.filter(user=user).values('expense_id'))
+    return Q(paid_by=user) | shared
+
+def attach_splits(expenses, include_archive=True):
+    """
+    Set expense.all_splits on each expense, live and archived splits alike,
+    with two queries however many expenses there are.
+    """
+    expenses = list(expenses)
+    by_expense = {expense.id: [] for expense in expenses}
+    sources = [Split, SplitArchive] if include_archive else [Split]
+    for model in sources:
+        for split in model.objects.filter(expense_id__in=by_expense).select_related('user').order_by('id'):
+            by_expense[split.expense_id].append(split)
+    for expense in expenses:
+        expense.all_splits = by_expense[expense.id]
+    return expenses
@@ -0,0 +1,166 @@
+"""
+Versioned cache for computed balances.
+
+Every group has a version number in the cache and balance entries are stored
+under keys that include it. Posting an expense or a settlement bumps the
+version inside its transaction, so readers move on to fresh keys and the old
+entries are never read again and simply expire. Only plain get/set/incr calls
+are used, so any Django cache backend that all server processes share works
+(file, Redis...); the expenses.E001 system check rejects per-process ones.
+"""
+import hashlib
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+from .models import Group, Debt, MemberBalance
+from .ledger import group_member_balances, open_debts_of
+
+HITS_KEY = 'balances:stats:hits'
+MISSES_KEY = 'balances:stats:misses'
+
+
+def get_cache():
+    return caches[getattr(settings, 'BALANCE_CACHE_ALIAS', 'default')]
+
+def version_key(group_id):
+    return f'balances:group:{group_id}:version'
+
+def new_version():
+    """Versions start from the clock, so a lost version key can never bring old entries back."""
+    return time.time_ns() // 1000
+
+def group_versions(group_ids):
+    """Return {group_id: version}, starting a version for groups that don't have one yet."""
+    cache = get_cache()
+    keys = {version_key(group_id): group_id for group_id in group_ids}
+    found = cache.get_many(keys)
+
+    versions = {keys[key]: version for key, version in found.items()}
+    missing = {key: new_version() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update({keys[key]: version for key, version in missing.items()})
+    return versions
+
+def bump_group_version(group_id):
+    """
+    Move a group to a new version, making everything cached for it unreachable.
+    Call it inside the transaction that changes the group's balances. The version
+    is bumped again on commit, so nothing a concurrent reader cached from the
+    pre-commit data survives.
+    """
+    _bump(group_id)
+    transaction.on_commit(lambda: _bump(group_id))
+
+def _bump(group_id):
+    cache = get_cache()
+    try:
+        cache.incr(version_key(group_id))
+    except ValueError:
+        cache.set(version_key(group_id), new_version(), None)
+
+def count(key, amount):
+    if not amount:
+        return
+    cache = get_cache()
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        cache.set(key, amount, None)
+
+def cache_stats():
+    """Return hit and miss counts since the last reset."""
+    counts = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    return {'hits': counts.get(HITS_KEY, 0), 'misses': counts.get(MISSES_KEY, 0)}
+
+def reset_cache_stats():
+    get_cache().delete_many([HITS_KEY, MISSES_KEY])
+
+def cached_group_member_balances(group):
+    """group_member_balances, served from the cache while the group's version is unchanged."""
+    cache = get_cache()
+    version = group_versions([group.id])[group.id]
+    key = f'balances:group:{group.id}:v{version}:balances'
+
+    member_balances = cache.get(key)
+    if member_balances is not None:
+        count(HITS_KEY, 1)
+        return member_balances
+
+    count(MISSES_KEY, 1)
+    member_balances = group_member_balances(group)
+    cache.set(key, member_balances, getattr(settings, 'BALANCE_CACHE_TIMEOUT', 300))
+    return member_balances
+
+def user_group_summaries(user, group_ids):
+    """
+    The user's position in each of the given groups: their MemberBalance figures
+    plus their open debts and credits there. Every group is cached separately
+    under its own version, and all misses are loaded together in two queries.
+    Returns {group_id: {'paid', 'owed', 'to_receive', 'net', 'credits', 'debts'}}.
+    """
+    cache = get_cache()
+    versions = group_versions(group_ids)
+    keys = {
+        f'balances:group:{group_id}:v{version}:user:{user.id}': group_id
+        for group_id, version in versions.items()
+    }
+    found = cache.get_many(keys)
+    summaries = {keys[key]: summary for key, summary in found.items()}
+
+    missing = [group_id for group_id in group_ids if group_id not in summaries]
+    count(HITS_KEY, len(summaries))
+    count(MISSES_KEY, len(missing))
+    if not missing:
+        return summaries
+
+    zero = Decimal('0.00')
+    loaded = {
+        group_id: {'paid': zero, 'owed': zero, 'to_receive': zero, 'net': zero, 'credits': [], 'debts': []}
+        for group_id in missing
+    }
+    for balance in MemberBalance.objects.filter(user=user, group_id__in=missing):
+        loaded[balance.group_id].update(
+            paid=balance.paid, owed=balance.owed, to_receive=balance.to_receive, net=balance.net
+        )
+    open_debts = Debt.objects.filter(
+        open_debts_of(user),
+        group_id__in=missing
+    ).select_related('creditor', 'debtor', 'group')
+    for debt in open_debts:
+        side = 'credits' if debt.creditor_id == user.id else 'debts'
+        loaded[debt.group_id][side].append(debt)
+
+    by_group = {group_id: key for key, group_id in keys.items()}
+    cache.set_many(
+        {by_group[group_id]: summary for group_id, summary in loaded.items()},
+        getattr(settings, 'BALANCE_CACHE_TIMEOUT', 300)
+    )
+    summaries.update(loaded)
+    return summaries
+
+def user_group_ids(user):
+    """Ids of the groups the user belongs to or still has open debts in."""
+    open_debt_groups = Debt.objects.filter(
+        open_debts_of(user)
+    ).values('group_id')
+    return list(
+        Group.objects.filter(Q(members=user) | Q(id__in=open_debt_groups)).distinct().values_list('id', flat=True)
+    )
+
+def balance_etag(request, group_ids):
+    """
+    ETag for a page built from the given groups, for use with @condition.
+    It only changes when one of the groups gets a new version (or the set of
+    groups changes), so repeat polls can get a 304 before any balance is loaded.
+    Returns None, skipping the check, while a flash message is waiting to be shown.
+    """
+    if len(messages.get_messages(request)):
+        return None
+    versions = group_versions(group_ids)
+    validator = ','.join(f'{group_id}.{versions[group_id]}' for group_id in sorted(versions))
+    return hashlib.md5(f'{request.user.id}:{request.get_full_path()}:{validator}'.encode()).hexdigest()
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Cache backends that keep their entries inside one process
+PER_PROCESS_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@register(Tags.caches)
+def check_balance_cache(app_configs, **kwargs):
+    """
+    The balance cache is invalidated by bumping a version key, which only works
+    if every server process sees the bump. A per-process cache would keep
+    serving stale balances (and 304s for changed ETags) in all the others.
+    """
+    alias = getattr(settings, 'BALANCE_CACHE_ALIAS', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend is None:
+        return [Error(
+            f"BALANCE_CACHE_ALIAS is '{alias}', which is not in CACHES.",
+            id='expenses.E002',
+        )]
+    if backend in PER_PROCESS_BACKENDS:
+        return [Error(
+            f"The balance cache '{alias}' uses {backend.rsplit('.', 1)[-1]}, which is per process.",
+            hint=(
+                'Use a backend all server processes share, such as FileBasedCache or RedisCache. '
+                'If the site only ever runs in a single process, add expenses.E001 to '
+                'SILENCED_SYSTEM_CHECKS.'
+            ),
+            id='expenses.E001',
+        )]
+    return []
@@ -1,125 +1,601 @@
-from decimal import Decimal
-from .models import Split, Debt
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Group, Expense, Split, Debt, Payment, LedgerQueueEntry, RecurringExpense
+from .balance_cache import bump_group_version
+from .archive import restore_expense_splits
+from .ledger import (
+    CENT, net_pair_changes, post_pair_changes, sync_debts,
+    member_changes_for_pairs, post_member_changes, post_user_stats_changes, enqueue_changes,
+    clear_group_balances,
+)
 
 def handle_equal_split(expense, participants):
     """Handle equal splitting of an expense among participants."""
-    total_participants = len(participants)
-    amount_per_person = expense.amount / Decimal(total_participants)
-    
-    # Create splits and update debts
-    for participant in participants:
-        # If this participant paid, they don't owe anything
-        if participant == expense.paid_by:
-            # Create a split record with 0 amount owed
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=Decimal('0.00')
-            )
-        else:
-            # Create a split record
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=amount_per_person
-            )
-            
-            # Update debt records
-            update_debt(expense.paid_by, participant, amount_per_person, expense.group)
+    splits = build_splits(expense, 'EQUAL', [participant.id for participant in participants])
+    apply_splits(expense, splits)
 
 def handle_percentage_split(expense, participants, percentages):
     """Handle percentage-based splitting of an expense."""
-    for participant in participants:
-        percentage = percentages.get(participant.id, Decimal('0'))
-        amount_owed = (percentage / Decimal('100')) * expense.amount
-        
-        # If this participant paid, they don't owe anything
-        if participant == expense.paid_by:
-            # Create a split record with 0 amount owed
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=Decimal('0.00'),
-                percentage=percentage
-            )
-        else:
-            # Create a split record
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=amount_owed,
-                percentage=percentage
-            )
-            
-            # Update debt records
-            update_debt(expense.paid_by, participant, amount_owed, expense.group)
+    splits = build_splits(expense, 'PERCENTAGE', [participant.id for participant in participants], percentages)
+    apply_splits(expense, splits)
 
 def handle_direct_split(expense, participants, direct_amounts):
     """Handle direct amount splitting of an expense."""
-    for participant in participants:
-        amount_owed = direct_amounts.get(participant.id, Decimal('0'))
-        
-        # If this participant paid, they don't owe anything
-        if participant == expense.paid_by:
-            # Create a split record with 0 amount owed
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=Decimal('0.00')
-            )
+    splits = build_splits(expense, 'DIRECT', [participant.id for participant in participants], direct_amounts)
+    apply_splits(expense, splits)
+
+def build_splits(expense, split_type, participant_ids, shares=None):
+    """
+    Compute the Split rows for an expense without writing anything.
+    `shares` maps participant id to a percentage (PERCENTAGE) or an amount (DIRECT).
+    The payer's own split is always 0 amount owed.
+    """
+    shares = shares or {}
+    total_participants = len(participant_ids)
+    splits = []
+
+    for user_id in participant_ids:
+        percentage = None
+        if split_type == 'PERCENTAGE':
+            percentage = shares.get(user_id, Decimal('0'))
+            amount_owed = (percentage / Decimal('100')) * expense.amount
+        elif split_type == 'DIRECT':
+            amount_owed = shares.get(user_id, Decimal('0'))
+        else:
+            amount_owed = expense.amount / Decimal(total_participants)
+
+        if user_id == expense.paid_by_id:
+            amount_owed = Decimal('0.00')
+
+        splits.append(Split(
+            expense=expense,
+            user_id=user_id,
+            amount_owed=Decimal(amount_owed).quantize(CENT),
+            percentage=percentage
+        ))
+    return splits
+
+def split_deltas(expense, splits):
+    """Return the (creditor_id, debtor_id) -> amount debt changes produced by an expense's splits."""
+    deltas = {}
+    for split in splits:
+        if split.user_id != expense.paid_by_id and split.amount_owed:
+            key = (expense.paid_by_id, split.user_id)
+            deltas[key] = deltas.get(key, Decimal('0.00')) + split.amount_owed
+    return deltas
+
+def apply_splits(expense, splits):
+    """
+    Write all split rows of an expense with one bulk insert and apply the
+    resulting debts in a fixed number of statements.
+    With LEDGER_ASYNC_POSTING the debts are queued instead of applied.
+    """
+    Split.objects.bulk_create(splits)
+    adjust_group_counters(expense.group_id, expenses=1, spent=expense.amount)
+    post_debt_deltas(expense.group, split_deltas(expense, splits), {expense.paid_by_id: expense.amount})
+    return splits
+
+def adjust_group_counters(group_id, expenses=0, spent=Decimal('0.00')):
+    """
+    Move a group's expense_count and total_spent by the given amounts.
+    A single F() update, so concurrent writers can't overwrite each other's change.
+    """
+    Group.objects.filter(pk=group_id).update(
+        expense_count=F('expense_count') + expenses,
+        total_spent=F('total_spent') + spent
+    )
+
+def post_debt_deltas(group, deltas, paid):
+    """Apply debt and paid changes now, or queue them when LEDGER_ASYNC_POSTING is on."""
+    if getattr(settings, 'LEDGER_ASYNC_POSTING', False):
+        # Debts are applied later by drain_ledger_queue, merged with other posts
+        enqueue_changes(group, deltas, paid)
+        # The expense itself is visible right away, so pages showing it must revalidate
+        bump_group_version(group.id)
+    else:
+        apply_debt_deltas(group, deltas, paid=paid)
+
+def update_expense(expense, changes, participant_ids, shares=None):
+    """
+    Edit an expense and re-split it, posting only the net debt change.
+    `changes` maps Expense field names to their new values. The old and new
+    Split sets are diffed per user, so the cost grows with the number of
+    participants, not with the size of the group.
+    """
+    with transaction.atomic():
+        expense = Expense.objects.select_for_update().select_related('group').get(pk=expense.pk)
+        # Archived splits come back first, so an old expense edits like any other
+        restore_expense_splits(expense.pk)
+        old_splits = {split.user_id: split for split in expense.splits.all()}
+        old_group = expense.group
+        old_amount = expense.amount
+        old_deltas = split_deltas(expense, old_splits.values())
+        old_paid = {expense.paid_by_id: expense.amount}
+
+        for field, value in changes.items():
+            setattr(expense, field, value)
+        expense.save()
+
+        new_splits = build_splits(expense, expense.split_type, participant_ids, shares)
+        to_update = []
+        for split in new_splits:
+            old = old_splits.pop(split.user_id, None)
+            if old is None:
+                continue
+            split.pk = old.pk
+            if (old.amount_owed, old.percentage) != (split.amount_owed, split.percentage):
+                to_update.append(split)
+        to_create = [split for split in new_splits if split.pk is None]
+
+        if old_splits:
+            Split.objects.filter(pk__in=[split.pk for split in old_splits.values()]).delete()
+        if to_update:
+            Split.objects.bulk_update(to_update, ['amount_owed', 'percentage'])
+        if to_create:
+            Split.objects.bulk_create(to_create)
+
+        new_deltas = split_deltas(expense, new_splits)
+        new_paid = {expense.paid_by_id: expense.amount}
+        if expense.group_id == old_group.id:
+            adjust_group_counters(expense.group_id, spent=expense.amount - old_amount)
+            post_debt_deltas(expense.group, subtract_deltas(new_deltas, old_deltas), subtract_deltas(new_paid, old_paid))
         else:
-            # Create a split record
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=amount_owed
-            )
-            
-            # Update debt records
-            update_debt(expense.paid_by, participant, amount_owed, expense.group)
+            adjust_group_counters(old_group.id, expenses=-1, spent=-old_amount)
+            adjust_group_counters(expense.group_id, expenses=1, spent=expense.amount)
+            post_debt_deltas(old_group, subtract_deltas({}, old_deltas), subtract_deltas({}, old_paid))
+            post_debt_deltas(expense.group, new_deltas, new_paid)
+    return expense
+
+def delete_expense(expense):
+    """Delete an expense and reverse exactly the debts its splits created."""
+    with transaction.atomic():
+        expense = Expense.objects.select_for_update().select_related('group').get(pk=expense.pk)
+        restore_expense_splits(expense.pk)
+        deltas = split_deltas(expense, expense.splits.all())
+        paid = {expense.paid_by_id: expense.amount}
+        group = expense.group
+        expense.delete()
+        adjust_group_counters(group.id, expenses=-1, spent=-expense.amount)
+        post_debt_deltas(group, subtract_deltas({}, deltas), subtract_deltas({}, paid))
+
+def subtract_deltas(new, old):
+    """Return new - old for two {key: amount} change maps, dropping keys that cancel out."""
+    result = dict(new)
+    for key, amount in old.items():
+        result[key] = result.get(key, Decimal('0.00')) - amount
+    return {key: amount for key, amount in result.items() if amount}
+
+def apply_debt_deltas(group, deltas, paid=None):
+    """
+    Apply a batch of debt changes within a group.
+    `deltas` maps (creditor_id, debtor_id) to the amount the debtor now additionally owes,
+    and `paid` optionally maps user_id to an amount to add to what they paid in the group.
+    The pairwise ledger takes one upsert per batch of pairs, then the Debt rows and
+    the MemberBalance projection for the touched users are brought in line with it.
+
+    The ledger upsert locks each pair's row until commit, so concurrent posters
+    touching the same pair queue up behind each other instead of losing updates.
+    That only holds inside a transaction, hence the atomic block.
+    """
+    with transaction.atomic():
+        net_changes = net_pair_changes(deltas)
+        balances = post_pair_changes(group, net_changes)
+        sync_debts(group, balances)
+
+        member_changes = member_changes_for_pairs(net_changes, balances)
+        for user_id, amount in (paid or {}).items():
+            member_changes.setdefault(user_id, {})['paid'] = amount
+        post_member_changes(group, member_changes)
+
+        # Cached balances for the group are stale from here on
+        bump_group_version(group.id)
+    return balances
 
 def update_debt(creditor, debtor, amount, group):
     """Update or create a debt record between two users."""
-    # Check if there's an existing debt in the opposite direction
+    apply_debt_deltas(group, {(creditor.id, debtor.id): amount})
+
+def settle_debt(debt):
+    """
+    Pay off a debt in full by recording a Payment for its amount.
+    The ledger takes the payment as the reverse of the debt, which clears the open row.
+    The row is locked and re-read first so a concurrent expense can't change the amount underneath us.
+    Returns the payment.
+    """
+    with transaction.atomic():
+        debt = Debt.objects.select_for_update().select_related('group').get(pk=debt.pk)
+        payment = Payment.objects.create(
+            payer_id=debt.debtor_id, payee_id=debt.creditor_id, group=debt.group, amount=debt.amount
+        )
+        post_user_stats_changes({debt.debtor_id: {'settled': 1}})
+        if debt.group_id is None:
+            # Group-less debts aren't in the ledger, so the row goes directly
+            debt.delete()
+        else:
+            apply_debt_deltas(debt.group, {(debt.debtor_id, debt.creditor_id): debt.amount})
+    return payment
+
+def settle_debts(debt_ids):
+    """
+    Pay off many open debts at once, in any number of groups.
+    The rows are locked, one Payment per debt goes in with a single bulk insert,
+    and each group's ledger takes the reversal of all its debts in a single
+    apply_debt_deltas. Debts already paid by someone else in the meantime are skipped.
+    Returns the payments recorded.
+    """
+    with transaction.atomic():
+        debts = list(
+            Debt.objects.select_for_update().filter(pk__in=debt_ids, is_settled=False).select_related('group')
+        )
+        if not debts:
+            return []
+        payments = Payment.objects.bulk_create([
+            Payment(payer_id=debt.debtor_id, payee_id=debt.creditor_id, group_id=debt.group_id, amount=debt.amount)
+            for debt in debts
+        ])
+
+        reversals, settled, groups = {}, {}, {}
+        for debt in debts:
+            settled[debt.debtor_id] = settled.get(debt.debtor_id, 0) + 1
+            if debt.group_id is None:
+                continue
+            groups[debt.group_id] = debt.group
+            group_deltas = reversals.setdefault(debt.group_id, {})
+            key = (debt.debtor_id, debt.creditor_id)
+            group_deltas[key] = group_deltas.get(key, Decimal('0.00')) + debt.amount
+
+        # Group-less debts aren't in the ledger, so their rows go directly
+        Debt.objects.filter(pk__in=[debt.pk for debt in debts if debt.group_id is None]).delete()
+        post_user_stats_changes({user_id: {'settled': count} for user_id, count in settled.items()})
+        for group_id, deltas in reversals.items():
+            apply_debt_deltas(groups[group_id], deltas)
+    return payments
+
+def settle_payment(debtor, creditor, amount, group=None):
+    """
+    Record a payment from debtor to creditor as a single Payment row.
+    Within a group the ledger takes it as a debt in the opposite direction,
+    which shrinks or clears their open debt there. Group-less debts aren't in
+    the ledger, so the payment pays those rows off directly, oldest first.
+    Raises ValidationError if the amount is not positive or more than is owed.
+    Returns the payment.
+    """
+    amount = Decimal(amount).quantize(CENT)
+    with transaction.atomic():
+        debts = list(
+            Debt.objects.select_for_update().filter(
+                debtor=debtor, creditor=creditor, group=group, is_settled=False
+            ).order_by('updated_at', 'id')
+        )
+
+        if amount <= 0:
+            raise ValidationError("The amount must be more than zero.")
+        if amount > sum((debt.amount for debt in debts), Decimal('0.00')):
+            raise ValidationError("The amount is more than is owed.")
+
+        payment = Payment.objects.create(payer=debtor, payee=creditor, group=group, amount=amount)
+        post_user_stats_changes({debtor.id: {'settled': 1}})
+
+        if group is not None:
+            apply_debt_deltas(group, {(debtor.id, creditor.id): amount})
+            return payment
+
+        remaining, paid_off = amount, []
+        for debt in debts:
+            if not remaining:
+                break
+            part = min(remaining, debt.amount)
+            remaining -= part
+            if part == debt.amount:
+                paid_off.append(debt.pk)
+            else:
+                Debt.objects.filter(pk=debt.pk).update(amount=debt.amount - part, updated_at=timezone.now())
+        Debt.objects.filter(pk__in=paid_off).delete()
+    return payment
+
+def settle_group(group):
+    """
+    Settle every balance in a group at once, in a constant number of queries.
+    Queued changes for the group are applied first so nothing posted before the
+    settlement is left behind. Returns the number of payments recorded.
+    """
+    with transaction.atomic():
+        while drain_ledger_queue(group_ids=[group.id]):
+            pass
+        settled = clear_group_balances(group.id)
+        bump_group_version(group.id)
+    return settled
+
+def compile_split_plan(amount, split_type, paid_by_id, participant_ids, shares=None):
+    """
+    Resolve a recurring expense's split once, when it is saved, into a plan of
+    [user_id, weight, share] rows. The weight is the percentage (PERCENTAGE),
+    the amount (DIRECT) or 1 (EQUAL), the share is already rounded to cents and
+    `remainder` is the rounding difference the payer absorbs.
+    Raises ValidationError when the split could never be generated.
+    """
+    if split_type not in ('EQUAL', 'PERCENTAGE', 'DIRECT'):
+        raise ValidationError(f"{split_type} splits can't be used for recurring expenses.")
+
+    participant_ids = list(dict.fromkeys(int(user_id) for user_id in participant_ids))
+    if not participant_ids:
+        raise ValidationError("You must select at least one participant.")
+
+    # Ensure payer is in participants
+    if paid_by_id not in participant_ids:
+        participant_ids.append(paid_by_id)
+
     try:
-        reverse_debt = Debt.objects.get(creditor=debtor, debtor=creditor, group=group)
-        
-        # If the reverse debt is greater, reduce it
-        if reverse_debt.amount > amount:
-            reverse_debt.amount -= amount
-            reverse_debt.save()
-            return
-        # If the reverse debt is equal, delete it
-        elif reverse_debt.amount == amount:
-            reverse_debt.delete()
-            return
-        # If the reverse debt is less, delete it and create a new debt in the opposite direction
+        amount = Decimal(str(amount)).quantize(CENT)
+        weights = {int(user_id): Decimal(str(value)) for user_id, value in (shares or {}).items()}
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValidationError("Split amounts must be numbers.")
+
+    if set(weights) - set(participant_ids):
+        raise ValidationError("Split shares were given for users who are not participants.")
+    if any(weight < 0 for weight in weights.values()):
+        raise ValidationError("Split shares can't be negative.")
+    if split_type == 'PERCENTAGE' and sum(weights.values()) != Decimal('100'):
+        raise ValidationError("Percentages must sum to 100%")
+    if split_type == 'DIRECT' and sum(weights.values()) != amount:
+        raise ValidationError("Direct amounts must sum to the total expense amount")
+
+    rows = []
+    for user_id in participant_ids:
+        if split_type == 'PERCENTAGE':
+            weight = weights.get(user_id, Decimal('0'))
+            share = (weight / Decimal('100')) * amount
+        elif split_type == 'DIRECT':
+            weight = weights.get(user_id, Decimal('0'))
+            share = weight
         else:
-            new_amount = amount - reverse_debt.amount
-            reverse_debt.delete()
-            
-            debt, created = Debt.objects.get_or_create(
-                creditor=creditor,
-                debtor=debtor,
-                group=group,
-                defaults={'amount': new_amount}
-            )
-            
-            if not created:
-                debt.amount += new_amount
-                debt.save()
-            
-            return
-    
-    except Debt.DoesNotExist:
-        # No reverse debt exists, so create or update a direct debt
-        debt, created = Debt.objects.get_or_create(
-            creditor=creditor,
-            debtor=debtor,
-            group=group,
-            defaults={'amount': amount}
+            weight = Decimal('1')
+            share = amount / Decimal(len(participant_ids))
+        rows.append([user_id, str(weight), str(share.quantize(CENT))])
+
+    remainder = amount - sum(Decimal(share) for _, _, share in rows)
+    return {
+        'split_type': split_type,
+        'amount': str(amount),
+        'paid_by': paid_by_id,
+        'participants': rows,
+        'remainder': str(remainder),
+    }
+
+def compile_posted_split_plan(recurring_expense, post, participants):
+    """
+    Compile a recurring expense's split plan from a submitted form onto the
+    unsaved instance, reading each participant's percentage_<id> or amount_<id>
+    field, and check it against the instance before the view saves it.
+    Raises ValidationError with a message for the form.
+    """
+    share_prefix = {'PERCENTAGE': 'percentage', 'DIRECT': 'amount'}.get(recurring_expense.split_type)
+    shares = {}
+    for participant in participants:
+        share_key = f'{share_prefix}_{participant.id}'
+        if share_prefix and share_key in post:
+            shares[participant.id] = post[share_key]
+
+    recurring_expense.split_plan = compile_split_plan(
+        recurring_expense.amount, recurring_expense.split_type, recurring_expense.paid_by_id,
+        [participant.id for participant in participants], shares
+    )
+    recurring_expense.validate_split_plan()
+
+def plan_splits(expense, plan):
+    """Build an expense's Split rows straight from a compiled plan, without parsing shares or looking up participants."""
+    with_percentage = plan['split_type'] == 'PERCENTAGE'
+    return [
+        Split(
+            expense=expense,
+            user_id=user_id,
+            amount_owed=Decimal('0.00') if user_id == expense.paid_by_id else Decimal(share),
+            percentage=Decimal(weight) if with_percentage else None
+        )
+        for user_id, weight, share in plan['participants']
+    ]
+
+def apply_split_plan(expense, plan):
+    """Write an expense's splits from a compiled plan."""
+    return apply_splits(expense, plan_splits(expense, plan))
+
+def recurring_expense_title(recurring_expense):
+    return f"{recurring_expense.title} (Recurring: {recurring_expense.get_frequency_display()})"
+
+def generate_expense_from_recurring(recurring_expense):
+    """Generate a new expense from a recurring expense"""
+    # Raises ValidationError for a plan that no longer matches the expense
+    recurring_expense.validate_split_plan()
+    with transaction.atomic():
+        expense = Expense.objects.create(
+            title=recurring_expense_title(recurring_expense),
+            amount=recurring_expense.amount,
+            paid_by_id=recurring_expense.paid_by_id,
+            group=recurring_expense.group,
+            split_type=recurring_expense.split_type
+        )
+        apply_split_plan(expense, recurring_expense.split_plan)
+        return expense
+
+def generate_recurring_chunk(today, after_id=0, limit=500, group_ids=None):
+    """
+    Generate one expense from each of the next `limit` recurring expenses due by
+    `today` with an id above `after_id` (only in `group_ids` when given).
+    The due rows are locked and read in one query, splits come from their
+    compiled plans, expenses and splits go in with one bulk insert each, every
+    group's ledger and counters take one post for the whole chunk, and the due
+    dates move on with one bulk update.
+    Rows whose plan no longer validates are reported and skipped. If the chunk
+    fails as a whole, its rows are retried one at a time, so one bad row only
+    costs the chunk its bulk writes and the rest still post.
+    Returns (last_id, generated, errors) as plain data, with last_id None when
+    nothing was due, generated a list of (expense title, recurring title) and
+    errors a list of (recurring title, message).
+    """
+    with transaction.atomic():
+        due = RecurringExpense.objects.select_for_update().filter(
+            next_due_date__lte=today, id__gt=after_id
+        ).select_related('group').order_by('id')
+        if group_ids is not None:
+            due = due.filter(group_id__in=group_ids)
+        due = list(due[:limit])
+        if not due:
+            return None, [], []
+
+        ready, errors = [], []
+        for recurring_expense in due:
+            try:
+                recurring_expense.validate_split_plan()
+            except ValidationError as e:
+                errors.append((recurring_expense.title, e.messages[0]))
+            else:
+                ready.append(recurring_expense)
+
+        # generate_recurring_expenses moves the due dates on as it goes
+        due_dates = {recurring_expense.pk: recurring_expense.next_due_date for recurring_expense in ready}
+        try:
+            with transaction.atomic():
+                generate_recurring_expenses(ready)
+            generated = ready
+        except Exception:
+            generated = []
+            for recurring_expense in ready:
+                recurring_expense.next_due_date = due_dates[recurring_expense.pk]
+                try:
+                    with transaction.atomic():
+                        generate_recurring_expenses([recurring_expense])
+                except Exception as e:
+                    errors.append((recurring_expense.title, str(e)))
+                else:
+                    generated.append(recurring_expense)
+
+    generated = [
+        (recurring_expense_title(recurring_expense), recurring_expense.title)
+        for recurring_expense in generated
+    ]
+    return due[-1].id, generated, errors
+
+def generate_recurring_expenses(recurring_expenses):
+    """Bulk-write one expense per (validated) recurring expense, see generate_recurring_chunk."""
+    expenses = Expense.objects.bulk_create([
+        Expense(
+            title=recurring_expense_title(recurring_expense),
+            amount=recurring_expense.amount,
+            paid_by_id=recurring_expense.paid_by_id,
+            group_id=recurring_expense.group_id,
+            split_type=recurring_expense.split_type
         )
-        
-        if not created:
-            debt.amount += amount
-            debt.save()
\ No newline at end of file
+        for recurring_expense in recurring_expenses
+    ])
+
+    splits, deltas, paid, counters, groups = [], {}, {}, {}, {}
+    for recurring_expense, expense in zip(recurring_expenses, expenses):
+        expense_splits = plan_splits(expense, recurring_expense.split_plan)
+        splits.extend(expense_splits)
+
+        group_id = expense.group_id
+        groups[group_id] = recurring_expense.group
+        group_deltas = deltas.setdefault(group_id, {})
+        for key, amount in split_deltas(expense, expense_splits).items():
+            group_deltas[key] = group_deltas.get(key, Decimal('0.00')) + amount
+        group_paid = paid.setdefault(group_id, {})
+        group_paid[expense.paid_by_id] = group_paid.get(expense.paid_by_id, Decimal('0.00')) + expense.amount
+        count, spent = counters.get(group_id, (0, Decimal('0.00')))
+        counters[group_id] = (count + 1, spent + expense.amount)
+
+        recurring_expense.next_due_date = following_due_date(recurring_expense.next_due_date, recurring_expense.frequency)
+
+    Split.objects.bulk_create(splits, batch_size=1000)
+
+    # One ledger post and one counter update per group in the chunk
+    for group_id, group in groups.items():
+        count, spent = counters[group_id]
+        adjust_group_counters(group_id, expenses=count, spent=spent)
+        post_debt_deltas(group, deltas[group_id], paid[group_id])
+
+    RecurringExpense.objects.bulk_update(recurring_expenses, ['next_due_date'], batch_size=500)
+    return expenses
+
+def following_due_date(current_date, frequency):
+    """The due date one period after `current_date`."""
+    if frequency == 'DAILY':
+        return current_date + timezone.timedelta(days=1)
+    elif frequency == 'WEEKLY':
+        return current_date + timezone.timedelta(weeks=1)
+    elif frequency == 'MONTHLY':
+        # Add one month (handle month boundaries)
+        month = current_date.month + 1
+        year = current_date.year
+        if month > 12:
+            month = 1
+            year += 1
+
+        # Handle different month lengths
+        day = min(current_date.day, [31, 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month-1])
+        return timezone.datetime(year, month, day).date()
+    else:
+        # Default to one month if frequency is unknown
+        return current_date + timezone.timedelta(days=30)
+
+def update_next_due_date(recurring_expense):
+    """Update the next due date based on frequency"""
+    recurring_expense.next_due_date = following_due_date(recurring_expense.next_due_date, recurring_expense.frequency)
+    recurring_expense.save(update_fields=['next_due_date'])
+
+def drain_ledger_queue(group_ids=None, limit=1000):
+    """
+    Apply up to `limit` queued ledger changes, oldest first.
+    Every change for the same (creditor, debtor, group) is merged first, so each
+    pair gets a single ledger write however many expenses touched it.
+    Returns the number of queue entries applied.
+    """
+    with transaction.atomic():
+        entries = LedgerQueueEntry.objects.order_by('id')
+        if group_ids is not None:
+            entries = entries.filter(group_id__in=group_ids)
+        if connection.features.has_select_for_update_skip_locked:
+            # Lets several drain workers run side by side without claiming the same rows
+            entries = entries.select_for_update(skip_locked=True)
+        entries = list(entries.values_list('id', 'group_id', 'creditor_id', 'debtor_id', 'amount')[:limit])
+
+        if not entries:
+            return 0
+
+        deltas, paid = {}, {}
+        for _, group_id, creditor_id, debtor_id, amount in entries:
+            if debtor_id is None:
+                group_paid = paid.setdefault(group_id, {})
+                group_paid[creditor_id] = group_paid.get(creditor_id, Decimal('0.00')) + amount
+            else:
+                group_deltas = deltas.setdefault(group_id, {})
+                key = (creditor_id, debtor_id)
+                group_deltas[key] = group_deltas.get(key, Decimal('0.00')) + amount
+
+        groups = Group.objects.in_bulk(set(deltas) | set(paid))
+        for group_id, group in groups.items():
+            apply_debt_deltas(group, deltas.get(group_id, {}), paid=paid.get(group_id))
+
+        LedgerQueueEntry.objects.filter(id__in=[entry[0] for entry in entries]).delete()
+    return len(entries)
+
+def remember_pending_ledger_writes(request, group):
+    """Note in the session that this user has queued changes for a group."""
+    if getattr(settings, 'LEDGER_ASYNC_POSTING', False):
+        pending = set(request.session.get('pending_ledger_groups', []))
+        pending.add(group.id)
+        request.session['pending_ledger_groups'] = sorted(pending)
+
+def flush_pending_ledger_writes(request):
+    """
+    Read-your-writes: apply the queued changes of the groups this user just posted to,
+    so their own pages never show balances from before their post.
+    """
+    group_ids = request.session.pop('pending_ledger_groups', None)
+    if group_ids:
+        while drain_ledger_queue(group_ids=group_ids):
+            pass
+
@@ -30,7 +30,8 @@ class ExpenseForm(forms.ModelForm):
             self.fields['paid_by'].initial = user
             
             # Set initial participants to all group members except the user
-            if 'group' in self.initial:
+            # (an existing expense pre-selects its own participants instead)
+            if 'group' in self.initial and self.instance.pk is None:
                 group = self.initial['group']
                 self.fields['participants'].initial = group.members.exclude(id=user.id)
         
@@ -0,0 +1,462 @@
+"""
+Pairwise balance ledger.
+
+PairBalance holds one signed row per unordered user pair per group and is the
+source of truth for who owes whom. Payments are posted to it as debts in the
+opposite direction, so it always holds debts minus payments. Debt rows are kept
+as a mirror of the ledger so the existing Debt-based views keep working
+unchanged, and MemberBalance is a
+per-user projection that the dashboard and group pages read directly. UserStats
+sums each user's MemberBalance rows across groups for the profile page.
+"""
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.db import connection, models
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Group, Debt, Payment, PaymentArchive, PairBalance, MemberBalance, UserStats, LedgerQueueEntry
+from .settlement_engine import settle_balances, to_cents, from_cents
+
+CENT = Decimal('0.01')
+
+# Rows per INSERT statement, keeps us well under SQLite's bound parameter limit
+UPSERT_BATCH_SIZE = 150
+
+
+def net_pair_changes(deltas):
+    """
+    Fold (creditor_id, debtor_id) -> amount changes onto unordered pairs.
+    Returns {(low_id, high_id): signed amount}, positive when high owes low.
+    """
+    net_changes = {}
+    for (creditor_id, debtor_id), amount in deltas.items():
+        if creditor_id == debtor_id or not amount:
+            continue
+        pair = (min(creditor_id, debtor_id), max(creditor_id, debtor_id))
+        signed = amount if creditor_id == pair[0] else -amount
+        net_changes[pair] = net_changes.get(pair, Decimal('0.00')) + signed
+    return {pair: change for pair, change in net_changes.items() if change}
+
+def post_pair_changes(group, net_changes):
+    """
+    Add signed changes to the ledger with atomic upserts.
+    Every pair is a single INSERT ... ON CONFLICT increment regardless of the
+    direction of the debt, and many pairs share one statement.
+    Returns {(low_id, high_id): new signed balance}.
+    """
+    if not net_changes:
+        return {}
+
+    table = connection.ops.quote_name(PairBalance._meta.db_table)
+    now = timezone.now()
+    balances = {}
+    # Sorted so concurrent writers always lock pairs in the same order
+    pairs = sorted(net_changes)
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(pairs), UPSERT_BATCH_SIZE):
+            batch = pairs[start:start + UPSERT_BATCH_SIZE]
+            placeholders = ', '.join(['(%s, %s, %s, %s, %s)'] * len(batch))
+            params = []
+            for low, high in batch:
+                params.extend([group.id, low, high, net_changes[(low, high)], now])
+
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (group_id, low_user_id, high_user_id, amount, updated_at)
+                VALUES {placeholders}
+                ON CONFLICT (group_id, low_user_id, high_user_id)
+                DO UPDATE SET amount = {table}.amount + excluded.amount,
+                              updated_at = excluded.updated_at
+                RETURNING low_user_id, high_user_id, amount
+                """,
+                params
+            )
+            for low, high, amount in cursor.fetchall():
+                balances[(low, high)] = Decimal(str(amount)).quantize(CENT)
+
+    return balances
+
+def sync_debts(group, balances):
+    """
+    Bring the open Debt rows in line with new ledger balances for the given pairs.
+    Uses one read plus at most one bulk update, one delete and one bulk insert.
+    A pair whose balance reaches zero has its open row removed.
+    """
+    if not balances:
+        return
+
+    user_ids = {user_id for pair in balances for user_id in pair}
+    existing = {}
+    open_debts = Debt.objects.filter(
+        group=group,
+        is_settled=False,
+        creditor_id__in=user_ids,
+        debtor_id__in=user_ids
+    )
+    for debt in open_debts:
+        pair = (min(debt.creditor_id, debt.debtor_id), max(debt.creditor_id, debt.debtor_id))
+        if pair in balances:
+            existing.setdefault(pair, []).append(debt)
+
+    now = timezone.now()
+    to_update, to_delete, to_create = [], [], []
+    for pair, balance in balances.items():
+        creditor_id, debtor_id = pair if balance > 0 else (pair[1], pair[0])
+        forward = None
+
+        for debt in existing.get(pair, []):
+            if balance and debt.creditor_id == creditor_id:
+                forward = debt
+            else:
+                to_delete.append(debt.pk)
+
+        if not balance:
+            continue
+
+        if forward is not None:
+            forward.amount = abs(balance)
+            forward.updated_at = now
+            to_update.append(forward)
+        else:
+            to_create.append(Debt(
+                creditor_id=creditor_id,
+                debtor_id=debtor_id,
+                group=group,
+                amount=abs(balance)
+            ))
+
+    if to_update:
+        Debt.objects.bulk_update(to_update, ['amount', 'updated_at'])
+    if to_delete:
+        Debt.objects.filter(pk__in=to_delete).delete()
+    if to_create:
+        Debt.objects.bulk_create(to_create)
+
+def member_changes_for_pairs(net_changes, balances):
+    """
+    Work out how owed / to_receive move for each user when pair balances change.
+    Takes the signed changes posted and the resulting balances from post_pair_changes.
+    Returns {user_id: {'owed': delta, 'to_receive': delta}}.
+    """
+    zero = Decimal('0.00')
+    changes = {}
+    for (low, high), new in balances.items():
+        old = new - net_changes[(low, high)]
+        # Positive balances are owed to low by high, negative ones to high by low
+        low_gain = max(new, zero) - max(old, zero)
+        high_gain = max(-new, zero) - max(-old, zero)
+
+        low_row = changes.setdefault(low, {'owed': zero, 'to_receive': zero})
+        high_row = changes.setdefault(high, {'owed': zero, 'to_receive': zero})
+        low_row['to_receive'] += low_gain
+        low_row['owed'] += high_gain
+        high_row['to_receive'] += high_gain
+        high_row['owed'] += low_gain
+    return changes
+
+def post_member_changes(group, changes):
+    """
+    Add paid / owed / to_receive changes to the MemberBalance projection.
+    `changes` maps user_id to a dict with any of those keys; net follows from the others.
+    All users are written with a single upsert per batch.
+    """
+    zero = Decimal('0.00')
+    rows = []
+    for user_id, change in sorted(changes.items()):
+        paid = change.get('paid', zero)
+        owed = change.get('owed', zero)
+        to_receive = change.get('to_receive', zero)
+        if paid or owed or to_receive:
+            rows.append((user_id, paid, owed, to_receive, to_receive - owed))
+
+    if not rows:
+        return
+
+    table = connection.ops.quote_name(MemberBalance._meta.db_table)
+    now = timezone.now()
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(batch))
+            params = []
+            for row in batch:
+                params.extend([group.id, *row, now])
+
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (group_id, user_id, paid, owed, to_receive, net, updated_at)
+                VALUES {placeholders}
+                ON CONFLICT (group_id, user_id)
+                DO UPDATE SET paid = {table}.paid + excluded.paid,
+                              owed = {table}.owed + excluded.owed,
+                              to_receive = {table}.to_receive + excluded.to_receive,
+                              net = {table}.net + excluded.net,
+                              updated_at = excluded.updated_at
+                """,
+                params
+            )
+
+    post_user_stats_changes({
+        user_id: {'paid': paid, 'owed': owed, 'to_receive': to_receive}
+        for user_id, paid, owed, to_receive, _ in rows
+    })
+
+def post_user_stats_changes(changes):
+    """
+    Add paid / owed / to_receive / settled changes to each user's UserStats row
+    and mark them as active now. One upsert per batch, like post_member_changes.
+    """
+    zero = Decimal('0.00')
+    rows = [
+        (user_id, change.get('paid', zero), change.get('owed', zero),
+         change.get('to_receive', zero), change.get('settled', 0))
+        for user_id, change in sorted(changes.items())
+    ]
+    if not rows:
+        return
+
+    table = connection.ops.quote_name(UserStats._meta.db_table)
+    now = timezone.now()
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(batch))
+            params = []
+            for row in batch:
+                params.extend([*row, now])
+
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (user_id, total_paid, owed, to_receive, settled_debt_count, last_activity)
+                VALUES {placeholders}
+                ON CONFLICT (user_id)
+                DO UPDATE SET total_paid = {table}.total_paid + excluded.total_paid,
+                              owed = {table}.owed + excluded.owed,
+                              to_receive = {table}.to_receive + excluded.to_receive,
+                              settled_debt_count = {table}.settled_debt_count + excluded.settled_debt_count,
+                              last_activity = excluded.last_activity
+                """,
+                params
+            )
+
+def refresh_user_stats(user_ids):
+    """
+    Recompute UserStats for the given users from their MemberBalance rows and
+    payments (archived ones included), for use after figures were rewritten wholesale.
+    last_activity becomes the latest change to any of their balances.
+    """
+    zero = models.Value(Decimal('0.00'), output_field=models.DecimalField())
+    users = User.objects.filter(pk__in=user_ids).annotate(
+        total_paid=Coalesce(models.Sum('member_balances__paid'), zero),
+        owed=Coalesce(models.Sum('member_balances__owed'), zero),
+        to_receive=Coalesce(models.Sum('member_balances__to_receive'), zero),
+        last_activity=models.Max('member_balances__updated_at'),
+        # Subqueries, a second join would multiply the sums above
+        settled_debt_count=Coalesce(models.Subquery(
+            Payment.objects.filter(payer=models.OuterRef('pk'))
+            .values('payer').annotate(total=models.Count('id')).values('total')
+        ), 0) + Coalesce(models.Subquery(
+            PaymentArchive.objects.filter(payer=models.OuterRef('pk'))
+            .values('payer').annotate(total=models.Count('id')).values('total')
+        ), 0),
+    )
+    fields = ['total_paid', 'owed', 'to_receive', 'settled_debt_count', 'last_activity']
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=user.pk, **{field: getattr(user, field) for field in fields}) for user in users],
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=fields,
+        batch_size=500,
+    )
+
+def member_totals(balances, paid):
+    """
+    Build full MemberBalance values from pair balances and paid totals.
+    Returns {user_id: {'paid', 'owed', 'to_receive', 'net'}}.
+    """
+    zero = Decimal('0.00')
+    totals = {}
+    for user_id, change in member_changes_for_pairs(balances, balances).items():
+        totals[user_id] = {'paid': zero, **change}
+    for user_id, amount in paid.items():
+        totals.setdefault(user_id, {'paid': zero, 'owed': zero, 'to_receive': zero})['paid'] = amount
+    for row in totals.values():
+        row['net'] = row['to_receive'] - row['owed']
+    return totals
+
+def open_debts_of(user):
+    """
+    Q for the user's open debts on either side. The open condition is repeated in
+    both branches, which is what lets SQLite serve each one from its partial index.
+    """
+    return models.Q(creditor=user, is_settled=False) | models.Q(debtor=user, is_settled=False)
+
+def group_member_balances(group):
+    """
+    Every member's paid / owed / to_receive / net figures for a group from a single query.
+    Members are joined to their MemberBalance row, so there is no per-member aggregate,
+    and members without a row yet come back as zeros.
+    Former members who still owe or are owed money are included too, with
+    is_member False, so the nets always add up to zero.
+    Returns {user: {'paid', 'owed', 'to_receive', 'net_balance', 'is_member'}} in user order.
+    """
+    zero = models.Value(Decimal('0.00'), output_field=models.DecimalField())
+    membership = Group.members.through.objects.filter(group_id=group.id)
+    holders = MemberBalance.objects.filter(group_id=group.id).exclude(net=0)
+    users = User.objects.filter(
+        models.Q(pk__in=membership.values('user_id')) | models.Q(pk__in=holders.values('user_id'))
+    ).annotate(
+        balance=models.FilteredRelation('member_balances', condition=models.Q(member_balances__group=group)),
+    ).annotate(
+        paid=Coalesce('balance__paid', zero),
+        owed=Coalesce('balance__owed', zero),
+        to_receive=Coalesce('balance__to_receive', zero),
+        net_balance=Coalesce('balance__net', zero),
+        is_member=models.Exists(membership.filter(user_id=models.OuterRef('pk'))),
+    ).order_by('id')
+    return {
+        user: {
+            'paid': user.paid,
+            'owed': user.owed,
+            'to_receive': user.to_receive,
+            'net_balance': user.net_balance,
+            'is_member': user.is_member,
+        }
+        for user in users
+    }
+
+def build_settlement_plan(member_balances):
+    """
+    Turn net balances from group_member_balances into the fewest payments that
+    settle the group, worked out in whole cents by the settlement engine.
+    Returns a list of {'from_user', 'to_user', 'amount'}, largest payments first.
+    """
+    payments = settle_balances({
+        member: to_cents(row['net_balance']) for member, row in member_balances.items()
+    })
+    return [
+        {'from_user': payer, 'to_user': payee, 'amount': from_cents(cents)}
+        for payer, payee, cents in sorted(payments, key=lambda payment: -payment[2])
+    ]
+
+def replace_group_ledger(group_id, balances, paid):
+    """
+    Overwrite a group's pair balances, open debts and member projection wholesale.
+    `balances` is {(low_id, high_id): signed amount} and `paid` is {user_id: total paid}.
+    Payments are left untouched, and queued changes are dropped because the
+    recomputed figures already include them. Stats of the affected users are recomputed.
+    """
+    balances = {pair: amount for pair, amount in balances.items() if amount}
+    user_ids = set(MemberBalance.objects.filter(group_id=group_id).values_list('user_id', flat=True))
+
+    LedgerQueueEntry.objects.filter(group_id=group_id).delete()
+
+    PairBalance.objects.filter(group_id=group_id).delete()
+    PairBalance.objects.bulk_create([
+        PairBalance(group_id=group_id, low_user_id=low, high_user_id=high, amount=amount)
+        for (low, high), amount in balances.items()
+    ], batch_size=1000)
+
+    Debt.objects.filter(group_id=group_id, is_settled=False).delete()
+    Debt.objects.bulk_create([
+        Debt(
+            group_id=group_id,
+            creditor_id=low if amount > 0 else high,
+            debtor_id=high if amount > 0 else low,
+            amount=abs(amount)
+        )
+        for (low, high), amount in balances.items()
+    ], batch_size=1000)
+
+    totals = member_totals(balances, paid)
+    MemberBalance.objects.filter(group_id=group_id).delete()
+    MemberBalance.objects.bulk_create([
+        MemberBalance(group_id=group_id, user_id=user_id, **values)
+        for user_id, values in totals.items()
+    ], batch_size=1000)
+
+    refresh_user_stats(user_ids | set(totals))
+
+def clear_group_balances(group_id):
+    """
+    Settle every open balance in a group with a fixed number of statements,
+    however many expenses or pairs are behind them: every open debt is paid with
+    a Payment, pair balances are dropped and members' owed / to_receive / net go
+    to zero (paid is lifetime spending and stays). UserStats follow the same
+    change. Run it inside a transaction, with the group's queue already drained.
+    Returns the number of payments recorded.
+    """
+    now = timezone.now()
+    zero = models.Value(Decimal('0.00'), output_field=models.DecimalField())
+
+    # Stats first, while the member rows and open debts still hold what is being cleared
+    member_row = MemberBalance.objects.filter(group_id=group_id, user_id=models.OuterRef('user_id'))
+    settled_count = Debt.objects.filter(
+        group_id=group_id, debtor_id=models.OuterRef('user_id'), is_settled=False
+    ).values('debtor_id').annotate(total=models.Count('id')).values('total')
+    UserStats.objects.filter(
+        user_id__in=MemberBalance.objects.filter(group_id=group_id).values('user_id')
+    ).update(
+        owed=models.F('owed') - Coalesce(models.Subquery(member_row.values('owed')), zero),
+        to_receive=models.F('to_receive') - Coalesce(models.Subquery(member_row.values('to_receive')), zero),
+        settled_debt_count=models.F('settled_debt_count') + Coalesce(models.Subquery(settled_count), 0),
+        last_activity=now,
+    )
+
+    # One payment per open debt, copied across by the database in a single statement
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {connection.ops.quote_name(Payment._meta.db_table)} (payer_id, payee_id, group_id, amount, created_at)
+            SELECT debtor_id, creditor_id, group_id, amount, %s
+            FROM {connection.ops.quote_name(Debt._meta.db_table)}
+            WHERE group_id = %s AND is_settled = %s
+            """,
+            [now, group_id, False]
+        )
+        settled = cursor.rowcount
+    Debt.objects.filter(group_id=group_id, is_settled=False).delete()
+    PairBalance.objects.filter(group_id=group_id).delete()
+    MemberBalance.objects.filter(group_id=group_id).update(
+        owed=Decimal('0.00'), to_receive=Decimal('0.00'), net=Decimal('0.00'), updated_at=now
+    )
+    return settled
+
+def enqueue_changes(group, deltas, paid=None):
+    """
+    Queue debt and paid changes for the drain worker instead of applying them now.
+    Takes the same arguments as apply_debt_deltas and writes them with one bulk insert.
+    """
+    entries = [
+        LedgerQueueEntry(group=group, creditor_id=creditor_id, debtor_id=debtor_id, amount=amount)
+        for (creditor_id, debtor_id), amount in deltas.items()
+        if amount and creditor_id != debtor_id
+    ]
+    entries.extend(
+        LedgerQueueEntry(group=group, creditor_id=user_id, amount=amount)
+        for user_id, amount in (paid or {}).items()
+        if amount
+    )
+    LedgerQueueEntry.objects.bulk_create(entries)
+
+def ledger_lag():
+    """
+    Report how far the ledger is behind the posting queue.
+    Returns the number of pending entries, the groups they touch and the age of the oldest one.
+    """
+    pending = LedgerQueueEntry.objects.aggregate(
+        entries=models.Count('id'),
+        groups=models.Count('group', distinct=True),
+        oldest=models.Min('created_at')
+    )
+    oldest = pending['oldest']
+    return {
+        'entries': pending['entries'],
+        'groups': pending['groups'],
+        'oldest': oldest,
+        'seconds': (timezone.now() - oldest).total_seconds() if oldest else 0,
+    }
+
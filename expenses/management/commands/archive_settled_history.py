@@ -0,0 +1,60 @@
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from expenses.archive import ARCHIVE_BATCH_SIZE, archive_payments, archive_settled_splits, settled_expenses
+from expenses.models import Payment, Split
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Move payments older than --days, and the splits of fully settled expenses '
+        'older than that, into the archive tables in batches. Balances are unchanged.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=getattr(settings, 'ARCHIVE_AFTER_DAYS', 365),
+            help='Archive history older than this many days',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=ARCHIVE_BATCH_SIZE,
+            help='Payments or expenses moved per transaction',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would be archived',
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['batch_size'] < 1:
+            raise CommandError("--days can't be negative and --batch-size must be at least 1")
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        if options['dry_run']:
+            payments = Payment.objects.filter(created_at__lt=cutoff).count()
+            splits = Split.objects.filter(expense__in=settled_expenses(cutoff)).count()
+            self.stdout.write(
+                f"Would archive {payments} payments and {splits} splits from before {cutoff:%Y-%m-%d}"
+            )
+            return
+
+        start = time.perf_counter()
+        payments = archive_payments(cutoff, options['batch_size'])
+        splits = archive_settled_splits(cutoff, options['batch_size'])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {payments} payments and {splits} splits from before {cutoff:%Y-%m-%d} in {elapsed:.1f}s"
+        ))
+        logger.info(f"Archived {payments} payments and {splits} splits older than {options['days']} days")
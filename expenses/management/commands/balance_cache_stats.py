@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from expenses.balance_cache import cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Report hits and misses of the balance cache. Counters live in the cache itself, '
+        'so with the per-process local memory cache only this process is counted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Reset the counters after reporting them',
+        )
+
+    def handle(self, *args, **options):
+        stats = cache_stats()
+        lookups = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / lookups if lookups else 0
+        self.stdout.write(
+            f"Hits: {stats['hits']}  Misses: {stats['misses']}  Hit ratio: {ratio:.1%}"
+        )
+
+        if options['reset']:
+            reset_cache_stats()
+            self.stdout.write(self.style.SUCCESS("Counters reset"))
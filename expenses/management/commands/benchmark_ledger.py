@@ -0,0 +1,62 @@
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from expenses.models import Group, Expense
+from expenses.expense_utils import handle_equal_split
+
+class Command(BaseCommand):
+    help = 'Benchmark query count and latency of posting expenses as groups grow'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--participants',
+            type=int,
+            nargs='+',
+            default=[2, 5, 10, 20, 40, 80],
+            help='Participant counts to benchmark',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Expenses posted per participant count',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'participants':>12} {'queries':>8} {'ms/expense':>11}")
+
+        for count in options['participants']:
+            queries, elapsed = self.benchmark_splits(count, options['repeat'])
+            self.stdout.write(f"{count:>12} {queries:>8} {elapsed * 1000:>11.2f}")
+
+    def benchmark_splits(self, count, repeat):
+        """Post `repeat` equal-split expenses into a fresh group and roll everything back."""
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=f'bench_{count}_{i}') for i in range(count)
+            ])
+            group = Group.objects.create(name=f'Benchmark {count}', admin=users[0])
+            group.members.add(*users)
+
+            queries = 0
+            start = time.perf_counter()
+            for i in range(repeat):
+                payer = users[i % count]
+                with CaptureQueriesContext(connection) as captured:
+                    expense = Expense.objects.create(
+                        title=f'Benchmark expense {i}',
+                        amount=Decimal('100.00'),
+                        paid_by=payer,
+                        group=group,
+                        split_type='EQUAL'
+                    )
+                    handle_equal_split(expense, users)
+                queries = max(queries, len(captured))
+            elapsed = (time.perf_counter() - start) / repeat
+
+            transaction.set_rollback(True)
+
+        return queries, elapsed
@@ -0,0 +1,123 @@
+import random
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from expenses.settlement_engine import settle_balances, EXACT_LIMIT
+
+
+def simulate_balances(members, expenses_per_member, rng):
+    """
+    Net cents per member after random expenses split equally among 2-4 people.
+    Most expenses stay within a circle of four friends, as they do in real groups,
+    which is what gives the exact search zero-sum subsets to find.
+    """
+    balances = [0] * members
+    for _ in range(members * expenses_per_member):
+        if rng.random() < 0.9:
+            circle = rng.randrange(0, members, 4)
+            people = list(range(circle, min(circle + 4, members)))
+        else:
+            people = list(range(members))
+        participants = rng.sample(people, min(len(people), rng.randint(2, 4)))
+        if len(participants) < 2:
+            continue
+        payer = participants[0]
+        amount = rng.randint(1, 200) * 100
+        share, remainder = divmod(amount, len(participants))
+        for position, participant in enumerate(participants):
+            # The payer absorbs the rounding, as the split handlers do
+            balances[participant] -= share + (remainder if position == 0 else 0)
+        balances[payer] += amount
+    return dict(enumerate(balances))
+
+def greedy_payments(balances):
+    """The previous two-pointer plan, kept as the baseline to compare against."""
+    debtors = sorted(([-cents, key] for key, cents in balances.items() if cents < 0), reverse=True)
+    creditors = sorted(([cents, key] for key, cents in balances.items() if cents > 0), reverse=True)
+    payments = []
+    i, j = 0, 0
+    while i < len(debtors) and j < len(creditors):
+        cents = min(debtors[i][0], creditors[j][0])
+        payments.append((debtors[i][1], creditors[j][1], cents))
+        debtors[i][0] -= cents
+        creditors[j][0] -= cents
+        if not debtors[i][0]:
+            i += 1
+        if not creditors[j][0]:
+            j += 1
+    return payments
+
+def leftover(balances, payments):
+    """Total cents still unsettled after the payments, zero for a correct plan."""
+    remaining = dict(balances)
+    for payer, payee, cents in payments:
+        remaining[payer] += cents
+        remaining[payee] -= cents
+    return sum(abs(cents) for cents in remaining.values())
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the settlement engine on simulated groups, comparing payment counts '
+        'with the old greedy plan and checking that every plan settles to the cent.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[5, 10, 14, 100, 1000, 10000],
+            help='Group sizes (members) to benchmark',
+        )
+        parser.add_argument(
+            '--trials',
+            type=int,
+            default=5,
+            help='Simulated groups per size',
+        )
+        parser.add_argument(
+            '--expenses',
+            type=int,
+            default=3,
+            help='Expenses simulated per member',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed, so runs can be compared',
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        self.stdout.write(
+            f"{'members':>8} {'method':>10} {'payments':>9} {'greedy':>8} {'ms':>9} {'greedy ms':>10}"
+        )
+
+        for size in options['sizes']:
+            payments = greedy = elapsed = greedy_elapsed = 0
+            for _ in range(options['trials']):
+                balances = simulate_balances(size, options['expenses'], rng)
+
+                start = time.perf_counter()
+                plan = settle_balances(balances)
+                elapsed += time.perf_counter() - start
+
+                start = time.perf_counter()
+                baseline = greedy_payments(balances)
+                greedy_elapsed += time.perf_counter() - start
+
+                if leftover(balances, plan):
+                    raise CommandError(f"Plan for {size} members leaves {leftover(balances, plan)} cents unsettled")
+                payments += len(plan)
+                greedy += len(baseline)
+
+            trials = options['trials']
+            method = 'exact' if size <= getattr(settings, 'SETTLEMENT_EXACT_LIMIT', EXACT_LIMIT) else 'heap'
+            self.stdout.write(
+                f"{size:>8} {method:>10} {payments / trials:>9.1f} {greedy / trials:>8.1f} "
+                f"{elapsed / trials * 1000:>9.2f} {greedy_elapsed / trials * 1000:>10.2f}"
+            )
+
+        self.stdout.write(self.style.SUCCESS("Every plan settled all balances to the cent"))
@@ -0,0 +1,72 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from expenses.query_budgets import PAGE_QUERY_BUDGETS as PAGES, build_query_fixture
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark page load times and query counts against growing amounts of data, '
+        'e.g. --sizes 10 100 1000 for users in up to 1,000 groups. The budgets are '
+        'enforced by the test suite; this reports them for sizes the tests don\'t reach. '
+        'Everything is rolled back afterwards, and the pages cache their balances in a '
+        'throwaway in-memory cache so nothing of the fixture is left in the real one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[1, 10, 50],
+            help='Groups (and counterparties) per user to check with',
+        )
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['sizes'])
+        counts = {name: [] for name, _, _ in PAGES}
+        timings = {name: [] for name, _, _ in PAGES}
+
+        # The rollback can't undo cache writes, so keep them out of the shared cache
+        alias = getattr(settings, 'BALANCE_CACHE_ALIAS', 'default')
+        throwaway_caches = {
+            **settings.CACHES,
+            alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'query-budgets'},
+        }
+
+        with override_settings(ALLOWED_HOSTS=['testserver'], CACHES=throwaway_caches):
+            for size in sizes:
+                with transaction.atomic():
+                    fixture = build_query_fixture(size)
+                    client = Client()
+                    client.force_login(fixture['user'])
+                    for name, url, _ in PAGES:
+                        # First load warms the session, the second one is measured
+                        client.get(url(fixture))
+                        start = time.perf_counter()
+                        with CaptureQueriesContext(connection) as captured:
+                            response = client.get(url(fixture))
+                        timings[name].append(time.perf_counter() - start)
+                        if response.status_code != 200:
+                            raise CommandError(f"{name} returned {response.status_code} at size {size}")
+                        counts[name].append(len(captured))
+                    transaction.set_rollback(True)
+
+        self.stdout.write(f"{'queries':<28}" + ''.join(f"{size:>8}" for size in sizes))
+        failures = []
+        for name, _, budget in PAGES:
+            self.stdout.write(f"{name:<28}" + ''.join(f"{count:>8}" for count in counts[name]))
+            if max(counts[name]) > counts[name][0]:
+                failures.append(f"{name} query count grows with data: {counts[name]}")
+            if max(counts[name]) > budget:
+                failures.append(f"{name} takes {max(counts[name])} queries, budget is {budget}")
+
+        self.stdout.write(f"{'ms per load':<28}" + ''.join(f"{size:>8}" for size in sizes))
+        for name, _, _ in PAGES:
+            self.stdout.write(f"{name:<28}" + ''.join(f"{elapsed * 1000:>8.1f}" for elapsed in timings[name]))
+
+        if failures:
+            raise CommandError('\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS("All pages are within their query budgets"))
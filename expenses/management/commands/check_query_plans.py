@@ -0,0 +1,106 @@
+import re
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from expenses.models import Expense, Split, SplitArchive, Debt, Payment, PaymentArchive, PairBalance, MemberBalance
+from expenses.archive import user_expenses_filter
+from expenses.ledger import open_debts_of
+
+# Any ids do, EXPLAIN only looks at the shape of the query
+USER_ID, OTHER_ID, GROUP_IDS = 1, 2, [1, 2]
+
+# The hot queries, written the way the views and the ledger build them
+QUERIES = [
+    ('open debt groups (user_group_ids)', lambda: Debt.objects.filter(
+        open_debts_of(USER_ID)
+    ).values('group_id')),
+    ('open debts in groups (user_group_summaries)', lambda: Debt.objects.filter(
+        open_debts_of(USER_ID), group_id__in=GROUP_IDS
+    ).select_related('creditor', 'debtor', 'group')),
+    ('dashboard counterparties', lambda: Debt.objects.filter(
+        open_debts_of(USER_ID)
+    ).values('creditor_id', 'debtor_id', 'amount')),
+    ('debts outside groups (settlement_summary)', lambda: Debt.objects.filter(
+        open_debts_of(USER_ID)
+    ).exclude(group_id__in=GROUP_IDS).select_related('creditor', 'debtor', 'group')),
+    ('group debts with a user (settle_up)', lambda: Debt.objects.filter(
+        open_debts_of(USER_ID), group_id=GROUP_IDS[0]
+    ).select_related('creditor', 'debtor', 'expense', 'group')),
+    ('group debts (group_detail)', lambda: Debt.objects.filter(
+        group_id=GROUP_IDS[0], is_settled=False
+    ).select_related('debtor', 'creditor')),
+    ('pair debts (sync_debts)', lambda: Debt.objects.filter(
+        group_id=GROUP_IDS[0], is_settled=False, creditor_id__in=[USER_ID, OTHER_ID], debtor_id__in=[USER_ID, OTHER_ID]
+    )),
+    ('pair debt (settle_payment)', lambda: Debt.objects.filter(
+        debtor_id=USER_ID, creditor_id=OTHER_ID, group_id=GROUP_IDS[0], is_settled=False
+    ).order_by('updated_at', 'id')),
+    ('pair balances (post_pair_changes)', lambda: PairBalance.objects.filter(
+        group_id=GROUP_IDS[0], low_user_id=USER_ID, high_user_id=OTHER_ID
+    )),
+    ('member balances (user_group_summaries)', lambda: MemberBalance.objects.filter(
+        user_id=USER_ID, group_id__in=GROUP_IDS
+    )),
+    ('payments made (refresh_user_stats)', lambda: Payment.objects.filter(payer_id=USER_ID).values('payer').order_by()),
+    ('group payments (rebuild_ledger)', lambda: Payment.objects.filter(group_id__in=GROUP_IDS).order_by()),
+    ('group splits (rebuild_ledger)', lambda: Split.objects.filter(
+        expense__group_id__in=GROUP_IDS
+    ).order_by('expense__group_id').values_list('expense__group_id', 'expense__paid_by_id', 'user_id', 'amount_owed')),
+    ('recent expenses (user_profile)', lambda: Expense.objects.filter(
+        user_expenses_filter(USER_ID)
+    ).order_by('-created_at')[:5]),
+    ('archived payments made (refresh_user_stats)', lambda: PaymentArchive.objects.filter(
+        payer_id=USER_ID
+    ).values('payer').order_by()),
+    ('archived splits of expenses (attach_splits)', lambda: SplitArchive.objects.filter(
+        expense_id__in=GROUP_IDS
+    ).select_related('user')),
+    ('archive horizon', lambda: SplitArchive.objects.order_by('-created_at').values_list('created_at')[:1]),
+]
+
+# "SCAN table" without an index is SQLite reading every row of the table.
+# SCAN ... USING INDEX walks an index (for ordering) and is allowed.
+FULL_SCAN = re.compile(r'\bSCAN (\w+)$')
+
+
+def full_scans(plan):
+    """Tables the plan reads in full, from the text QuerySet.explain() returns on SQLite."""
+    tables = []
+    for line in plan.splitlines():
+        match = FULL_SCAN.search(line.strip())
+        if match:
+            tables.append(match.group(1))
+    return tables
+
+
+class Command(BaseCommand):
+    help = (
+        'Run EXPLAIN QUERY PLAN on the hot balance and settlement queries and fail '
+        'if any of them falls back to a full table scan. SQLite only.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--show',
+            action='store_true',
+            help='Print every query plan, not just the failing ones',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError(f"Query plans are only checked on SQLite, not {connection.vendor}")
+
+        failures = []
+        for name, build in QUERIES:
+            plan = build().explain()
+            scanned = full_scans(plan)
+            if scanned:
+                failures.append(f"{name} scans {', '.join(scanned)}")
+                self.stdout.write(self.style.ERROR(f"{name}: full scan of {', '.join(scanned)}"))
+            else:
+                self.stdout.write(f"{name}: ok")
+            if scanned or options['show']:
+                self.stdout.write(plan)
+
+        if failures:
+            raise CommandError('\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS(f"None of the {len(QUERIES)} hot queries scans a whole table"))
@@ -0,0 +1,65 @@
+import logging
+import time
+from django.core.management.base import BaseCommand
+from expenses.expense_utils import drain_ledger_queue
+from expenses.ledger import ledger_lag
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Apply queued ledger changes from asynchronous expense posting, merging changes per pair'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Queue entries applied per transaction',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and poll the queue instead of exiting once it is empty',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds to sleep between polls when looping on an empty queue',
+        )
+        parser.add_argument(
+            '--status',
+            action='store_true',
+            help='Only report how far the ledger lags behind the queue',
+        )
+
+    def handle(self, *args, **options):
+        if options['status']:
+            self.report_lag()
+            return
+
+        applied_total = 0
+        while True:
+            applied = drain_ledger_queue(limit=options['batch_size'])
+            applied_total += applied
+
+            if applied:
+                self.stdout.write(f"Applied {applied} queued changes")
+                logger.info(f"Applied {applied} queued ledger changes")
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f"Queue drained. Applied {applied_total} changes in total"))
+
+    def report_lag(self):
+        lag = ledger_lag()
+        if not lag['entries']:
+            self.stdout.write(self.style.SUCCESS("Ledger is up to date"))
+            return
+        self.stdout.write(
+            f"{lag['entries']} pending changes across {lag['groups']} groups, "
+            f"oldest queued {lag['seconds']:.1f}s ago"
+        )
@@ -0,0 +1,250 @@
+import csv
+import json
+import logging
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from expenses.models import Group, Expense, Split
+from expenses.expense_utils import (
+    CENT, compile_split_plan, plan_splits, split_deltas, apply_debt_deltas, adjust_group_counters
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+SPLIT_TYPES = ('EQUAL', 'PERCENTAGE', 'DIRECT')
+
+
+class RowError(Exception):
+    """Raised when an input row cannot be turned into an expense."""
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk import expenses from a CSV or JSONL file. '
+        'Each row needs title, amount, paid_by (username), group (id or name) and '
+        'participants (usernames, ";"-separated in CSV), all members of the group; '
+        'split_type, shares and date are optional. Rows get the same checks as the expense form. '
+        'Each chunk\'s debts are applied in the same transaction as its rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file to import')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'jsonl'],
+            help='Input format (defaults to the file extension)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Expenses inserted per transaction',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        chunk_size = options['chunk_size']
+
+        # In-memory lookup maps so rows never hit the database to resolve names
+        self.users = dict(User.objects.values_list('username', 'id'))
+        self.groups = {}
+        self.ambiguous_groups = set()
+        for group_id, name in Group.objects.values_list('id', 'name'):
+            if name in self.groups:
+                self.ambiguous_groups.add(name)
+            self.groups[name] = group_id
+        self.group_ids = set(self.groups.values())
+        self.memberships = set(Group.members.through.objects.values_list('group_id', 'user_id'))
+
+        imported_count = 0
+        error_count = 0
+        start = time.perf_counter()
+
+        chunk = []
+        with open(path, newline='', encoding='utf-8') as handle:
+            for line_number, row in self.read_rows(handle, file_format):
+                try:
+                    chunk.append(self.parse_row(row))
+                except RowError as e:
+                    error_count += 1
+                    self.stdout.write(self.style.ERROR(f"Line {line_number}: {e}"))
+                    logger.error(f"Import line {line_number}: {e}")
+                    continue
+
+                if len(chunk) >= chunk_size:
+                    imported_count += self.write_chunk(chunk)
+                    chunk = []
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(f"Imported {imported_count} expenses ({imported_count / elapsed:.0f} rows/sec)")
+
+            if chunk:
+                imported_count += self.write_chunk(chunk)
+
+        elapsed = time.perf_counter() - start
+        rate = imported_count / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully imported {imported_count} expenses in {elapsed:.1f}s ({rate:.0f} rows/sec). Errors: {error_count}"
+        ))
+        logger.info(f"Imported {imported_count} expenses ({rate:.0f} rows/sec). Errors: {error_count}")
+
+    def read_rows(self, handle, file_format):
+        """Yield (line number, row) one row at a time; JSONL rows are still undecoded strings."""
+        if file_format == 'csv':
+            # Line 1 is the header
+            yield from enumerate(csv.DictReader(handle), start=2)
+        else:
+            for line_number, line in enumerate(handle, start=1):
+                if line.strip():
+                    yield line_number, line
+
+    def parse_row(self, row):
+        """Validate a row and resolve it into an unsaved Expense plus its split inputs."""
+        if isinstance(row, str):
+            try:
+                row = json.loads(row)
+            except json.JSONDecodeError as e:
+                raise RowError(f"invalid JSON ({e})")
+            if not isinstance(row, dict):
+                raise RowError("expected a JSON object")
+
+        try:
+            amount = Decimal(str(row['amount']))
+        except (KeyError, InvalidOperation):
+            raise RowError(f"invalid amount {row.get('amount')!r}")
+        if not amount.is_finite() or amount <= 0 or amount != amount.quantize(CENT):
+            raise RowError(f"invalid amount {row.get('amount')!r}, expected a positive amount in cents")
+
+        paid_by_id = self.resolve_user(row.get('paid_by'))
+        group_id = self.resolve_group(row.get('group'))
+        split_type = row.get('split_type') or 'EQUAL'
+        if not isinstance(split_type, str) or split_type.upper() not in SPLIT_TYPES:
+            raise RowError(f"unsupported split type {split_type!r}")
+        split_type = split_type.upper()
+
+        title = row.get('title') or ''
+        if not isinstance(title, str):
+            raise RowError(f"invalid title {title!r}")
+
+        usernames = row.get('participants') or []
+        if isinstance(usernames, str):
+            usernames = [name.strip() for name in usernames.split(';') if name.strip()]
+        if not isinstance(usernames, list):
+            raise RowError("participants must be a list of usernames")
+        if not usernames:
+            raise RowError("no participants")
+
+        participant_ids = list(dict.fromkeys(self.resolve_user(name) for name in usernames))
+        shares = self.parse_shares(row.get('shares'), usernames)
+
+        for username, user_id in [(row.get('paid_by'), paid_by_id), *zip(usernames, participant_ids)]:
+            if (group_id, user_id) not in self.memberships:
+                raise RowError(f"{username!r} is not a member of group {row.get('group')!r}")
+
+        # The same checks the forms run, which also resolve the split into shares
+        try:
+            plan = compile_split_plan(amount, split_type, paid_by_id, participant_ids, shares)
+        except ValidationError as e:
+            raise RowError(e.messages[0])
+
+        expense = Expense(
+            title=title[:100],
+            amount=amount,
+            paid_by_id=paid_by_id,
+            group_id=group_id,
+            split_type=split_type
+        )
+        created_at = self.parse_date(row.get('date'))
+        return expense, plan, created_at
+
+    def parse_shares(self, shares, usernames):
+        """Turn the shares column into {user_id: value}, aligned with participants when given as a list."""
+        if not shares:
+            return {}
+        if isinstance(shares, str):
+            shares = [value.strip() for value in shares.split(';')]
+        if isinstance(shares, list):
+            if len(shares) != len(usernames):
+                raise RowError("shares must match participants one to one")
+            shares = dict(zip(usernames, shares))
+        if not isinstance(shares, dict):
+            raise RowError("shares must be a list or an object keyed by username")
+        return {self.resolve_user(name): value for name, value in shares.items()}
+
+    def parse_date(self, value):
+        if not value:
+            return None
+        if not isinstance(value, str):
+            raise RowError(f"invalid date {value!r}, expected YYYY-MM-DD")
+        try:
+            return timezone.make_aware(datetime.strptime(value, '%Y-%m-%d'))
+        except ValueError:
+            raise RowError(f"invalid date {value!r}, expected YYYY-MM-DD")
+
+    def resolve_user(self, username):
+        if not isinstance(username, str) or username not in self.users:
+            raise RowError(f"unknown user {username!r}")
+        return self.users[username]
+
+    def resolve_group(self, value):
+        value = str(value or '').strip()
+        if value.isdigit() and int(value) in self.group_ids:
+            return int(value)
+        if value in self.ambiguous_groups:
+            raise RowError(f"group name {value!r} is ambiguous, use the group id")
+        try:
+            return self.groups[value]
+        except KeyError:
+            raise RowError(f"unknown group {value!r}")
+
+    def write_chunk(self, chunk):
+        """
+        Insert one chunk of expenses and their splits and post their debts, all in
+        a single transaction, so a run that stops part way leaves every imported
+        expense fully reflected in the ledger.
+        """
+        with transaction.atomic():
+            expenses = Expense.objects.bulk_create([expense for expense, _, _ in chunk])
+
+            # created_at is auto_now_add, so historical dates are written afterwards
+            dated = []
+            for expense, _, created_at in chunk:
+                if created_at:
+                    expense.created_at = created_at
+                    dated.append(expense)
+            if dated:
+                Expense.objects.bulk_update(dated, ['created_at'])
+
+            splits, deltas, paid = [], {}, {}
+            for expense, plan, _ in chunk:
+                expense_splits = plan_splits(expense, plan)
+                splits.extend(expense_splits)
+
+                group_deltas = deltas.setdefault(expense.group_id, {})
+                for key, amount in split_deltas(expense, expense_splits).items():
+                    group_deltas[key] = group_deltas.get(key, Decimal('0.00')) + amount
+                group_paid = paid.setdefault(expense.group_id, {})
+                group_paid[expense.paid_by_id] = group_paid.get(expense.paid_by_id, Decimal('0.00')) + expense.amount
+
+            Split.objects.bulk_create(splits, batch_size=1000)
+
+            # One counter update per group in the chunk
+            counters = {}
+            for expense in expenses:
+                count, spent = counters.get(expense.group_id, (0, Decimal('0.00')))
+                counters[expense.group_id] = (count + 1, spent + expense.amount)
+            for group_id, (count, spent) in counters.items():
+                adjust_group_counters(group_id, expenses=count, spent=spent)
+
+            # One ledger post per group in the chunk
+            groups = Group.objects.in_bulk(deltas.keys())
+            for group_id, group_deltas in deltas.items():
+                apply_debt_deltas(groups[group_id], group_deltas, paid=paid[group_id])
+
+        return len(expenses)
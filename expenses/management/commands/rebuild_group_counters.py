@@ -0,0 +1,107 @@
+import logging
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from expenses.models import Group, Expense
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Groups checked per round of aggregate queries
+GROUP_BATCH_SIZE = 500
+
+COUNTER_FIELDS = ('member_count', 'expense_count', 'total_spent')
+
+
+def count_group_totals(group_ids):
+    """Recount members, expenses and spending for a batch of groups, keyed by group id."""
+    totals = {
+        group_id: {'member_count': 0, 'expense_count': 0, 'total_spent': Decimal('0.00')}
+        for group_id in group_ids
+    }
+
+    for group_id, members in Group.members.through.objects.filter(
+        group_id__in=group_ids
+    ).values_list('group_id').annotate(members=Count('user_id')).order_by():
+        totals[group_id]['member_count'] = members
+
+    for group_id, expenses, spent in Expense.objects.filter(
+        group_id__in=group_ids
+    ).values_list('group_id').annotate(expenses=Count('id'), spent=Sum('amount')).order_by():
+        totals[group_id]['expense_count'] = expenses
+        totals[group_id]['total_spent'] = spent or Decimal('0.00')
+
+    return totals
+
+
+class Command(BaseCommand):
+    help = (
+        'Recount the member_count, expense_count and total_spent counters stored on groups '
+        'and repair any that drifted, or just report them with --verify.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--group',
+            type=int,
+            action='append',
+            dest='groups',
+            help='Only check this group id (can be repeated)',
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Report differences without writing anything',
+        )
+
+    def handle(self, *args, **options):
+        verify = options['verify']
+
+        group_ids = Group.objects.order_by('id').values_list('id', flat=True)
+        if options['groups']:
+            group_ids = group_ids.filter(id__in=options['groups'])
+        group_ids = list(group_ids)
+
+        start = time.perf_counter()
+        mismatched = 0
+        for offset in range(0, len(group_ids), GROUP_BATCH_SIZE):
+            batch = group_ids[offset:offset + GROUP_BATCH_SIZE]
+            with transaction.atomic():
+                # Lock the batch so counters can't move between the recount and the repair
+                groups = Group.objects.filter(id__in=batch).only(*COUNTER_FIELDS)
+                if not verify:
+                    groups = groups.select_for_update()
+                groups = list(groups)
+                totals = count_group_totals(batch)
+
+                to_fix = []
+                for group in groups:
+                    expected = totals[group.id]
+                    differences = [
+                        f"{field}: stored {getattr(group, field)}, counted {expected[field]}"
+                        for field in COUNTER_FIELDS if getattr(group, field) != expected[field]
+                    ]
+                    if not differences:
+                        continue
+                    mismatched += 1
+                    self.stdout.write(self.style.WARNING(f"Group {group.id}: {', '.join(differences)}"))
+                    for field in COUNTER_FIELDS:
+                        setattr(group, field, expected[field])
+                    to_fix.append(group)
+
+                if to_fix and not verify:
+                    Group.objects.bulk_update(to_fix, COUNTER_FIELDS)
+
+        elapsed = time.perf_counter() - start
+        if verify:
+            style = self.style.SUCCESS if not mismatched else self.style.ERROR
+            self.stdout.write(style(
+                f"Checked {len(group_ids)} groups in {elapsed:.1f}s. Groups with differences: {mismatched}"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Checked {len(group_ids)} groups in {elapsed:.1f}s. Repaired: {mismatched}"
+            ))
+        logger.info(f"Checked counters of {len(group_ids)} groups. Groups with differences: {mismatched}")
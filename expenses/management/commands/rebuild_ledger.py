@@ -0,0 +1,224 @@
+import logging
+import time
+from decimal import Decimal
+from itertools import repeat
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from expenses.models import Group, Expense, Split, SplitArchive, Debt, Payment, PaymentArchive, PairBalance, MemberBalance, LedgerQueueEntry
+from expenses.ledger import CENT, member_totals, replace_group_ledger
+from expenses.balance_cache import bump_group_version
+from expenses.workers import process_pool
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Groups handled per streaming query (and per unit of work handed to a worker)
+GROUP_BATCH_SIZE = 200
+
+
+def compute_group_ledgers(group_ids):
+    """
+    Net every split and payment of the given groups, archived ones included, into pair balances.
+    Splits are streamed ordered by group, so only one group is held in memory at a time.
+    Yields (group_id, balances, paid) with balances keyed by (low_id, high_id).
+    """
+    zero = Decimal('0.00')
+
+    paid = {}
+    for group_id, user_id, total in Expense.objects.filter(
+        group_id__in=group_ids
+    ).values_list('group_id', 'paid_by_id').annotate(total=Sum('amount')).order_by():
+        paid.setdefault(group_id, {})[user_id] = (total or zero).quantize(CENT)
+
+    # (creditor, debtor, amount) rows added on top of the live splits. A payment is
+    # a debt from the payee back to the payer. Payments and archived splits are
+    # summed per pair, so they take little memory however many there are.
+    extra = {}
+    for model in (Payment, PaymentArchive):
+        for group_id, payer_id, payee_id, amount in model.objects.filter(
+            group_id__in=group_ids
+        ).values_list('group_id', 'payer_id', 'payee_id').annotate(total=Sum('amount')).order_by():
+            extra.setdefault(group_id, []).append((payer_id, payee_id, amount))
+    for group_id, paid_by_id, user_id, amount in SplitArchive.objects.filter(
+        expense__group_id__in=group_ids
+    ).values_list('expense__group_id', 'expense__paid_by_id', 'user_id').annotate(total=Sum('amount_owed')).order_by():
+        extra.setdefault(group_id, []).append((paid_by_id, user_id, amount))
+
+    def finish(group_id, balances):
+        for creditor_id, debtor_id, amount in extra.get(group_id, []):
+            add(balances, creditor_id, debtor_id, amount)
+        return group_id, balances, paid.get(group_id, {})
+
+    def add(balances, creditor_id, debtor_id, amount):
+        if creditor_id == debtor_id or not amount:
+            return
+        pair = (min(creditor_id, debtor_id), max(creditor_id, debtor_id))
+        balances[pair] = balances.get(pair, zero) + (amount if creditor_id == pair[0] else -amount)
+
+    splits = Split.objects.filter(
+        expense__group_id__in=group_ids
+    ).order_by('expense__group_id').values_list(
+        'expense__group_id', 'expense__paid_by_id', 'user_id', 'amount_owed'
+    )
+
+    seen = set()
+    current_id, balances = None, {}
+    # iterator() uses a server-side cursor where the backend supports it
+    for group_id, payer_id, user_id, amount_owed in splits.iterator(chunk_size=5000):
+        if group_id != current_id:
+            if current_id is not None:
+                yield finish(current_id, balances)
+            current_id, balances = group_id, {}
+            seen.add(group_id)
+        add(balances, payer_id, user_id, amount_owed)
+
+    if current_id is not None:
+        yield finish(current_id, balances)
+
+    # Groups without any splits can still hold payments or stale rows
+    for group_id in group_ids:
+        if group_id not in seen:
+            yield finish(group_id, {})
+
+def diff_group_ledger(group_id, balances, paid):
+    """Compare freshly computed figures with what is stored and describe every mismatch."""
+    zero = Decimal('0.00')
+    differences = []
+
+    pending = LedgerQueueEntry.objects.filter(group_id=group_id).count()
+    if pending:
+        differences.append(f"{pending} queued changes not applied yet, run drain_ledger_queue first")
+
+    stored_pairs = {
+        (low, high): amount
+        for low, high, amount in PairBalance.objects.filter(group_id=group_id).values_list(
+            'low_user_id', 'high_user_id', 'amount'
+        )
+    }
+    stored_debts = {}
+    for creditor_id, debtor_id, amount in Debt.objects.filter(
+        group_id=group_id, is_settled=False
+    ).values_list('creditor_id', 'debtor_id', 'amount'):
+        pair = (min(creditor_id, debtor_id), max(creditor_id, debtor_id))
+        stored_debts[pair] = stored_debts.get(pair, zero) + (amount if creditor_id == pair[0] else -amount)
+
+    for pair in sorted(set(balances) | set(stored_pairs) | set(stored_debts)):
+        expected = balances.get(pair, zero)
+        ledger = stored_pairs.get(pair, zero)
+        debts = stored_debts.get(pair, zero)
+        if expected != ledger or expected != debts:
+            differences.append(
+                f"pair {pair[0]}/{pair[1]}: expected {expected}, ledger {ledger}, debts {debts}"
+            )
+
+    expected_members = member_totals(balances, paid)
+    stored_members = {
+        row['user_id']: row
+        for row in MemberBalance.objects.filter(group_id=group_id).values(
+            'user_id', 'paid', 'owed', 'to_receive', 'net'
+        )
+    }
+    for user_id in sorted(set(expected_members) | set(stored_members)):
+        expected = expected_members.get(user_id, {})
+        stored = stored_members.get(user_id, {})
+        for field in ('paid', 'owed', 'to_receive', 'net'):
+            if expected.get(field, zero) != stored.get(field, zero):
+                differences.append(
+                    f"member {user_id} {field}: expected {expected.get(field, zero)}, stored {stored.get(field, zero)}"
+                )
+
+    return differences
+
+def rebuild_groups(group_ids, verify):
+    """
+    Rebuild (or just verify) a batch of groups.
+    Runs in worker processes too, so it only takes and returns plain data.
+    """
+    results = []
+    for group_id, balances, paid in compute_group_ledgers(group_ids):
+        if verify:
+            results.append((group_id, diff_group_ledger(group_id, balances, paid)))
+        else:
+            with transaction.atomic():
+                replace_group_ledger(group_id, balances, paid)
+                bump_group_version(group_id)
+            results.append((group_id, []))
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute pair balances, open debts and member balances from split history. '
+        'Run while no expenses or settlements are being posted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--group',
+            type=int,
+            action='append',
+            dest='groups',
+            help='Only rebuild this group id (can be repeated)',
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Report differences without writing anything',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help=(
+                'Number of processes to spread groups across. Works on Linux, macOS and '
+                'Windows; workers are forked where possible and spawned otherwise'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        verify = options['verify']
+        workers = options['workers']
+
+        group_ids = Group.objects.order_by('id').values_list('id', flat=True)
+        if options['groups']:
+            group_ids = group_ids.filter(id__in=options['groups'])
+        group_ids = list(group_ids)
+
+        batches = [
+            group_ids[start:start + GROUP_BATCH_SIZE]
+            for start in range(0, len(group_ids), GROUP_BATCH_SIZE)
+        ]
+
+        action = 'Verifying' if verify else 'Rebuilding'
+        self.stdout.write(f"{action} ledger for {len(group_ids)} groups with {workers} worker(s)")
+        start = time.perf_counter()
+
+        if workers > 1 and len(batches) > 1:
+            with process_pool(workers) as pool:
+                results = [
+                    result
+                    for batch_results in pool.map(rebuild_groups, batches, repeat(verify))
+                    for result in batch_results
+                ]
+        else:
+            results = [result for batch in batches for result in rebuild_groups(batch, verify)]
+
+        mismatched = 0
+        for group_id, differences in results:
+            if differences:
+                mismatched += 1
+                self.stdout.write(self.style.WARNING(f"Group {group_id}: {len(differences)} difference(s)"))
+                for difference in differences:
+                    self.stdout.write(f"  {difference}")
+
+        elapsed = time.perf_counter() - start
+        if verify:
+            style = self.style.SUCCESS if not mismatched else self.style.ERROR
+            self.stdout.write(style(
+                f"Verified {len(results)} groups in {elapsed:.1f}s. Groups with differences: {mismatched}"
+            ))
+            logger.info(f"Verified {len(results)} groups. Groups with differences: {mismatched}")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(results)} groups in {elapsed:.1f}s"))
+            logger.info(f"Rebuilt ledger for {len(results)} groups")
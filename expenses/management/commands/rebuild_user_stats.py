@@ -0,0 +1,79 @@
+import logging
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from expenses.models import UserStats
+from expenses.ledger import refresh_user_stats
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Users recomputed per transaction
+USER_BATCH_SIZE = 500
+
+STAT_FIELDS = ('total_paid', 'owed', 'to_receive', 'settled_debt_count')
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the per-user lifetime stats shown on profile pages from member balances '
+        'and payments, or just report differences with --verify.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='users',
+            help='Only check this user id (can be repeated)',
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Report differences without writing anything',
+        )
+
+    def handle(self, *args, **options):
+        verify = options['verify']
+
+        user_ids = User.objects.order_by('id').values_list('id', flat=True)
+        if options['users']:
+            user_ids = user_ids.filter(id__in=options['users'])
+        user_ids = list(user_ids)
+
+        start = time.perf_counter()
+        mismatched = 0
+        for offset in range(0, len(user_ids), USER_BATCH_SIZE):
+            batch = user_ids[offset:offset + USER_BATCH_SIZE]
+            with transaction.atomic():
+                stored = {stats.user_id: stats for stats in UserStats.objects.filter(user_id__in=batch)}
+                refresh_user_stats(batch)
+                fresh = {stats.user_id: stats for stats in UserStats.objects.filter(user_id__in=batch)}
+
+                for user_id in batch:
+                    before = stored.get(user_id) or UserStats(user_id=user_id)
+                    differences = [
+                        f"{field}: stored {getattr(before, field)}, counted {getattr(fresh[user_id], field)}"
+                        for field in STAT_FIELDS if getattr(before, field) != getattr(fresh[user_id], field)
+                    ]
+                    if differences:
+                        mismatched += 1
+                        self.stdout.write(self.style.WARNING(f"User {user_id}: {', '.join(differences)}"))
+
+                # Verifying recomputes in the transaction and then throws the result away
+                if verify:
+                    transaction.set_rollback(True)
+
+        elapsed = time.perf_counter() - start
+        if verify:
+            style = self.style.SUCCESS if not mismatched else self.style.ERROR
+            self.stdout.write(style(
+                f"Checked {len(user_ids)} users in {elapsed:.1f}s. Users with differences: {mismatched}"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Checked {len(user_ids)} users in {elapsed:.1f}s. Repaired: {mismatched}"
+            ))
+        logger.info(f"Checked stats of {len(user_ids)} users. Users with differences: {mismatched}")
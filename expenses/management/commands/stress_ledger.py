@@ -0,0 +1,115 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from expenses.models import Group, Expense
+from expenses.expense_utils import handle_equal_split, handle_percentage_split, handle_direct_split
+from expenses.management.commands.rebuild_ledger import compute_group_ledgers, diff_group_ledger
+
+
+def post_expenses(group, users, count, seed):
+    """
+    Post `count` random expenses the same way add_expense does, on this thread's
+    own connection. Returns the error messages of the posts that failed.
+    """
+    rng = random.Random(seed)
+    errors = []
+    try:
+        for _ in range(count):
+            participants = rng.sample(users, rng.randint(2, len(users)))
+            paid_by = rng.choice(participants)
+            amount = Decimal(rng.randint(100, 100000)) / 100
+            split_type = rng.choice(['EQUAL', 'PERCENTAGE', 'DIRECT'])
+            try:
+                with transaction.atomic():
+                    expense = Expense.objects.create(
+                        title='Stress expense',
+                        amount=amount,
+                        paid_by=paid_by,
+                        group=group,
+                        split_type=split_type
+                    )
+                    if split_type == 'EQUAL':
+                        handle_equal_split(expense, participants)
+                    elif split_type == 'PERCENTAGE':
+                        shares = random_shares(rng, participants, Decimal('100'))
+                        handle_percentage_split(expense, participants, shares)
+                    else:
+                        shares = random_shares(rng, participants, amount)
+                        handle_direct_split(expense, participants, shares)
+            except Exception as e:
+                errors.append(str(e))
+    finally:
+        # Every thread has its own connection
+        connection.close()
+    return errors
+
+def random_shares(rng, participants, total):
+    """Split `total` into random cent amounts, one per participant, that add up exactly."""
+    cents = int(total * 100)
+    cuts = sorted(rng.randint(0, cents) for _ in range(len(participants) - 1))
+    bounds = [0] + cuts + [cents]
+    return {
+        participant.id: Decimal(bounds[i + 1] - bounds[i]) / 100
+        for i, participant in enumerate(participants)
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Post expenses into one group from many threads at once and check that '
+        'the ledger, open debts and member balances come out exact'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent posters')
+        parser.add_argument('--expenses', type=int, default=2000, help='Total expenses to post')
+        parser.add_argument('--members', type=int, default=12, help='Members in the stress group')
+        parser.add_argument('--keep', action='store_true', help='Keep the stress group and users afterwards')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        total = options['expenses']
+
+        users = [
+            User.objects.create(username=f'stress_{int(time.time())}_{i}')
+            for i in range(options['members'])
+        ]
+        group = Group.objects.create(name='Ledger stress test', admin=users[0])
+        group.members.add(*users)
+
+        per_thread = [total // threads + (1 if i < total % threads else 0) for i in range(threads)]
+        self.stdout.write(f"Posting {total} expenses from {threads} threads into group {group.id}")
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            failures = [
+                error
+                for thread_errors in pool.map(
+                    lambda args: post_expenses(group, users, *args),
+                    [(count, seed) for seed, count in enumerate(per_thread)]
+                )
+                for error in thread_errors
+            ]
+        elapsed = time.perf_counter() - start
+        for error in failures:
+            self.stderr.write(f"Posting failed: {error}")
+        errors = len(failures)
+
+        self.stdout.write(f"Posted {total - errors} expenses in {elapsed:.1f}s ({(total - errors) / elapsed:.0f}/sec), errors: {errors}")
+
+        (group_id, balances, paid), = compute_group_ledgers([group.id])
+        differences = diff_group_ledger(group_id, balances, paid)
+        for difference in differences:
+            self.stdout.write(f"  {difference}")
+
+        if not options['keep']:
+            group.delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        if errors or differences:
+            raise CommandError(f"Stress test failed: {errors} posting errors, {len(differences)} balance differences")
+        self.stdout.write(self.style.SUCCESS("Balances are exact"))
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:48
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_pair_balances(apps, schema_editor):
+    """Seed the ledger from the unsettled group debts that exist today."""
+    Debt = apps.get_model('expenses', 'Debt')
+    PairBalance = apps.get_model('expenses', 'PairBalance')
+
+    balances = {}
+    for debt in Debt.objects.filter(is_settled=False, group__isnull=False).iterator():
+        low, high = sorted((debt.creditor_id, debt.debtor_id))
+        signed = debt.amount if debt.creditor_id == low else -debt.amount
+        key = (debt.group_id, low, high)
+        balances[key] = balances.get(key, Decimal('0.00')) + signed
+
+    PairBalance.objects.bulk_create([
+        PairBalance(group_id=group_id, low_user_id=low, high_user_id=high, amount=amount)
+        for (group_id, low, high), amount in balances.items()
+        if amount
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0005_merge_20250406_2041'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PairBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pair_balances', to='expenses.group')),
+                ('high_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('low_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('group', 'low_user', 'high_user')},
+            },
+        ),
+        migrations.RunPython(backfill_pair_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:48
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_member_balances(apps, schema_editor):
+    """Build the projection from expenses paid and the current pairwise ledger."""
+    Expense = apps.get_model('expenses', 'Expense')
+    PairBalance = apps.get_model('expenses', 'PairBalance')
+    MemberBalance = apps.get_model('expenses', 'MemberBalance')
+
+    zero = Decimal('0.00')
+    rows = {}
+
+    def row(group_id, user_id):
+        return rows.setdefault((group_id, user_id), {'paid': zero, 'owed': zero, 'to_receive': zero})
+
+    for item in Expense.objects.values('group_id', 'paid_by_id').annotate(total=Sum('amount')):
+        row(item['group_id'], item['paid_by_id'])['paid'] += item['total'] or zero
+
+    for balance in PairBalance.objects.exclude(amount=0).iterator():
+        creditor_id, debtor_id = balance.low_user_id, balance.high_user_id
+        if balance.amount < 0:
+            creditor_id, debtor_id = debtor_id, creditor_id
+        row(balance.group_id, creditor_id)['to_receive'] += abs(balance.amount)
+        row(balance.group_id, debtor_id)['owed'] += abs(balance.amount)
+
+    MemberBalance.objects.bulk_create([
+        MemberBalance(
+            group_id=group_id,
+            user_id=user_id,
+            paid=values['paid'],
+            owed=values['owed'],
+            to_receive=values['to_receive'],
+            net=values['to_receive'] - values['owed']
+        )
+        for (group_id, user_id), values in rows.items()
+    ], batch_size=500)
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0006_pairbalance'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('owed', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('to_receive', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('net', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='member_balances', to='expenses.group')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='member_balances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('group', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_member_balances, migrations.RunPython.noop),
+    ]
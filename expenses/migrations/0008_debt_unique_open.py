@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0007_memberbalance'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='debt',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='debt',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_settled', False)), fields=('creditor', 'debtor', 'group'), name='unique_open_debt'),
+        ),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:57
+
+import json
+from decimal import Decimal, InvalidOperation
+from django.db import migrations, models
+
+CENT = Decimal('0.01')
+
+
+def compile_plan(amount, split_type, paid_by_id, participant_ids, shares):
+    """
+    expense_utils.compile_split_plan as it was when this migration was written,
+    frozen here so later changes to it can't change what the migration does.
+    Raises ValueError when the split can't be compiled.
+    """
+    if split_type not in ('EQUAL', 'PERCENTAGE', 'DIRECT'):
+        raise ValueError(f"{split_type} splits can't be used for recurring expenses")
+
+    participant_ids = list(dict.fromkeys(int(user_id) for user_id in participant_ids))
+    if not participant_ids:
+        raise ValueError("no participants")
+    if paid_by_id not in participant_ids:
+        participant_ids.append(paid_by_id)
+
+    try:
+        amount = Decimal(str(amount)).quantize(CENT)
+        weights = {int(user_id): Decimal(str(value)) for user_id, value in shares.items()}
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError("split amounts must be numbers")
+
+    if set(weights) - set(participant_ids):
+        raise ValueError("shares given for users who are not participants")
+    if any(weight < 0 for weight in weights.values()):
+        raise ValueError("negative shares")
+    if split_type == 'PERCENTAGE' and sum(weights.values()) != Decimal('100'):
+        raise ValueError("percentages don't sum to 100")
+    if split_type == 'DIRECT' and sum(weights.values()) != amount:
+        raise ValueError("direct amounts don't sum to the expense amount")
+
+    rows = []
+    for user_id in participant_ids:
+        if split_type == 'PERCENTAGE':
+            weight = weights.get(user_id, Decimal('0'))
+            share = (weight / Decimal('100')) * amount
+        elif split_type == 'DIRECT':
+            weight = weights.get(user_id, Decimal('0'))
+            share = weight
+        else:
+            weight = Decimal('1')
+            share = amount / Decimal(len(participant_ids))
+        rows.append([user_id, str(weight), str(share.quantize(CENT))])
+
+    remainder = amount - sum(Decimal(share) for _, _, share in rows)
+    return {
+        'split_type': split_type,
+        'amount': str(amount),
+        'paid_by': paid_by_id,
+        'participants': rows,
+        'remainder': str(remainder),
+    }
+
+def compile_existing_plans(apps, schema_editor):
+    """
+    Compile the free-text split_details of existing recurring expenses into plans.
+    Rows whose details can't be compiled are left without a plan and listed, so
+    they are reported when due instead of silently becoming equal splits; saving
+    them from the edit form compiles a plan.
+    """
+    RecurringExpense = apps.get_model('expenses', 'RecurringExpense')
+
+    failed = []
+    for recurring_expense in RecurringExpense.objects.prefetch_related('participants').iterator(chunk_size=500):
+        participant_ids = [participant.id for participant in recurring_expense.participants.all()]
+        split_type = recurring_expense.split_type
+        try:
+            shares = json.loads(recurring_expense.split_details or '{}') if split_type in ('PERCENTAGE', 'DIRECT') else {}
+            if not isinstance(shares, dict):
+                raise ValueError("split details are not an object")
+            plan = compile_plan(recurring_expense.amount, split_type, recurring_expense.paid_by_id, participant_ids, shares)
+        except ValueError as e:
+            failed.append((recurring_expense.pk, str(e)))
+            continue
+
+        RecurringExpense.objects.filter(pk=recurring_expense.pk).update(split_plan=plan)
+
+    if failed:
+        print(f"\n  {len(failed)} recurring expense(s) have no split plan and need to be edited:")
+        for pk, reason in failed:
+            print(f"    id {pk}: {reason}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0009_ledgerqueueentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recurringexpense',
+            name='split_plan',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(compile_existing_plans, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:21
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    """Fill the new counters from the member and expense tables in one statement."""
+    Group = apps.get_model('expenses', 'Group')
+    Expense = apps.get_model('expenses', 'Expense')
+    Membership = Group.members.through
+
+    def per_group(queryset, aggregate, default):
+        return Coalesce(Subquery(
+            queryset.filter(group_id=OuterRef('pk')).values('group_id').annotate(total=aggregate).values('total')
+        ), Value(default))
+
+    Group.objects.update(
+        member_count=per_group(Membership.objects, Count('user_id'), 0),
+        expense_count=per_group(Expense.objects, Count('id'), 0),
+        total_spent=per_group(Expense.objects, Sum('amount'), Decimal('0.00')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0010_recurringexpense_split_plan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='expense_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='member_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='total_spent',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
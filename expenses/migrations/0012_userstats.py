@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:23
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_stats(apps, schema_editor):
+    """Give every user a stats row summed from their balances and settled debts."""
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Debt = apps.get_model('expenses', 'Debt')
+    UserStats = apps.get_model('expenses', 'UserStats')
+
+    zero = Value(Decimal('0.00'), output_field=models.DecimalField())
+    users = User.objects.annotate(
+        total_paid=Coalesce(Sum('member_balances__paid'), zero),
+        owed=Coalesce(Sum('member_balances__owed'), zero),
+        to_receive=Coalesce(Sum('member_balances__to_receive'), zero),
+        last_activity=Max('member_balances__updated_at'),
+        settled_debt_count=Coalesce(Subquery(
+            Debt.objects.filter(debtor=OuterRef('pk'), is_settled=True)
+            .values('debtor').annotate(total=Count('id')).values('total')
+        ), 0),
+    ).values_list('pk', 'total_paid', 'owed', 'to_receive', 'settled_debt_count', 'last_activity')
+
+    UserStats.objects.bulk_create([
+        UserStats(
+            user_id=pk, total_paid=total_paid, owed=owed, to_receive=to_receive,
+            settled_debt_count=settled_debt_count, last_activity=last_activity
+        )
+        for pk, total_paid, owed, to_receive, settled_debt_count, last_activity in users.iterator(chunk_size=2000)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('expenses', '0011_group_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('owed', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('to_receive', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('settled_debt_count', models.IntegerField(default=0)),
+                ('last_activity', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+# Rows converted per round trip
+BATCH_SIZE = 2000
+
+
+def convert_settled_debts(apps, schema_editor):
+    """Turn every settled debt into the payment it stood for and drop the settled row."""
+    Debt = apps.get_model('expenses', 'Debt')
+    Payment = apps.get_model('expenses', 'Payment')
+
+    while True:
+        batch = list(
+            Debt.objects.filter(is_settled=True).order_by('id')
+            .values_list('id', 'debtor_id', 'creditor_id', 'group_id', 'amount', 'updated_at')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        Payment.objects.bulk_create([
+            Payment(payer_id=debtor_id, payee_id=creditor_id, group_id=group_id, amount=amount, created_at=updated_at)
+            for _, debtor_id, creditor_id, group_id, amount, updated_at in batch
+        ])
+        Debt.objects.filter(id__in=[row[0] for row in batch]).delete()
+
+
+def restore_settled_debts(apps, schema_editor):
+    """Turn payments back into settled debts, for rolling the migration back."""
+    Debt = apps.get_model('expenses', 'Debt')
+    Payment = apps.get_model('expenses', 'Payment')
+    # updated_at is auto_now, which would stamp every restored debt with the
+    # time of the rollback instead of the payment's
+    Debt._meta.get_field('updated_at').auto_now = False
+
+    payments = Payment.objects.order_by('id').values_list(
+        'payer_id', 'payee_id', 'group_id', 'amount', 'created_at'
+    )
+    Debt.objects.bulk_create([
+        Debt(debtor_id=payer_id, creditor_id=payee_id, group_id=group_id, amount=amount, updated_at=created_at, is_settled=True)
+        for payer_id, payee_id, group_id, amount, created_at in payments.iterator(chunk_size=BATCH_SIZE)
+    ], batch_size=1000)
+    Payment.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0012_userstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='expenses.group')),
+                ('payee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments_received', to=settings.AUTH_USER_MODEL)),
+                ('payer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments_made', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['payer'], name='expenses_pa_payer_i_fec589_idx'), models.Index(fields=['payee'], name='expenses_pa_payee_i_fea636_idx'), models.Index(fields=['group'], name='expenses_pa_group_i_dd8d34_idx'), models.Index(fields=['created_at'], name='expenses_pa_created_bfffaf_idx')],
+            },
+        ),
+        migrations.RunPython(convert_settled_debts, restore_settled_debts),
+    ]
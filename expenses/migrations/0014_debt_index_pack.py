@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0013_payment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='debt',
+            name='expenses_de_credito_730644_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='debt',
+            name='expenses_de_debtor__a74061_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='debt',
+            name='expenses_de_group_i_7608b8_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='split',
+            name='expenses_sp_user_id_6307a6_idx',
+        ),
+        migrations.AddIndex(
+            model_name='debt',
+            index=models.Index(condition=models.Q(('is_settled', False)), fields=['debtor', 'group'], name='debt_open_debtor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='debt',
+            index=models.Index(condition=models.Q(('is_settled', False)), fields=['creditor', 'group'], name='debt_open_creditor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='debt',
+            index=models.Index(condition=models.Q(('is_settled', False)), fields=['group', 'creditor', 'debtor'], name='debt_open_group_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='split',
+            index=models.Index(fields=['user', 'expense'], name='split_user_expense_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:36
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0014_debt_index_pack'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_payments', to='expenses.group')),
+                ('payee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_payments_received', to=settings.AUTH_USER_MODEL)),
+                ('payer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_payments_made', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'expenses_payment_archive',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['payer'], name='expenses_pa_payer_i_eaf86a_idx'), models.Index(fields=['group'], name='expenses_pa_group_i_5c449f_idx'), models.Index(fields=['created_at'], name='expenses_pa_created_b6a88c_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SplitArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount_owed', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('percentage', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expense', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_splits', to='expenses.expense')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_expense_splits', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'expenses_split_archive',
+                'indexes': [models.Index(fields=['user', 'expense'], name='split_archive_user_idx'), models.Index(fields=['created_at'], name='expenses_sp_created_ceaffe_idx')],
+                'unique_together': {('expense', 'user')},
+            },
+        ),
+    ]
@@ -1,7 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
+from django.core.exceptions import ValidationError
 
 # Add the CURRENCY_CHOICES definition
 CURRENCY_CHOICES = [
@@ -25,6 +26,11 @@ class Group(models.Model):
     members = models.ManyToManyField(User, related_name='expense_groups')  # Changed related_name from 'groups' to 'expense_groups'
     admin = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='administered_groups')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Counters kept in step by the membership and expense write paths,
+    # checked and repaired by the rebuild_group_counters command
+    member_count = models.IntegerField(default=0)
+    expense_count = models.IntegerField(default=0)
+    total_spent = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
 
     class Meta:
         ordering = ['-created_at']
@@ -117,7 +123,8 @@ class Split(models.Model):
         unique_together = ('expense', 'user')
         indexes = [
             models.Index(fields=['expense']),
-            models.Index(fields=['user']),
+            # Covers "expenses the user has a share in" without touching the table
+            models.Index(fields=['user', 'expense'], name='split_user_expense_idx'),
         ]
 
     def __str__(self):
@@ -127,10 +134,13 @@ class Split(models.Model):
 class Debt(models.Model):
     """
     Represents the net debt between two users, possibly within a specific group.
-    This model helps track who owes whom and how much.
+    This model helps track who owes whom and how much. Open rows mirror the
+    ledger, which already has every Payment taken off, so a pair's open debt is
+    what their expenses say minus what has been paid back.
     """
-    creditor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='credits')
-    debtor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='debts')
+    # Lookups by either side go through the open-debt indexes below
+    creditor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='credits', db_index=False)
+    debtor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='debts', db_index=False)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='group_debts', null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -138,11 +148,23 @@ class Debt(models.Model):
     expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='debt_set', null=True, blank=True)
 
     class Meta:
-        unique_together = ('creditor', 'debtor', 'group')
+        # Only one open debt per pair and direction. Settling records a Payment
+        # instead of flagging the row; is_settled stays for rows from older versions
+        constraints = [
+            models.UniqueConstraint(
+                fields=['creditor', 'debtor', 'group'],
+                condition=models.Q(is_settled=False),
+                name='unique_open_debt',
+            ),
+        ]
+        # Balance queries only ever want open debts, by either side of the pair or by
+        # group, so these cover just the open rows. Settling deletes debts rather
+        # than flagging them, so that is every row. The creditor and debtor foreign
+        # keys have no index of their own, otherwise SQLite picks those instead.
         indexes = [
-            models.Index(fields=['creditor']),
-            models.Index(fields=['debtor']),
-            models.Index(fields=['group']),
+            models.Index(fields=['debtor', 'group'], condition=models.Q(is_settled=False), name='debt_open_debtor_idx'),
+            models.Index(fields=['creditor', 'group'], condition=models.Q(is_settled=False), name='debt_open_creditor_idx'),
+            models.Index(fields=['group', 'creditor', 'debtor'], condition=models.Q(is_settled=False), name='debt_open_group_idx'),
             models.Index(fields=['updated_at']),
         ]
 
@@ -151,6 +173,165 @@ class Debt(models.Model):
         return f"{self.debtor.username} owes {self.creditor.username} ${self.amount}{group_str}"
 
 
+class Payment(models.Model):
+    """
+    Money paid from one user to another to settle up, possibly within a group.
+    Payments are only ever inserted: settling never rewrites Debt rows, the
+    ledger takes each payment as a debt in the opposite direction instead.
+    """
+    payer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payments_made')
+    payee = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payments_received')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='payments', null=True, blank=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['payer']),
+            models.Index(fields=['payee']),
+            models.Index(fields=['group']),
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        group_str = f" in {self.group.name}" if self.group else ""
+        return f"{self.payer.username} paid {self.payee.username} ${self.amount}{group_str}"
+
+
+class PaymentArchive(models.Model):
+    """
+    A Payment moved out of the hot table by archive_settled_history.
+    Rows keep their original id and timestamps and are never changed again.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    payer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_payments_made')
+    payee = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_payments_received')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='archived_payments', null=True, blank=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'expenses_payment_archive'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['payer']),
+            models.Index(fields=['group']),
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.payer_id} paid {self.payee_id} ${self.amount} (archived)"
+
+
+class SplitArchive(models.Model):
+    """
+    A Split of a fully settled expense, moved out of the hot table by
+    archive_settled_history. created_at is the expense's, so history pages can
+    tell whether a date range reaches back into archived periods.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='archived_splits')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_expense_splits')
+    amount_owed = models.DecimalField(max_digits=10, decimal_places=2)
+    percentage = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'expenses_split_archive'
+        unique_together = ('expense', 'user')
+        indexes = [
+            models.Index(fields=['user', 'expense'], name='split_archive_user_idx'),
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} owed ${self.amount_owed} for {self.expense_id} (archived)"
+
+
+class PairBalance(models.Model):
+    """
+    Running net balance between two users within a group.
+    There is exactly one row per unordered pair: low_user always has the smaller id,
+    and a positive amount means high_user owes low_user (negative means the reverse).
+    """
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='pair_balances')
+    low_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    high_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('group', 'low_user', 'high_user')
+
+    def __str__(self):
+        return f"{self.low_user_id}/{self.high_user_id} in {self.group_id}: {self.amount}"
+
+
+class MemberBalance(models.Model):
+    """
+    Per-user position within a group, kept up to date with every split and settlement.
+    paid is the total of expenses the user paid for, owed and to_receive mirror the
+    user's unsettled debts, and net is to_receive minus owed.
+    """
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='member_balances')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='member_balances')
+    paid = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    owed = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    to_receive = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    net = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('group', 'user')
+
+    def __str__(self):
+        return f"{self.user_id} in {self.group_id}: {self.net}"
+
+
+class UserStats(models.Model):
+    """
+    Lifetime figures for a user across all groups, read by the profile page.
+    paid, owed and to_receive are the sums of the user's MemberBalance rows and
+    move with them. settled_debt_count counts payments the user has made, and
+    last_activity is when an expense or settlement last touched their balances.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    total_paid = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    owed = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    to_receive = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    settled_debt_count = models.IntegerField(default=0)
+    last_activity = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Stats for {self.user_id}"
+
+
+class LedgerQueueEntry(models.Model):
+    """
+    A ledger change waiting to be applied by the drain_ledger_queue worker.
+    Written in the same transaction as the expense when posting asynchronously.
+    With a debtor it is a debt of `amount` owed to the creditor, without one it
+    adds `amount` to what the creditor has paid in the group.
+    """
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='ledger_queue')
+    creditor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    debtor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', null=True, blank=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group']),
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.debtor_id} -> {self.creditor_id} in {self.group_id}: {self.amount}"
+
+
 class RecurringExpense(models.Model):
     """
     Represents an expense that repeats at regular intervals.
@@ -187,6 +368,8 @@ class RecurringExpense(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     # Fix the syntax error - remove the unexpected parentheses
     split_details = models.TextField(blank=True, null=True)  # Add this field if it doesn't exist
+    # Resolved split, built by expense_utils.compile_split_plan when the expense is saved
+    split_plan = models.JSONField(default=dict, blank=True)
 
     class Meta:
         ordering = ['next_due_date']
@@ -200,6 +383,46 @@ class RecurringExpense(models.Model):
     def __str__(self):
         return f"{self.title} - ${self.amount} - {self.get_frequency_display()} - Next due: {self.next_due_date}"
 
+    # Fields the split plan is compiled from, plus the plan itself
+    SPLIT_PLAN_FIELDS = {'amount', 'paid_by', 'paid_by_id', 'split_type', 'split_plan'}
+
+    def save(self, *args, **kwargs):
+        # Partial saves that leave the plan and its inputs alone, such as the
+        # next_due_date bump after generating, skip the check
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or self.SPLIT_PLAN_FIELDS.intersection(update_fields):
+            self.validate_split_plan()
+        super().save(*args, **kwargs)
+
+    def validate_split_plan(self):
+        """
+        Reject a split plan that doesn't match this expense. save() calls it, the
+        views call it first to report failures on the form, and the generator
+        before applying a plan saved before it was checked. Not part of clean(),
+        since forms validate before the view compiles the new plan.
+        """
+        plan = self.split_plan or {}
+        try:
+            rows = plan['participants']
+            user_ids = [int(user_id) for user_id, _, _ in rows]
+            shares = [Decimal(share) for _, _, share in rows]
+            remainder = Decimal(plan['remainder'])
+            amount = Decimal(plan['amount'])
+        except (KeyError, TypeError, ValueError, InvalidOperation):
+            raise ValidationError("Recurring expense has no valid split plan.")
+
+        if plan.get('split_type') != self.split_type:
+            raise ValidationError("Split plan was compiled for a different split type.")
+        if amount != Decimal(str(self.amount)) or plan.get('paid_by') != self.paid_by_id:
+            raise ValidationError("Split plan is out of date, the amount or payer has changed.")
+        if not user_ids or len(set(user_ids)) != len(user_ids) or self.paid_by_id not in user_ids:
+            raise ValidationError("Split plan must list each participant once, including the payer.")
+        if any(share < 0 for share in shares) or sum(shares) + remainder != amount:
+            raise ValidationError("Split plan shares don't add up to the expense amount.")
+        # Only rounding may be left over, at most a cent per participant
+        if abs(remainder) >= Decimal('0.01') * len(user_ids):
+            raise ValidationError("Split plan shares don't add up to the expense amount.")
+
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -0,0 +1,71 @@
+"""
+Query budgets for the busiest pages, and the data to check them against.
+Shared by the test suite, which enforces the budgets, and check_query_budgets,
+which reports them for sizes the tests don't reach.
+"""
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.urls import reverse
+from .models import Group, Expense, Split
+from .expense_utils import build_splits, split_deltas, apply_debt_deltas
+
+
+# Pages whose query count must stay flat however much data sits behind them,
+# with the most queries a single page load may take with an empty balance cache
+PAGE_QUERY_BUDGETS = [
+    ('dashboard', lambda fixture: reverse('dashboard'), 9),
+    ('group_list', lambda fixture: reverse('group_list'), 5),
+    ('group_detail', lambda fixture: reverse('group_detail', args=[fixture['groups'][0].id]), 8),
+    ('group_settlement_summary', lambda fixture: reverse('group_settlement_summary', args=[fixture['groups'][0].id]), 8),
+]
+
+def build_query_fixture(size):
+    """
+    A user in `size` groups, each with its own two counterparties and a few
+    expenses both ways. The first group also has `size` members and expenses.
+    Rows are bulk inserted, like import_expenses does, so large sizes stay quick.
+    """
+    users = User.objects.bulk_create([
+        User(username=f'budget_{size}_{i}') for i in range(2 * size + 1)
+    ])
+    user = users[0]
+
+    groups = Group.objects.bulk_create([
+        Group(name=f'Budget group {index}', admin=user) for index in range(size)
+    ])
+    memberships, expenses, members_of = [], [], {}
+    for index, group in enumerate(groups):
+        members = users if index == 0 else [user, *users[1 + 2 * index:3 + 2 * index]]
+        members_of[group.id] = members
+        memberships.extend(
+            Group.members.through(group_id=group.id, user_id=member.id) for member in members
+        )
+
+        expense_count = max(size, 6) if index == 0 else 6
+        for i in range(expense_count):
+            expenses.append(Expense(
+                title=f'Budget expense {i}',
+                amount=Decimal('30.00'),
+                # Alternate between two payers so balances never net out to zero
+                paid_by=members[i % 2],
+                group=group,
+                split_type='EQUAL'
+            ))
+    Group.members.through.objects.bulk_create(memberships)
+    Expense.objects.bulk_create(expenses)
+
+    splits, deltas, paid = [], {}, {}
+    for expense in expenses:
+        expense_splits = build_splits(expense, 'EQUAL', [member.id for member in members_of[expense.group_id]])
+        splits.extend(expense_splits)
+        group_deltas = deltas.setdefault(expense.group_id, {})
+        for key, amount in split_deltas(expense, expense_splits).items():
+            group_deltas[key] = group_deltas.get(key, Decimal('0.00')) + amount
+        group_paid = paid.setdefault(expense.group_id, {})
+        group_paid[expense.paid_by_id] = group_paid.get(expense.paid_by_id, Decimal('0.00')) + expense.amount
+    Split.objects.bulk_create(splits, batch_size=1000)
+
+    for group in groups:
+        apply_debt_deltas(group, deltas[group.id], paid=paid[group.id])
+
+    return {'user': user, 'groups': groups}
@@ -1,13 +1,11 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.core.exceptions import ValidationError
 from django.db import transaction
-from django.utils import timezone
-from decimal import Decimal
-from .models import RecurringExpense, Expense
+from .models import RecurringExpense
 from .forms import RecurringExpenseForm
-from .expense_utils import handle_equal_split, handle_percentage_split, handle_direct_split
-import json
+from .expense_utils import compile_posted_split_plan, generate_expense_from_recurring, update_next_due_date
 
 @login_required
 def recurring_expenses(request):
@@ -48,47 +46,30 @@ def add_recurring_expense(request):
                 participants = list(participants)
                 participants.append(paid_by)
             
+            recurring_expense = RecurringExpense(
+                title=title,
+                amount=amount,
+                paid_by=paid_by,
+                group=group,
+                frequency=frequency,
+                split_type=split_type,
+                next_due_date=next_due_date
+            )
+            # Resolve the split now, so generating the expense later is a plain apply step
+            try:
+                compile_posted_split_plan(recurring_expense, request.POST, participants)
+            except ValidationError as e:
+                messages.error(request, e.messages[0])
+                return render(request, 'expenses/add_recurring_expense.html', {'form': form})
+
             try:
                 with transaction.atomic():
                     # Create the recurring expense
-                    recurring_expense = RecurringExpense.objects.create(
-                        title=title,
-                        amount=amount,
-                        paid_by=paid_by,
-                        group=group,
-                        frequency=frequency,
-                        split_type=split_type,
-                        next_due_date=next_due_date
-                    )
+                    recurring_expense.save()
                     
                     # Add participants
                     recurring_expense.participants.set(participants)
                     
-                    # Handle different split types for future reference
-                    if split_type == 'PERCENTAGE':
-                        # Store percentages as metadata
-                        percentages = {}
-                        for participant in participants:
-                            percentage_key = f'percentage_{participant.id}'
-                            if percentage_key in request.POST:
-                                percentages[str(participant.id)] = request.POST[percentage_key]
-                        
-                        # Save percentages as JSON in a new field or related model
-                        recurring_expense.split_details = json.dumps(percentages)
-                        recurring_expense.save()
-                        
-                    elif split_type == 'DIRECT':
-                        # Store direct amounts as metadata
-                        direct_amounts = {}
-                        for participant in participants:
-                            amount_key = f'amount_{participant.id}'
-                            if amount_key in request.POST:
-                                direct_amounts[str(participant.id)] = request.POST[amount_key]
-                        
-                        # Save direct amounts as JSON
-                        recurring_expense.split_details = json.dumps(direct_amounts)
-                        recurring_expense.save()
-                    
                     messages.success(request, f"Recurring expense '{title}' was added successfully!")
                     return redirect('recurring_expenses')
             
@@ -130,6 +111,14 @@ def edit_recurring_expense(request, expense_id):
                 participants = list(participants)
                 participants.append(recurring_expense.paid_by)
             
+            # Resolve the split now, so generating the expense later is a plain apply step
+            try:
+                # form.is_valid() already copied the new values onto the instance
+                compile_posted_split_plan(recurring_expense, request.POST, participants)
+            except ValidationError as e:
+                messages.error(request, e.messages[0])
+                return render(request, 'expenses/edit_recurring_expense.html', {'form': form, 'expense': recurring_expense})
+
             try:
                 with transaction.atomic():
                     # Update the recurring expense
@@ -138,32 +127,6 @@ def edit_recurring_expense(request, expense_id):
                     # Update participants
                     recurring_expense.participants.set(participants)
                     
-                    # Handle different split types for future reference
-                    split_type = form.cleaned_data['split_type']
-                    if split_type == 'PERCENTAGE':
-                        # Store percentages as metadata
-                        percentages = {}
-                        for participant in participants:
-                            percentage_key = f'percentage_{participant.id}'
-                            if percentage_key in request.POST:
-                                percentages[str(participant.id)] = request.POST[percentage_key]
-                        
-                        # Save percentages as JSON
-                        recurring_expense.split_details = json.dumps(percentages)
-                        recurring_expense.save()
-                        
-                    elif split_type == 'DIRECT':
-                        # Store direct amounts as metadata
-                        direct_amounts = {}
-                        for participant in participants:
-                            amount_key = f'amount_{participant.id}'
-                            if amount_key in request.POST:
-                                direct_amounts[str(participant.id)] = request.POST[amount_key]
-                        
-                        # Save direct amounts as JSON
-                        recurring_expense.split_details = json.dumps(direct_amounts)
-                        recurring_expense.save()
-                    
                     messages.success(request, f"Recurring expense '{recurring_expense.title}' was updated successfully!")
                     return redirect('recurring_expenses')
             
@@ -221,67 +184,3 @@ def generate_recurring_expense_now(request, expense_id):
     
     return redirect('recurring_expenses')
 
-def generate_expense_from_recurring(recurring_expense):
-    """Generate a new expense from a recurring expense"""
-    with transaction.atomic():
-        # Create the expense
-        expense = Expense.objects.create(
-            title=f"{recurring_expense.title} (Recurring: {recurring_expense.get_frequency_display()})",
-            amount=recurring_expense.amount,
-            paid_by=recurring_expense.paid_by,
-            group=recurring_expense.group,
-            split_type=recurring_expense.split_type
-        )
-        
-        # Get participants
-        participants = recurring_expense.participants.all()
-        
-        # Handle different split types
-        if recurring_expense.split_type == 'EQUAL':
-            handle_equal_split(expense, participants)
-        elif recurring_expense.split_type == 'PERCENTAGE':
-            # Get percentages from stored metadata
-            try:
-                percentages = json.loads(recurring_expense.split_details)
-                percentage_dict = {int(k): Decimal(v) for k, v in percentages.items()}
-                handle_percentage_split(expense, participants, percentage_dict)
-            except (json.JSONDecodeError, AttributeError):
-                # Fallback to equal split if percentages are not available
-                handle_equal_split(expense, participants)
-        elif recurring_expense.split_type == 'DIRECT':
-            # Get direct amounts from stored metadata
-            try:
-                direct_amounts = json.loads(recurring_expense.split_details)
-                amount_dict = {int(k): Decimal(v) for k, v in direct_amounts.items()}
-                handle_direct_split(expense, participants, amount_dict)
-            except (json.JSONDecodeError, AttributeError):
-                # Fallback to equal split if direct amounts are not available
-                handle_equal_split(expense, participants)
-        
-        return expense
-
-def update_next_due_date(recurring_expense):
-    """Update the next due date based on frequency"""
-    current_date = recurring_expense.next_due_date
-    
-    if recurring_expense.frequency == 'DAILY':
-        next_date = current_date + timezone.timedelta(days=1)
-    elif recurring_expense.frequency == 'WEEKLY':
-        next_date = current_date + timezone.timedelta(weeks=1)
-    elif recurring_expense.frequency == 'MONTHLY':
-        # Add one month (handle month boundaries)
-        month = current_date.month + 1
-        year = current_date.year
-        if month > 12:
-            month = 1
-            year += 1
-        
-        # Handle different month lengths
-        day = min(current_date.day, [31, 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month-1])
-        next_date = timezone.datetime(year, month, day).date()
-    else:
-        # Default to one month if frequency is unknown
-        next_date = current_date + timezone.timedelta(days=30)
-    
-    recurring_expense.next_due_date = next_date
-    recurring_expense.save()
\ No newline at end of file
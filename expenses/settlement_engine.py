@@ -0,0 +1,235 @@
+"""
+Minimum cash-flow settlement.
+
+Given everyone's net balance in a group, find payments that bring every
+balance to zero. All amounts are integer minor units (cents), so there is no
+rounding and nothing is left over.
+
+Settling a set of balances that sums to zero takes one payment less than the
+number of people in it. So the fewest payments overall come from splitting the
+group into as many separate zero-sum subsets as possible. That is exact for small
+groups (a bitmask search over subsets). Larger groups use a heap-based pass that
+pays the largest debt to the largest credit first, which never needs more than
+one payment less than the number of people with a balance.
+
+net_across_groups does the same job for one user's debts across all their
+groups, with one payment per counterparty allocated back to the group debts.
+BalanceSheet holds a group's balances for trying out payments in memory.
+"""
+import heapq
+from array import array
+from decimal import Decimal
+from django.conf import settings
+
+CENT = Decimal('0.01')
+
+# Most people with a non-zero balance the exact search is run for.
+# The search takes about 2^n * n steps, so 14 stays well under 100ms.
+EXACT_LIMIT = 14
+
+
+def to_cents(amount):
+    """Decimal amount to integer minor units."""
+    return int((Decimal(amount) / CENT).to_integral_value())
+
+def from_cents(cents):
+    return (Decimal(cents) * CENT).quantize(CENT)
+
+def settle_balances(balances, exact_limit=None):
+    """
+    Payments that settle `balances`, a mapping of key -> net cents (positive is
+    owed money, negative owes money). Keys can be anything: user ids, users...
+    Returns a list of (payer_key, payee_key, cents).
+    Raises ValueError if the balances don't add up to zero.
+    """
+    if exact_limit is None:
+        exact_limit = getattr(settings, 'SETTLEMENT_EXACT_LIMIT', EXACT_LIMIT)
+
+    keys = [key for key, cents in balances.items() if cents]
+    amounts = [balances[key] for key in keys]
+    if sum(amounts) != 0:
+        raise ValueError(f"Balances add up to {sum(amounts)} cents instead of zero")
+
+    # A debt that exactly matches a credit is always one payment in an optimal plan
+    payments, rest = cancel_matching_pairs(amounts)
+
+    if len(rest) <= exact_limit:
+        for block in zero_sum_blocks([amounts[index] for index in rest]):
+            payments.extend(heap_settle(amounts, [rest[position] for position in block]))
+    else:
+        payments.extend(heap_settle(amounts, rest))
+
+    return [(keys[payer], keys[payee], cents) for payer, payee, cents in payments]
+
+def cancel_matching_pairs(amounts):
+    """
+    Pair off debts and credits of exactly the same size.
+    Returns the payments between them and the indexes still to settle.
+    """
+    open_credits = {}
+    for index, cents in enumerate(amounts):
+        if cents > 0:
+            open_credits.setdefault(cents, []).append(index)
+
+    payments, rest, matched = [], [], set()
+    for index, cents in enumerate(amounts):
+        if cents < 0 and open_credits.get(-cents):
+            payee = open_credits[-cents].pop()
+            payments.append((index, payee, -cents))
+            matched.add(payee)
+        elif cents < 0:
+            rest.append(index)
+    rest.extend(index for index, cents in enumerate(amounts) if cents > 0 and index not in matched)
+    return payments, sorted(rest)
+
+def zero_sum_blocks(amounts):
+    """
+    Split `amounts` (summing to zero) into the largest possible number of
+    zero-sum blocks. best[mask] is the most zero-sum blocks the members in mask
+    can be cut into, found by dropping one member at a time.
+    Returns a list of blocks, each a list of positions in `amounts`.
+    """
+    count = len(amounts)
+    if not count:
+        return []
+    full = (1 << count) - 1
+
+    sums = [0] * (full + 1)
+    best = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        lowest = mask & -mask
+        sums[mask] = sums[mask ^ lowest] + amounts[lowest.bit_length() - 1]
+
+        most, rest = 0, mask
+        while rest:
+            bit = rest & -rest
+            if best[mask ^ bit] > most:
+                most = best[mask ^ bit]
+            rest ^= bit
+        best[mask] = most + (sums[mask] == 0)
+
+    # Walk back down, every zero-sum mask on the way closes a block
+    blocks, mask, block_start = [], full, full
+    while mask:
+        needed = best[mask] - (sums[mask] == 0)
+        rest = mask
+        while rest:
+            bit = rest & -rest
+            if best[mask ^ bit] == needed:
+                break
+            rest ^= bit
+        mask ^= bit
+        if sums[mask] == 0:
+            block = block_start ^ mask
+            blocks.append([position for position in range(count) if block >> position & 1])
+            block_start = mask
+    return blocks
+
+def heap_settle(amounts, indexes):
+    """
+    Settle the given members by repeatedly paying the largest debt to the largest
+    credit. Every payment clears at least one of the two, so a zero-sum set of n
+    members takes at most n - 1 payments. O(n log n).
+    Returns a list of (payer_index, payee_index, cents).
+    """
+    debtors = [(amounts[index], index) for index in indexes if amounts[index] < 0]
+    creditors = [(-amounts[index], index) for index in indexes if amounts[index] > 0]
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+
+    payments = []
+    while debtors and creditors:
+        debt, payer = heapq.heappop(debtors)
+        credit, payee = heapq.heappop(creditors)
+        cents = min(-debt, -credit)
+        payments.append((payer, payee, cents))
+
+        # Whatever is left of the larger side goes back on its heap
+        if -debt > cents:
+            heapq.heappush(debtors, (debt + cents, payer))
+        if -credit > cents:
+            heapq.heappush(creditors, (credit + cents, payee))
+    return payments
+
+def net_across_groups(user_id, debts):
+    """
+    Net a user's open debts with each counterparty across all groups, so someone
+    the user owes in five groups gets one payment instead of five.
+    Debts in opposite directions cancel out, then a single payment covers the rest.
+    Every payment has the user on one side, so the user can record it alone; for
+    debts that all involve the user that is already the fewest payments possible.
+
+    Returns one entry per counterparty, largest payment first:
+    {'counterparty_id', 'payer_id', 'payee_id', 'cents',
+     'allocations': [(debt, cents, offset)]}
+    where each allocation says how many cents of which group debt the payment
+    clears, or that cancel against the other direction (offset=True).
+    Between them the allocations cover every debt in full.
+    """
+    by_counterparty = {}
+    for debt in sorted(debts, key=lambda debt: debt.pk):
+        if debt.creditor_id == user_id:
+            sides = by_counterparty.setdefault(debt.debtor_id, ([], []))
+            sides[0].append(debt)
+        elif debt.debtor_id == user_id:
+            sides = by_counterparty.setdefault(debt.creditor_id, ([], []))
+            sides[1].append(debt)
+
+    transfers = []
+    for counterparty_id, (owed_to_user, owed_by_user) in by_counterparty.items():
+        incoming = sum(to_cents(debt.amount) for debt in owed_to_user)
+        outgoing = sum(to_cents(debt.amount) for debt in owed_by_user)
+
+        # The smaller direction cancels out completely against the larger one
+        larger, smaller = (owed_to_user, owed_by_user) if incoming >= outgoing else (owed_by_user, owed_to_user)
+        to_offset = min(incoming, outgoing)
+        allocations = [(debt, to_cents(debt.amount), True) for debt in smaller]
+        for debt in larger:
+            cents = to_cents(debt.amount)
+            offset = min(cents, to_offset)
+            to_offset -= offset
+            if offset:
+                allocations.append((debt, offset, True))
+            if cents > offset:
+                allocations.append((debt, cents - offset, False))
+
+        transfers.append({
+            'counterparty_id': counterparty_id,
+            'payer_id': counterparty_id if incoming >= outgoing else user_id,
+            'payee_id': user_id if incoming >= outgoing else counterparty_id,
+            'cents': abs(incoming - outgoing),
+            'allocations': allocations,
+        })
+
+    transfers.sort(key=lambda transfer: (-transfer['cents'], transfer['counterparty_id']))
+    return transfers
+
+class BalanceSheet:
+    """
+    A group's net balances for "what if" questions, with one slot per member in
+    a flat array of cents. Loading it is one pass over the balances, a payment is
+    two array updates, and nothing is ever written back to the database.
+    """
+
+    def __init__(self, balances):
+        """`balances` maps a key (a user id) to net cents, positive when owed money."""
+        self.keys = list(balances)
+        self.index = {key: position for position, key in enumerate(self.keys)}
+        self.cents = array('q', (balances[key] for key in self.keys))
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def pay(self, payer, payee, cents):
+        """Apply a payment from payer to payee: the payer owes less, the payee is owed less."""
+        self.cents[self.index[payer]] += cents
+        self.cents[self.index[payee]] -= cents
+
+    def balances(self):
+        """Return {key: net cents} for everyone on the sheet."""
+        return dict(zip(self.keys, self.cents))
+
+    def settlement_plan(self, exact_limit=None):
+        """The fewest payments that settle the sheet as it stands, largest first."""
+        payments = settle_balances(self.balances(), exact_limit)
+        return sorted(payments, key=lambda payment: -payment[2])
@@ -0,0 +1,33 @@
+from django.db.models import F
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+from .models import Group
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def count_members(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep Group.member_count in step with every change to group membership,
+    from either side of the relation (group.members or user.expense_groups).
+    """
+    if action == 'post_add':
+        # Django only reports the rows it actually inserted
+        if reverse:
+            Group.objects.filter(pk__in=pk_set).update(member_count=F('member_count') + 1)
+        else:
+            Group.objects.filter(pk=instance.pk).update(member_count=F('member_count') + len(pk_set))
+
+    elif action == 'pre_remove':
+        # pk_set is whatever was asked for, so count the rows that really go
+        if reverse:
+            memberships = sender.objects.filter(user_id=instance.pk, group_id__in=pk_set)
+            Group.objects.filter(pk__in=memberships.values('group_id')).update(member_count=F('member_count') - 1)
+        else:
+            removed = sender.objects.filter(group_id=instance.pk, user_id__in=pk_set).count()
+            Group.objects.filter(pk=instance.pk).update(member_count=F('member_count') - removed)
+
+    elif action == 'pre_clear':
+        if reverse:
+            Group.objects.filter(members=instance).update(member_count=F('member_count') - 1)
+        else:
+            Group.objects.filter(pk=instance.pk).update(member_count=0)
@@ -1,3 +1,1032 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from .models import (
+    Group, Expense, Split, Debt, Payment, PaymentArchive, SplitArchive, RecurringExpense, LedgerQueueEntry,
+    UserStats
+)
+from .expense_utils import (
+    handle_equal_split, compile_split_plan, plan_splits,
+    generate_expense_from_recurring, update_next_due_date, settle_debts, update_expense, delete_expense,
+    drain_ledger_queue, settle_payment
+)
+from .ledger import group_member_balances, open_debts_of, refresh_user_stats
+from .management.commands.check_query_plans import QUERIES, full_scans
+from .management.commands.rebuild_ledger import compute_group_ledgers, diff_group_ledger
+from .management.commands.stress_ledger import post_expenses
+from .management.commands.generate_recurring_expenses import generate_due
+from .balance_cache import bump_group_version
+from .query_budgets import PAGE_QUERY_BUDGETS, build_query_fixture
+from .checks import check_balance_cache
+from .settlement_engine import (
+    settle_balances, cancel_matching_pairs, zero_sum_blocks, heap_settle, net_across_groups, BalanceSheet
+)
 
-# Create your tests here.
+
+def make_group(name, members):
+    group = Group.objects.create(name=name, admin=members[0])
+    group.members.add(*members)
+    return group
+
+def add_equal_expense(group, paid_by, amount, participants):
+    expense = Expense.objects.create(
+        title='Dinner', amount=Decimal(amount), paid_by=paid_by, group=group, split_type='EQUAL'
+    )
+    handle_equal_split(expense, participants)
+    return expense
+
+def page_query_count(client, url):
+    """
+    Queries one page load takes, measured on the second load so the session is
+    warm, with the balance cache emptied so the balance queries are counted too.
+    """
+    client.get(url)
+    cache.clear()
+    with CaptureQueriesContext(connection) as captured:
+        response = client.get(url)
+    return response, len(captured)
+
+def ledger_differences(*groups):
+    """What rebuild_ledger --verify reports for the groups, empty while their ledgers are right."""
+    return [
+        difference
+        for group_id, balances, paid in compute_group_ledgers([group.id for group in groups])
+        for difference in diff_group_ledger(group_id, balances, paid)
+    ]
+
+def net_balances(group):
+    return {user.username: row['net_balance'] for user, row in group_member_balances(group).items()}
+
+def leftover_cents(balances, payments):
+    """Total cents still unsettled after the payments, zero for a correct plan."""
+    remaining = dict(balances)
+    for payer, payee, cents in payments:
+        remaining[payer] += cents
+        remaining[payee] -= cents
+    return sum(abs(cents) for cents in remaining.values())
+
+
+class SettlementEngineTests(SimpleTestCase):
+    """The exact / heap settlement engine, on balances in cents."""
+
+    def test_zero_sum_blocks_finds_most_blocks(self):
+        # {-5, 5}, {-3, 1, 2} and {-4, 4} are the best cut, three blocks
+        amounts = [-5, -3, 1, 2, 4, -4, 5]
+        blocks = zero_sum_blocks(amounts)
+        self.assertEqual(len(blocks), 3)
+        self.assertEqual(sorted(position for block in blocks for position in block), list(range(len(amounts))))
+        for block in blocks:
+            self.assertEqual(sum(amounts[position] for position in block), 0)
+
+    def test_zero_sum_blocks_of_one_block(self):
+        self.assertEqual(zero_sum_blocks([-6, 1, 2, 3]), [[0, 1, 2, 3]])
+        self.assertEqual(zero_sum_blocks([]), [])
+
+    def test_cancel_matching_pairs(self):
+        payments, rest = cancel_matching_pairs([-5, 5, -3, 2, 1, -5])
+        self.assertEqual(payments, [(0, 1, 5)])
+        self.assertEqual(rest, [2, 3, 4, 5])
+
+    def test_heap_settle_takes_at_most_n_minus_one_payments(self):
+        amounts = [-700, -250, -50, 100, 300, 600]
+        payments = heap_settle(amounts, list(range(len(amounts))))
+        self.assertLessEqual(len(payments), len(amounts) - 1)
+        self.assertEqual(leftover_cents(dict(enumerate(amounts)), payments), 0)
+
+    def test_settle_balances_exact_and_heap(self):
+        balances = {'a': -500, 'b': -300, 'c': 100, 'd': 200, 'e': 500}
+        # Exact search: {a, e} and {b, c, d} settle in 1 + 2 payments
+        exact = settle_balances(balances, exact_limit=14)
+        self.assertEqual(len(exact), 3)
+        self.assertEqual(leftover_cents(balances, exact), 0)
+
+        heap = settle_balances(balances, exact_limit=0)
+        self.assertLessEqual(len(heap), len(balances) - 1)
+        self.assertEqual(leftover_cents(balances, heap), 0)
+
+    def test_settle_balances_rejects_balances_that_dont_net_to_zero(self):
+        with self.assertRaises(ValueError):
+            settle_balances({1: 2000, 2: -1000})
+        with self.assertRaises(ValueError):
+            BalanceSheet({1: 2000, 2: -1000}).settlement_plan()
+
+    def test_net_across_groups_allocations_cover_every_debt(self):
+        debts = [
+            Debt(id=1, creditor_id=2, debtor_id=1, amount=Decimal('30.00'), group_id=10),
+            Debt(id=2, creditor_id=2, debtor_id=1, amount=Decimal('15.50'), group_id=11),
+            Debt(id=3, creditor_id=1, debtor_id=2, amount=Decimal('20.00'), group_id=12),
+            Debt(id=4, creditor_id=1, debtor_id=3, amount=Decimal('7.25'), group_id=10),
+        ]
+        transfers = net_across_groups(1, debts)
+        self.assertEqual(
+            [(transfer['payer_id'], transfer['payee_id'], transfer['cents']) for transfer in transfers],
+            [(1, 2, 2550), (3, 1, 725)]
+        )
+
+        covered = {}
+        for transfer in transfers:
+            for debt, cents, offset in transfer['allocations']:
+                covered[debt.id] = covered.get(debt.id, 0) + cents
+        self.assertEqual(covered, {1: 3000, 2: 1550, 3: 2000, 4: 725})
+
+
+class BalanceCacheCheckTests(SimpleTestCase):
+    """The balance cache has to be shared between server processes."""
+
+    def test_shared_cache_passes(self):
+        self.assertEqual(check_balance_cache(None), [])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_per_process_cache_fails(self):
+        self.assertEqual([error.id for error in check_balance_cache(None)], ['expenses.E001'])
+
+    @override_settings(BALANCE_CACHE_ALIAS='balances')
+    def test_missing_alias_fails(self):
+        self.assertEqual([error.id for error in check_balance_cache(None)], ['expenses.E002'])
+
+    def test_tests_have_a_cache_of_their_own(self):
+        config = settings.CACHES['default']
+        self.assertTrue(config['LOCATION'].endswith('-test'))
+        self.assertEqual(config['KEY_PREFIX'], 'splitwisetest')
+
+
+class FormerMemberBalanceTests(TestCase):
+    """A member removed while they still owe money keeps the group's balances netting to zero."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(username) for username in ('alice', 'bob', 'carol')
+        ]
+        self.group = make_group('Trip', [self.alice, self.bob, self.carol])
+        add_equal_expense(self.group, self.alice, '30.00', [self.alice, self.bob, self.carol])
+        self.group.members.remove(self.carol)
+        bump_group_version(self.group.id)
+        self.client.force_login(self.alice)
+
+    def test_former_member_with_balance_is_included(self):
+        balances = group_member_balances(self.group)
+        self.assertEqual(set(balances), {self.alice, self.bob, self.carol})
+        self.assertFalse(balances[self.carol]['is_member'])
+        self.assertEqual(balances[self.carol]['net_balance'], Decimal('-10.00'))
+        self.assertEqual(sum(row['net_balance'] for row in balances.values()), 0)
+
+    def test_group_pages_load(self):
+        response = self.client.get(reverse('group_settlement_summary', args=[self.group.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['settlement_plan']), 2)
+
+        response = self.client.get(reverse('group_detail', args=[self.group.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(self.carol, response.context['members'])
+
+    def test_simulate_settles_former_member(self):
+        response = self.client.post(
+            reverse('simulate_settlement', args=[self.group.id]),
+            json.dumps({'payments': [{'from': self.carol.id, 'to': self.alice.id, 'amount': '10.00'}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['settlement_plan'], [
+            {'from_user_id': self.bob.id, 'to_user_id': self.alice.id, 'amount': '10.00'}
+        ])
+
+    def test_former_member_cannot_view_group(self):
+        self.client.force_login(self.carol)
+        response = self.client.get(reverse('group_settlement_summary', args=[self.group.id]))
+        self.assertRedirects(response, reverse('group_list'), fetch_redirect_response=False)
+
+
+class NetworkSettlementTests(TestCase):
+    """Settling across groups records the plan that was shown, and only that plan."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(username) for username in ('alice', 'bob', 'carol')
+        ]
+        self.flat = make_group('Flat', [self.alice, self.bob])
+        self.trip = make_group('Trip', [self.alice, self.bob])
+        self.dinner = make_group('Dinner', [self.alice, self.carol])
+        add_equal_expense(self.flat, self.alice, '40.00', [self.alice, self.bob])
+        add_equal_expense(self.trip, self.bob, '10.00', [self.alice, self.bob])
+        add_equal_expense(self.dinner, self.carol, '30.00', [self.alice, self.carol])
+        self.client.force_login(self.alice)
+
+    def shown_plan(self):
+        response = self.client.get(reverse('network_settlement'))
+        self.assertEqual(response.context['payment_count'], 2)
+        return response.context['plan']
+
+    def test_recording_the_plan_settles_every_debt(self):
+        response = self.client.post(reverse('network_settlement'), {'plan': self.shown_plan()})
+        self.assertRedirects(response, reverse('settlement_summary'), fetch_redirect_response=False)
+        self.assertEqual(
+            [str(message) for message in get_messages(response.wsgi_request)],
+            ['Recorded 3 payment(s) across 3 group(s), which come down to 2 transfer(s) between people.'],
+        )
+        self.assertEqual(Payment.objects.count(), 3)
+        self.assertFalse(Debt.objects.filter(open_debts_of(self.alice)).exists())
+        for group in (self.flat, self.trip, self.dinner):
+            self.assertTrue(all(row['net_balance'] == 0 for row in group_member_balances(group).values()))
+
+    def test_stale_plan_is_rejected(self):
+        plan = self.shown_plan()
+        add_equal_expense(self.flat, self.alice, '8.00', [self.alice, self.bob])
+        response = self.client.post(reverse('network_settlement'), {'plan': plan})
+        self.assertRedirects(response, reverse('network_settlement'), fetch_redirect_response=False)
+        self.assertIn('changed', str(list(get_messages(response.wsgi_request))[0]))
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(Debt.objects.filter(open_debts_of(self.alice)).count(), 3)
+
+
+class ExpenseShareInputTests(TestCase):
+    """Share fields that aren't numbers are reported on the form instead of failing the request."""
+
+    def setUp(self):
+        self.alice, self.bob = [User.objects.create_user(username) for username in ('alice', 'bob')]
+        self.group = make_group('Flat', [self.alice, self.bob])
+        self.expense = add_equal_expense(self.group, self.alice, '20.00', [self.alice, self.bob])
+        self.client.force_login(self.alice)
+
+    def form_data(self, **shares):
+        return {
+            'title': 'Dinner', 'amount': '20.00', 'paid_by': self.alice.id, 'group': self.group.id,
+            'split_type': 'PERCENTAGE', 'participants': [self.alice.id, self.bob.id], **shares,
+        }
+
+    def test_edit_with_non_numeric_share(self):
+        response = self.client.post(
+            reverse('edit_expense', args=[self.expense.id]),
+            self.form_data(**{f'percentage_{self.alice.id}': 'abc', f'percentage_{self.bob.id}': '50'}),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'valid number')
+        self.assertEqual(self.expense.splits.get(user=self.bob).amount_owed, Decimal('10.00'))
+
+    def test_add_with_non_numeric_share(self):
+        response = self.client.post(
+            reverse('add_expense'),
+            self.form_data(**{f'percentage_{self.alice.id}': '50', f'percentage_{self.bob.id}': 'fifty'}),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Expense.objects.count(), 1)
+
+
+class ImportExpensesTests(TestCase):
+    """import_expenses reports malformed rows and posts every imported chunk's debts with it."""
+
+    def setUp(self):
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(username) for username in ('alice', 'bob', 'carol')
+        ]
+        self.group = make_group('Flat', [self.alice, self.bob, self.carol])
+
+    def run_import(self, rows):
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(handle, 'w') as file:
+            file.writelines(json.dumps(row) + '\n' for row in rows)
+        self.addCleanup(os.remove, path)
+        output = StringIO()
+        call_command('import_expenses', path, '--chunk-size', '2', stdout=output)
+        return output.getvalue()
+
+    def test_malformed_rows_are_reported(self):
+        row = {'title': 'Rent', 'amount': '90.00', 'paid_by': 'alice', 'group': self.group.id,
+               'participants': ['alice', 'bob', 'carol']}
+        with self.assertLogs('expenses.management.commands.import_expenses', 'ERROR') as logs:
+            output = self.run_import([
+                row,
+                {**row, 'date': 20240101},
+                {**row, 'split_type': 'DIRECT', 'shares': 90},
+                {**row, 'participants': 3},
+                {**row, 'title': ['Rent']},
+                {**row, 'paid_by': ['alice']},
+                {**row, 'amount': 'NaN'},
+                {**row, 'split_type': 'DIRECT', 'shares': {'bob': '45.00', 'carol': '45.00'}},
+            ])
+        self.assertIn('Successfully imported 2 expenses', output)
+        self.assertIn('Errors: 6', output)
+        self.assertIn('Line 2: invalid date 20240101', output)
+        self.assertEqual(len(logs.records), 6)
+
+    def test_rows_the_forms_would_reject_are_reported(self):
+        User.objects.create_user('dave')
+        row = {'title': 'Rent', 'amount': '90.00', 'paid_by': 'alice', 'group': self.group.id,
+               'participants': ['alice', 'bob']}
+        with self.assertLogs('expenses.management.commands.import_expenses', 'ERROR'):
+            output = self.run_import([
+                {**row, 'amount': '0'},
+                {**row, 'amount': '-90.00'},
+                {**row, 'amount': '90.001'},
+                {**row, 'split_type': 'DIRECT', 'shares': {'alice': '100.00', 'bob': '-10.00'}},
+                {**row, 'split_type': 'PERCENTAGE', 'shares': {'dave': 50, 'bob': 50}},
+                {**row, 'split_type': 'PERCENTAGE', 'shares': {'alice': 'half', 'bob': 50}},
+                {**row, 'paid_by': 'dave'},
+                {**row, 'participants': ['alice', 'dave']},
+            ])
+        self.assertIn('Successfully imported 0 expenses', output)
+        self.assertIn('Errors: 8', output)
+        self.assertIn('Line 5: Split shares were given for users who are not participants.', output)
+        self.assertIn("Line 8: 'dave' is not a member of group", output)
+        self.assertFalse(Debt.objects.exists())
+
+    def test_each_chunk_posts_its_debts(self):
+        rows = [
+            {'title': f'Groceries {i}', 'amount': '30.00', 'paid_by': ['alice', 'bob'][i % 2],
+             'group': self.group.id, 'participants': 'alice;bob;carol'}
+            for i in range(5)
+        ]
+        self.run_import(rows)
+        self.assertEqual(Expense.objects.filter(group=self.group).count(), 5)
+        (group_id, balances, paid), = compute_group_ledgers([self.group.id])
+        self.assertEqual(diff_group_ledger(group_id, balances, paid), [])
+
+
+class RecurringExpensePlanTests(TestCase):
+    """A split plan is checked when it is saved and again when it is applied."""
+
+    def setUp(self):
+        self.alice, self.bob = [User.objects.create_user(username) for username in ('alice', 'bob')]
+        self.group = make_group('Flat', [self.alice, self.bob])
+        self.recurring = RecurringExpense.objects.create(
+            title='Rent', amount=Decimal('100.00'), paid_by=self.alice, group=self.group,
+            frequency='MONTHLY', next_due_date=date(2024, 1, 31), split_type='EQUAL',
+            split_plan=compile_split_plan(Decimal('100.00'), 'EQUAL', self.alice.id, [self.alice.id, self.bob.id]),
+        )
+
+    def test_out_of_date_plan_is_rejected_on_save(self):
+        self.recurring.amount = Decimal('120.00')
+        with self.assertRaises(ValidationError):
+            self.recurring.save()
+        with self.assertRaises(ValidationError):
+            self.recurring.save(update_fields=['amount'])
+        self.recurring.refresh_from_db()
+        self.assertEqual(self.recurring.amount, Decimal('100.00'))
+
+    def test_due_date_bump_skips_the_check(self):
+        # e.g. a row saved before plans were checked
+        RecurringExpense.objects.filter(pk=self.recurring.pk).update(amount=Decimal('120.00'))
+        self.recurring.refresh_from_db()
+        update_next_due_date(self.recurring)
+        self.recurring.refresh_from_db()
+        self.assertEqual(self.recurring.next_due_date, date(2024, 2, 29))
+
+    def test_out_of_date_plan_is_not_generated(self):
+        RecurringExpense.objects.filter(pk=self.recurring.pk).update(amount=Decimal('120.00'))
+        self.recurring.refresh_from_db()
+        with self.assertRaises(ValidationError):
+            generate_expense_from_recurring(self.recurring)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_edit_recompiles_the_plan(self):
+        self.client.force_login(self.alice)
+        response = self.client.post(reverse('edit_recurring_expense', args=[self.recurring.id]), {
+            'title': 'Rent', 'amount': '120.00', 'group': self.group.id, 'frequency': 'MONTHLY',
+            'next_due_date': '2024-01-31', 'split_type': 'EQUAL', 'paid_by': self.alice.id,
+            'participants': [self.alice.id, self.bob.id],
+        })
+        self.assertRedirects(response, reverse('recurring_expenses'), fetch_redirect_response=False)
+        self.recurring.refresh_from_db()
+        self.recurring.validate_split_plan()
+        self.assertEqual(self.recurring.split_plan['amount'], '120.00')
+
+    def test_add_reads_the_posted_shares(self):
+        self.client.force_login(self.alice)
+        data = {
+            'title': 'Internet', 'amount': '60.00', 'group': self.group.id, 'frequency': 'MONTHLY',
+            'next_due_date': '2024-01-31', 'split_type': 'PERCENTAGE', 'paid_by': self.alice.id,
+            'participants': [self.alice.id, self.bob.id],
+            f'percentage_{self.alice.id}': '25', f'percentage_{self.bob.id}': '75',
+        }
+        response = self.client.post(reverse('add_recurring_expense'), {**data, f'percentage_{self.bob.id}': '70'})
+        self.assertContains(response, 'Percentages must sum to 100%')
+
+        response = self.client.post(reverse('add_recurring_expense'), data)
+        self.assertRedirects(response, reverse('recurring_expenses'), fetch_redirect_response=False)
+        plan = RecurringExpense.objects.get(title='Internet').split_plan
+        self.assertEqual(plan['participants'], [[self.alice.id, '25', '15.00'], [self.bob.id, '75', '45.00']])
+
+
+class ArchiveRoundTripTests(TestCase):
+    """Archiving settled history, rebuilding from it and restoring from it leaves the ledger unchanged."""
+
+    def setUp(self):
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(username) for username in ('alice', 'bob', 'carol')
+        ]
+        self.settled = make_group('Trip', [self.alice, self.bob, self.carol])
+        self.dinner = add_equal_expense(self.settled, self.alice, '30.00', [self.alice, self.bob, self.carol])
+        self.taxi = add_equal_expense(self.settled, self.bob, '12.00', [self.alice, self.bob, self.carol])
+        settle_debts(Debt.objects.filter(group=self.settled, is_settled=False).values_list('pk', flat=True))
+        self.open = make_group('Flat', [self.alice, self.bob])
+        add_equal_expense(self.open, self.alice, '50.00', [self.alice, self.bob])
+
+    def archive(self):
+        call_command('archive_settled_history', '--days', '0', stdout=StringIO())
+
+    def test_archiving_keeps_balances_and_rebuild(self):
+        before = net_balances(self.settled), net_balances(self.open)
+        payments = Payment.objects.count()
+        self.archive()
+
+        self.assertEqual(PaymentArchive.objects.count(), payments)
+        self.assertEqual(SplitArchive.objects.count(), 6)
+        self.assertFalse(Split.objects.filter(expense__group=self.settled).exists())
+        self.assertTrue(Split.objects.filter(expense__group=self.open).exists())
+        self.assertEqual((net_balances(self.settled), net_balances(self.open)), before)
+        self.assertEqual(ledger_differences(self.settled, self.open), [])
+
+    def test_edit_and_delete_restore_archived_splits(self):
+        self.archive()
+
+        update_expense(self.dinner, {'amount': Decimal('36.00')}, [self.alice.id, self.bob.id, self.carol.id])
+        self.assertFalse(SplitArchive.objects.filter(expense=self.dinner).exists())
+        self.assertEqual(self.dinner.splits.count(), 3)
+        self.assertEqual(net_balances(self.settled), {
+            'alice': Decimal('4.00'), 'bob': Decimal('-2.00'), 'carol': Decimal('-2.00'),
+        })
+        self.assertEqual(ledger_differences(self.settled), [])
+
+        delete_expense(self.taxi)
+        self.assertFalse(SplitArchive.objects.exists())
+        self.assertEqual(net_balances(self.settled), {
+            'alice': Decimal('8.00'), 'bob': Decimal('-10.00'), 'carol': Decimal('2.00'),
+        })
+        self.assertEqual(ledger_differences(self.settled), [])
+
+
+@override_settings(LEDGER_ASYNC_POSTING=True)
+class LedgerQueueTests(TestCase):
+    """With async posting, queued ledger changes are applied once, and before the poster reads them back."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(username) for username in ('alice', 'bob', 'carol')
+        ]
+        self.group = make_group('Flat', [self.alice, self.bob, self.carol])
+
+    def test_drain_applies_each_entry_once(self):
+        for payer in (self.alice, self.bob, self.alice):
+            add_equal_expense(self.group, payer, '30.00', [self.alice, self.bob, self.carol])
+        queued = LedgerQueueEntry.objects.count()
+        self.assertFalse(Debt.objects.exists())
+
+        # Small batches merge across calls exactly like one large one
+        drained = 0
+        while applied := drain_ledger_queue(limit=2):
+            drained += applied
+        self.assertEqual(drained, queued)
+        self.assertEqual(drain_ledger_queue(), 0)
+        self.assertFalse(LedgerQueueEntry.objects.exists())
+        self.assertEqual(net_balances(self.group), {
+            'alice': Decimal('30.00'), 'bob': Decimal('0.00'), 'carol': Decimal('-30.00'),
+        })
+        self.assertEqual(ledger_differences(self.group), [])
+
+    def add_expense(self, title, amount, participants):
+        self.client.post(reverse('add_expense'), {
+            'title': title, 'amount': amount, 'paid_by': self.alice.id, 'group': self.group.id,
+            'split_type': 'EQUAL', 'participants': [user.id for user in participants],
+        })
+
+    def test_own_writes_are_applied_before_settling(self):
+        self.client.force_login(self.alice)
+        self.add_expense('Dinner', '30.00', [self.alice, self.bob, self.carol])
+        self.assertTrue(LedgerQueueEntry.objects.exists())
+
+        response = self.client.get(reverse('settle_up', args=[self.group.id]))
+        self.assertEqual(set(response.context['debts_by_debtor']), {self.bob, self.carol})
+        self.assertFalse(LedgerQueueEntry.objects.exists())
+
+        # Bob only owes the full 16.00 once the taxi's queued change is applied
+        self.add_expense('Taxi', '12.00', [self.alice, self.bob])
+        response = self.client.post(reverse('settle_up', args=[self.group.id]), {
+            'settlement_type': 'receive', 'debtor_id': self.bob.id, 'amount': '16.00',
+        })
+        self.assertRedirects(response, reverse('group_detail', args=[self.group.id]), fetch_redirect_response=False)
+        self.assertEqual(Payment.objects.get().amount, Decimal('16.00'))
+        self.assertEqual(net_balances(self.group)['bob'], Decimal('0.00'))
+
+
+class ConditionalGetTests(TestCase):
+    """Balance pages answer repeat polls with a 304 until something they show changes."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(username) for username in ('alice', 'bob', 'carol')
+        ]
+        self.group = make_group('Flat', [self.alice, self.bob])
+        self.expense = add_equal_expense(self.group, self.alice, '20.00', [self.alice, self.bob])
+        self.client.force_login(self.alice)
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_unchanged_group_gets_304_until_an_expense_is_added(self):
+        for name in ('group_detail', 'group_expense_history'):
+            url = reverse(name, args=[self.group.id])
+            etag = self.etag(url)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+            add_equal_expense(self.group, self.bob, '8.00', [self.alice, self.bob])
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_non_member_is_checked_before_the_etag(self):
+        url = reverse('group_expense_history', args=[self.group.id])
+        etag = self.etag(url)
+        self.client.force_login(self.carol)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_history_changes_when_a_left_group_does(self):
+        settle_debts(Debt.objects.filter(group=self.group).values_list('pk', flat=True))
+        self.group.members.remove(self.alice)
+        url = reverse('user_expense_history')
+        etag = self.etag(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        update_expense(self.expense, {'title': 'Groceries'}, [self.alice.id, self.bob.id])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Groceries')
+
+
+class SettleGroupTests(TestCase):
+    """Settling a whole group, or a batch of debts, pays each open debt once and leaves every balance at zero."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(username) for username in ('alice', 'bob', 'carol')
+        ]
+        self.group = make_group('Trip', [self.alice, self.bob, self.carol])
+        add_equal_expense(self.group, self.alice, '30.00', [self.alice, self.bob, self.carol])
+        add_equal_expense(self.group, self.bob, '45.00', [self.alice, self.bob, self.carol])
+        add_equal_expense(self.group, self.carol, '9.00', [self.bob, self.carol])
+        self.url = reverse('settle_up', args=[self.group.id])
+
+    def open_debts(self, *groups):
+        return sorted(
+            Debt.objects.filter(group__in=groups, is_settled=False)
+            .values_list('debtor_id', 'creditor_id', 'group_id', 'amount')
+        )
+
+    def payments(self):
+        return sorted(Payment.objects.values_list('payer_id', 'payee_id', 'group_id', 'amount'))
+
+    def test_only_the_admin_can_settle_all(self):
+        before = self.open_debts(self.group)
+        self.client.force_login(self.bob)
+        response = self.client.post(self.url, {'settlement_type': 'settle_all'})
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(self.open_debts(self.group), before)
+
+    def test_settle_all_pays_every_open_debt_once(self):
+        plan = self.open_debts(self.group)
+        self.assertEqual(len(plan), 3)
+        self.client.force_login(self.alice)
+        response = self.client.post(self.url, {'settlement_type': 'settle_all'})
+        self.assertRedirects(response, reverse('group_detail', args=[self.group.id]), fetch_redirect_response=False)
+
+        self.assertEqual(self.payments(), plan)
+        self.assertEqual(self.open_debts(self.group), [])
+        self.assertEqual(set(net_balances(self.group).values()), {Decimal('0.00')})
+        self.assertEqual(ledger_differences(self.group), [])
+
+    def test_settle_debts_across_groups(self):
+        other = make_group('Flat', [self.alice, self.bob])
+        add_equal_expense(other, self.bob, '16.00', [self.alice, self.bob])
+        plan = self.open_debts(self.group, other)
+
+        settled = settle_debts(Debt.objects.filter(is_settled=False).values_list('pk', flat=True))
+        self.assertEqual(len(settled), len(plan))
+        self.assertEqual(self.payments(), plan)
+        for group in (self.group, other):
+            self.assertEqual(set(net_balances(group).values()), {Decimal('0.00')})
+        self.assertEqual(ledger_differences(self.group, other), [])
+
+
+class GroupCounterTests(TestCase):
+    """Stored group counters follow every expense and membership change, and a recount agrees with them."""
+
+    def setUp(self):
+        self.alice, self.bob, self.carol, self.dave = [
+            User.objects.create_user(username) for username in ('alice', 'bob', 'carol', 'dave')
+        ]
+        self.group = make_group('Flat', [self.alice, self.bob, self.carol])
+        self.other = make_group('Trip', [self.alice, self.bob])
+
+    def counters(self, group):
+        group.refresh_from_db()
+        return group.member_count, group.expense_count, group.total_spent
+
+    def assert_recount_agrees(self):
+        output = StringIO()
+        call_command('rebuild_group_counters', '--verify', stdout=output)
+        self.assertIn('Groups with differences: 0', output.getvalue())
+
+    def test_expense_changes(self):
+        rent = add_equal_expense(self.group, self.alice, '30.00', [self.alice, self.bob, self.carol])
+        taxi = add_equal_expense(self.group, self.bob, '12.00', [self.alice, self.bob])
+        self.assertEqual(self.counters(self.group), (3, 2, Decimal('42.00')))
+
+        update_expense(rent, {'amount': Decimal('45.00')}, [self.alice.id, self.bob.id, self.carol.id])
+        self.assertEqual(self.counters(self.group), (3, 2, Decimal('57.00')))
+
+        update_expense(taxi, {'group': self.other}, [self.alice.id, self.bob.id])
+        self.assertEqual(self.counters(self.group), (3, 1, Decimal('45.00')))
+        self.assertEqual(self.counters(self.other), (2, 1, Decimal('12.00')))
+
+        delete_expense(rent)
+        self.assertEqual(self.counters(self.group), (3, 0, Decimal('0.00')))
+        self.assert_recount_agrees()
+
+    def test_membership_changes(self):
+        # Adding an existing member or removing a non-member changes nothing
+        self.group.members.add(self.bob)
+        self.group.members.remove(self.dave)
+        self.assertEqual(self.counters(self.group)[0], 3)
+
+        self.group.members.add(self.dave)
+        self.dave.expense_groups.add(self.other)
+        self.assertEqual((self.counters(self.group)[0], self.counters(self.other)[0]), (4, 3))
+
+        self.dave.expense_groups.remove(self.group, self.other)
+        self.group.members.remove(self.carol)
+        self.assertEqual((self.counters(self.group)[0], self.counters(self.other)[0]), (2, 2))
+
+        self.bob.expense_groups.clear()
+        self.assertEqual((self.counters(self.group)[0], self.counters(self.other)[0]), (1, 1))
+        self.group.members.clear()
+        self.assertEqual(self.counters(self.group)[0], 0)
+        self.assert_recount_agrees()
+
+
+class UserStatsTests(TestCase):
+    """The UserStats kept up to date by every write match a recompute from scratch."""
+
+    fields = ('total_paid', 'owed', 'to_receive', 'settled_debt_count')
+
+    def setUp(self):
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(username) for username in ('alice', 'bob', 'carol')
+        ]
+        self.flat = make_group('Flat', [self.alice, self.bob, self.carol])
+        self.trip = make_group('Trip', [self.alice, self.bob])
+        rent = add_equal_expense(self.flat, self.alice, '90.00', [self.alice, self.bob, self.carol])
+        add_equal_expense(self.flat, self.carol, '15.00', [self.bob, self.carol])
+        taxi = add_equal_expense(self.trip, self.bob, '40.00', [self.alice, self.bob])
+        update_expense(rent, {'amount': Decimal('120.00')}, [self.alice.id, self.bob.id, self.carol.id])
+        delete_expense(taxi)
+        add_equal_expense(self.trip, self.bob, '22.00', [self.alice, self.bob])
+        settle_payment(self.bob, self.alice, '15.00', group=self.flat)
+        settle_debts(Debt.objects.filter(group=self.trip).values_list('pk', flat=True))
+
+    def stats(self):
+        return {
+            row[0]: row[1:] for row in UserStats.objects.order_by('user_id').values_list('user_id', *self.fields)
+        }
+
+    def rebuild(self, *args):
+        output = StringIO()
+        call_command('rebuild_user_stats', *args, stdout=output)
+        return output.getvalue()
+
+    def test_running_stats_match_a_refresh(self):
+        running = self.stats()
+        self.assertEqual(running[self.bob.id], (Decimal('22.00'), Decimal('32.50'), Decimal('0.00'), 1))
+        refresh_user_stats([self.alice.id, self.bob.id, self.carol.id])
+        self.assertEqual(self.stats(), running)
+        self.assertIn('Users with differences: 0', self.rebuild('--verify'))
+
+    def test_rebuild_repairs_drifted_stats(self):
+        running = self.stats()
+        UserStats.objects.filter(user=self.carol).update(owed=Decimal('999.00'))
+
+        self.assertIn('Users with differences: 1', self.rebuild('--verify'))
+        self.assertEqual(UserStats.objects.get(user=self.carol).owed, Decimal('999.00'))
+        self.assertIn('Repaired: 1', self.rebuild())
+        self.assertEqual(self.stats(), running)
+
+
+class GenerateRecurringExpensesTests(TestCase):
+    """Due recurring expenses are generated in bulk, and a bad row doesn't hold back the rest of its chunk."""
+
+    def setUp(self):
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(username) for username in ('alice', 'bob', 'carol')
+        ]
+        self.flat = make_group('Flat', [self.alice, self.bob, self.carol])
+        self.trip = make_group('Trip', [self.alice, self.bob])
+        self.yesterday = timezone.now().date() - timedelta(days=1)
+        self.rent = self.make_recurring(self.flat, 'Rent', '90.00', [self.alice, self.bob, self.carol])
+        self.power = self.make_recurring(self.flat, 'Power', '30.00', [self.alice, self.carol])
+        self.hotel = self.make_recurring(self.trip, 'Hotel', '50.00', [self.alice, self.bob])
+
+    def make_recurring(self, group, title, amount, participants):
+        recurring = RecurringExpense.objects.create(
+            title=title, amount=Decimal(amount), paid_by=self.alice, group=group, frequency='DAILY',
+            next_due_date=self.yesterday, split_type='EQUAL',
+            split_plan=compile_split_plan(Decimal(amount), 'EQUAL', self.alice.id, [user.id for user in participants]),
+        )
+        recurring.participants.set(participants)
+        return recurring
+
+    def generate(self):
+        output = StringIO()
+        with self.assertLogs('expenses.management.commands.generate_recurring_expenses', 'ERROR'):
+            call_command('generate_recurring_expenses', '--chunk-size', '2', stdout=output)
+        return output.getvalue()
+
+    def due_dates(self):
+        return dict(RecurringExpense.objects.values_list('title', 'next_due_date'))
+
+    def test_bulk_generation_posts_every_due_expense(self):
+        # A plan that no longer matches is reported and left due
+        RecurringExpense.objects.filter(pk=self.power.pk).update(amount=Decimal('35.00'))
+        output = self.generate()
+
+        self.assertIn('Successfully generated 2 expenses. Errors: 1', output)
+        self.assertIn("'Power': Split plan is out of date", output)
+        self.assertEqual(sorted(Expense.objects.values_list('title', flat=True)), [
+            'Hotel (Recurring: Daily)', 'Rent (Recurring: Daily)',
+        ])
+        self.assertEqual(self.due_dates(), {
+            'Rent': self.yesterday + timedelta(days=1), 'Power': self.yesterday,
+            'Hotel': self.yesterday + timedelta(days=1),
+        })
+        self.assertEqual(net_balances(self.flat)['alice'], Decimal('60.00'))
+        self.assertEqual(ledger_differences(self.flat, self.trip), [])
+        self.assert_counters_agree()
+
+    def test_failed_chunk_falls_back_to_single_rows(self):
+        def plan_splits_failing_for_rent(expense, plan):
+            if expense.title.startswith('Rent'):
+                raise ValueError('no splits for rent')
+            return plan_splits(expense, plan)
+
+        with mock.patch('expenses.expense_utils.plan_splits', plan_splits_failing_for_rent):
+            output = self.generate()
+
+        # Rent shares its chunk with Power, which still goes through
+        self.assertIn('Successfully generated 2 expenses. Errors: 1', output)
+        self.assertIn("'Rent': no splits for rent", output)
+        self.assertEqual(sorted(Expense.objects.values_list('title', flat=True)), [
+            'Hotel (Recurring: Daily)', 'Power (Recurring: Daily)',
+        ])
+        self.assertEqual(self.due_dates()['Rent'], self.yesterday)
+        self.assertEqual(ledger_differences(self.flat, self.trip), [])
+        self.assert_counters_agree()
+
+    def assert_counters_agree(self):
+        output = StringIO()
+        call_command('rebuild_group_counters', '--verify', stdout=output)
+        self.assertIn('Groups with differences: 0', output.getvalue())
+
+
+class PageQueryBudgetTests(TestCase):
+    """The main pages take a fixed number of queries, however many groups and members are behind them."""
+
+    sizes = [1, 10, 30]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_query_counts_stay_flat_and_within_budget(self):
+        counts = {name: [] for name, _, _ in PAGE_QUERY_BUDGETS}
+        for size in self.sizes:
+            fixture = build_query_fixture(size)
+            self.client.force_login(fixture['user'])
+            for name, url, _ in PAGE_QUERY_BUDGETS:
+                response, queries = page_query_count(self.client, url(fixture))
+                self.assertEqual(response.status_code, 200, f"{name} at size {size}")
+                counts[name].append(queries)
+
+        for name, _, budget in PAGE_QUERY_BUDGETS:
+            with self.subTest(page=name):
+                self.assertEqual(counts[name], [counts[name][0]] * len(self.sizes), f"{name} grows with data")
+                self.assertLessEqual(max(counts[name]), budget)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are only checked on SQLite')
+class QueryPlanTests(TestCase):
+    """EXPLAIN QUERY PLAN for the hot queries: no full table scans, and open debts come from the partial indexes."""
+
+    def test_no_full_table_scans(self):
+        for name, build in QUERIES:
+            with self.subTest(query=name):
+                self.assertEqual(full_scans(build().explain()), [])
+
+    def test_open_debts_of_user_use_partial_indexes(self):
+        plan = Debt.objects.filter(open_debts_of(1)).explain()
+        self.assertIn('debt_open_creditor_idx', plan)
+        self.assertIn('debt_open_debtor_idx', plan)
+
+    def test_open_debts_outside_groups_use_partial_indexes(self):
+        plan = Debt.objects.filter(open_debts_of(1)).exclude(group_id__in=[1, 2]).explain()
+        self.assertIn('debt_open_creditor_idx', plan)
+        self.assertIn('debt_open_debtor_idx', plan)
+
+    def test_pair_debts_use_open_group_index(self):
+        plan = Debt.objects.filter(
+            group_id=1, is_settled=False, creditor_id__in=[1, 2], debtor_id__in=[1, 2]
+        ).explain()
+        self.assertIn('debt_open_group_idx', plan)
+
+
+class ConcurrentLedgerTests(TransactionTestCase):
+    """Expenses posted from several threads at once leave the ledger exactly as a rebuild from scratch computes it."""
+
+    threads = 4
+    expenses_per_thread = 25
+
+    def test_concurrent_posts_match_rebuild(self):
+        users = [User.objects.create_user(f'stress{i}') for i in range(6)]
+        group = make_group('Stress', users)
+
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            errors = [
+                error
+                for thread_errors in pool.map(
+                    lambda seed: post_expenses(group, users, self.expenses_per_thread, seed), range(self.threads)
+                )
+                for error in thread_errors
+            ]
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Expense.objects.filter(group=group).count(), self.threads * self.expenses_per_thread)
+        (group_id, balances, paid), = compute_group_ledgers([group.id])
+        self.assertEqual(diff_group_ledger(group_id, balances, paid), [])
+
+
+class SpawnedWorkerTests(TransactionTestCase):
+    """Generation spread over spawned worker processes gives the same result as generating in-process."""
+
+    def setUp(self):
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(username) for username in ('alice', 'bob', 'carol')
+        ]
+        self.due = timezone.now().date() - timedelta(days=1)
+        # Two identical sets of groups, one generated in-process and one by the workers
+        self.in_process = [self.make_group(f'In-process {index}') for index in range(2)]
+        self.spawned = [self.make_group(f'Spawned {index}') for index in range(2)]
+
+    def make_group(self, name):
+        group = make_group(name, [self.alice, self.bob, self.carol])
+        for title, amount, split_type, shares in [
+            ('Rent', '100.00', 'EQUAL', None),
+            ('Power', '45.00', 'PERCENTAGE', {self.alice.id: 20, self.bob.id: 30, self.carol.id: 50}),
+        ]:
+            recurring = RecurringExpense.objects.create(
+                title=title, amount=Decimal(amount), paid_by=self.bob, group=group, frequency='MONTHLY',
+                next_due_date=self.due, split_type=split_type,
+                split_plan=compile_split_plan(
+                    Decimal(amount), split_type, self.bob.id, [self.alice.id, self.bob.id, self.carol.id], shares
+                ),
+            )
+            recurring.participants.set([self.alice, self.bob, self.carol])
+        return group
+
+    def outcome(self, groups):
+        return [
+            (
+                sorted(Split.objects.filter(expense__group=group).values_list(
+                    'expense__title', 'expense__amount', 'user__username', 'amount_owed'
+                )),
+                net_balances(group),
+                sorted(group.recurring_expenses.values_list('title', 'next_due_date')),
+            )
+            for group in groups
+        ]
+
+    def test_spawned_workers_match_in_process_generation(self):
+        generated, errors = generate_due(timezone.now().date(), 500, [group.id for group in self.in_process])
+        self.assertEqual((len(generated), errors), (4, []))
+
+        output = StringIO()
+        with mock.patch('multiprocessing.get_all_start_methods', return_value=['spawn']):
+            call_command('generate_recurring_expenses', '--workers', '2', stdout=output)
+        self.assertIn('Spreading 2 groups across 2 workers', output.getvalue())
+        self.assertIn('Successfully generated 4 expenses. Errors: 0', output.getvalue())
+
+        self.assertEqual(self.outcome(self.spawned), self.outcome(self.in_process))
+        self.assertEqual(ledger_differences(*self.in_process, *self.spawned), [])
+
+
+class MigrationTestCase(TransactionTestCase):
+    """Rows are written with the historical models at `migrate_from`, then migrated."""
+
+    migrate_from = None
+
+    def setUp(self):
+        self.latest = MigrationExecutor(connection).loader.graph.leaf_nodes('expenses')
+        self.apps = self.migrate(self.migrate_from)
+
+    def tearDown(self):
+        self.migrate(self.latest[0][1])
+
+    def migrate(self, name):
+        """Migrate the app to `name` and return the historical apps there."""
+        executor = MigrationExecutor(connection)
+        executor.migrate([('expenses', name)])
+        return executor.loader.project_state([('expenses', name)]).apps
+
+
+class SplitPlanMigrationTests(MigrationTestCase):
+    """0010 compiles the plans it can and leaves the rest without one instead of rewriting them."""
+
+    migrate_from = '0009_ledgerqueueentry'
+
+    def test_plans_are_compiled_and_failures_listed(self):
+        User = self.apps.get_model('auth', 'User')
+        Group = self.apps.get_model('expenses', 'Group')
+        RecurringExpense = self.apps.get_model('expenses', 'RecurringExpense')
+        alice, bob = User.objects.create(username='alice'), User.objects.create(username='bob')
+        group = Group.objects.create(name='Flat', admin=alice)
+        rows = {}
+        for title, details in [('Rent', {alice.id: 30, bob.id: 70}), ('Power', {alice.id: 30, bob.id: 30})]:
+            rows[title] = RecurringExpense.objects.create(
+                title=title, amount=Decimal('100.00'), paid_by=alice, group=group, frequency='MONTHLY',
+                next_due_date=date(2024, 1, 31), split_type='PERCENTAGE', split_details=json.dumps(details),
+            )
+            rows[title].participants.set([alice, bob])
+
+        with redirect_stdout(StringIO()) as output:
+            apps = self.migrate('0010_recurringexpense_split_plan')
+
+        RecurringExpense = apps.get_model('expenses', 'RecurringExpense')
+        rent = RecurringExpense.objects.get(pk=rows['Rent'].pk)
+        self.assertEqual(rent.split_plan['participants'], [[alice.id, '30', '30.00'], [bob.id, '70', '70.00']])
+        power = RecurringExpense.objects.get(pk=rows['Power'].pk)
+        self.assertEqual((power.split_type, power.split_plan), ('PERCENTAGE', {}))
+        self.assertIn(f"id {power.pk}: percentages don't sum to 100", output.getvalue())
+
+
+class PaymentMigrationTests(MigrationTestCase):
+    """0013 turns settled debts into payments and back, leaving open debts alone."""
+
+    migrate_from = '0012_userstats'
+
+    def test_settled_debts_round_trip_through_payments(self):
+        User = self.apps.get_model('auth', 'User')
+        Group = self.apps.get_model('expenses', 'Group')
+        Debt = self.apps.get_model('expenses', 'Debt')
+        alice, bob, carol = [User.objects.create(username=name) for name in ('alice', 'bob', 'carol')]
+        group = Group.objects.create(name='Flat', admin=alice)
+        settled_rows = [
+            (bob.id, alice.id, group.id, Decimal('12.50'), datetime(2024, 1, 5, tzinfo=dt_timezone.utc)),
+            (carol.id, alice.id, group.id, Decimal('7.25'), datetime(2024, 2, 9, tzinfo=dt_timezone.utc)),
+            (carol.id, bob.id, None, Decimal('3.00'), datetime(2024, 3, 1, tzinfo=dt_timezone.utc)),
+        ]
+        for debtor_id, creditor_id, group_id, amount, settled_at in settled_rows:
+            debt = Debt.objects.create(
+                debtor_id=debtor_id, creditor_id=creditor_id, group_id=group_id, amount=amount, is_settled=True
+            )
+            # updated_at is auto_now, so the settlement time is written afterwards
+            Debt.objects.filter(pk=debt.pk).update(updated_at=settled_at)
+        open_debt = Debt.objects.create(debtor=bob, creditor=carol, group=group, amount=Decimal('4.00'))
+        open_fields = ('id', 'debtor_id', 'creditor_id', 'group_id', 'amount', 'is_settled')
+        open_row = Debt.objects.filter(pk=open_debt.pk).values_list(*open_fields).get()
+
+        apps = self.migrate('0013_payment')
+        Debt = apps.get_model('expenses', 'Debt')
+        Payment = apps.get_model('expenses', 'Payment')
+        self.assertCountEqual(
+            Payment.objects.values_list('payer_id', 'payee_id', 'group_id', 'amount', 'created_at'), settled_rows
+        )
+        self.assertEqual(list(Debt.objects.values_list(*open_fields)), [open_row])
+
+        apps = self.migrate('0012_userstats')
+        Debt = apps.get_model('expenses', 'Debt')
+        self.assertCountEqual(
+            Debt.objects.filter(is_settled=True).values_list('debtor_id', 'creditor_id', 'group_id', 'amount', 'updated_at'),
+            settled_rows,
+        )
+        self.assertEqual(list(Debt.objects.filter(is_settled=False).values_list(*open_fields)), [open_row])
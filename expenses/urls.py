@@ -35,6 +35,8 @@ urlpatterns = [
     path('expenses/', views_expense.expense_list, name='expense_list'),
     path('expenses/add/', views_expense.add_expense, name='add_expense'),
     path('expenses/<int:expense_id>/', views_expense.expense_detail, name='expense_detail'),
+    path('expenses/<int:expense_id>/edit/', views_expense.edit_expense, name='edit_expense'),
+    path('expenses/<int:expense_id>/delete/', views_expense.delete_expense, name='delete_expense'),
     path('expenses/history/', views_expense.user_expense_history, name='user_expense_history'),
     path('expenses/export/', views_expense.export_user_expenses, name='export_user_expenses'),
     
@@ -48,6 +50,7 @@ urlpatterns = [
     # Settlement views
     path('settlements/', views_settlement.settlement_summary, name='settlement_summary'),
     path('settlements/record/', views_settlement.record_settlement, name='record_settlement'),
+    path('settlements/network/', views_settlement.network_settlement, name='network_settlement'),
     # Add these lines to your existing urls.py
     path('groups/<int:group_id>/settle-up/', views_settlement.settle_up, name='settle_up'),
     path('groups/<int:group_id>/settle-up/<int:creditor_id>/', views_settlement.settle_up, name='settle_up_with_user'),
@@ -58,6 +61,7 @@ urlpatterns = [
     path('settlements/settle-up/', views_settlement.settle_up_redirect, name='settle_up_no_group'),
     # Add this line to your urlpatterns
     path('groups/<int:group_id>/settlements/', views_group.group_settlement_summary, name='group_settlement_summary'),
+    path('groups/<int:group_id>/settlements/simulate/', views_settlement.simulate_settlement, name='simulate_settlement'),
     path('groups/<int:group_id>/expenses/history/', views_group.group_expense_history, name='group_expense_history'),
     # Add this line to your urlpatterns
     path('groups/<int:group_id>/invite/', views_group.invite_to_group, name='invite_to_group'),
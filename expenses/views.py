@@ -7,6 +7,7 @@ from django.db import transaction
 from decimal import Decimal
 from .models import Expense, Split, Debt, Group
 from .forms import ExpenseForm
+from .expense_utils import handle_equal_split, handle_percentage_split, handle_direct_split, update_debt
 
 def home(request):
     return render(request, 'expenses/home.html')
@@ -208,129 +209,6 @@ def add_expense(request):
     
     return render(request, 'expenses/add_expense.html', {'form': form})
 
-def handle_equal_split(expense, participants):
-    """Handle equal splitting of an expense among participants."""
-    total_participants = len(participants)
-    amount_per_person = expense.amount / Decimal(total_participants)
-    
-    # Create splits and update debts
-    for participant in participants:
-        # If this participant paid, they don't owe anything
-        if participant == expense.paid_by:
-            # Create a split record with 0 amount owed
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=Decimal('0.00')
-            )
-        else:
-            # Create a split record
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=amount_per_person
-            )
-            
-            # Update debt records
-            update_debt(expense.paid_by, participant, amount_per_person, expense.group)
-
-def handle_percentage_split(expense, participants, percentages):
-    """Handle percentage-based splitting of an expense."""
-    for participant in participants:
-        percentage = percentages.get(participant.id, Decimal('0'))
-        amount_owed = (percentage / Decimal('100')) * expense.amount
-        
-        # If this participant paid, they don't owe anything
-        if participant == expense.paid_by:
-            # Create a split record with 0 amount owed
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=Decimal('0.00'),
-                percentage=percentage
-            )
-        else:
-            # Create a split record
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=amount_owed,
-                percentage=percentage
-            )
-            
-            # Update debt records
-            update_debt(expense.paid_by, participant, amount_owed, expense.group)
-
-def handle_direct_split(expense, participants, direct_amounts):
-    """Handle direct amount splitting of an expense."""
-    for participant in participants:
-        amount_owed = direct_amounts.get(participant.id, Decimal('0'))
-        
-        # If this participant paid, they don't owe anything
-        if participant == expense.paid_by:
-            # Create a split record with 0 amount owed
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=Decimal('0.00')
-            )
-        else:
-            # Create a split record
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=amount_owed
-            )
-            
-            # Update debt records
-            update_debt(expense.paid_by, participant, amount_owed, expense.group)
-
-def update_debt(creditor, debtor, amount, group):
-    """Update or create a debt record between two users."""
-    # Check if there's an existing debt in the opposite direction
-    try:
-        reverse_debt = Debt.objects.get(creditor=debtor, debtor=creditor, group=group)
-        
-        # If the reverse debt is greater, reduce it
-        if reverse_debt.amount > amount:
-            reverse_debt.amount -= amount
-            reverse_debt.save()
-            return
-        # If the reverse debt is equal, delete it
-        elif reverse_debt.amount == amount:
-            reverse_debt.delete()
-            return
-        # If the reverse debt is less, delete it and create a new debt in the opposite direction
-        else:
-            new_amount = amount - reverse_debt.amount
-            reverse_debt.delete()
-            
-            debt, created = Debt.objects.get_or_create(
-                creditor=creditor,
-                debtor=debtor,
-                group=group,
-                defaults={'amount': new_amount}
-            )
-            
-            if not created:
-                debt.amount += new_amount
-                debt.save()
-            
-            return
-    
-    except Debt.DoesNotExist:
-        # No reverse debt exists, so create or update a direct debt
-        debt, created = Debt.objects.get_or_create(
-            creditor=creditor,
-            debtor=debtor,
-            group=group,
-            defaults={'amount': amount}
-        )
-        
-        if not created:
-            debt.amount += amount
-            debt.save
-
 # Add these to your existing views.py file
 
 # Around line 300-310 (recurring expenses section)
@@ -342,7 +220,8 @@ from django.utils import timezone
 from decimal import Decimal
 from .models import RecurringExpense, Expense, Split, Debt
 from .forms import RecurringExpenseForm
-import json  # Add this import for JSON handling
+from django.core.exceptions import ValidationError
+from .expense_utils import compile_posted_split_plan, generate_expense_from_recurring, update_next_due_date
 from django.contrib.auth.models import User  # Add this import for User model
 
 @login_required
@@ -384,48 +263,30 @@ def add_recurring_expense(request):
                 participants = list(participants)
                 participants.append(paid_by)
             
+            recurring_expense = RecurringExpense(
+                title=title,
+                amount=amount,
+                paid_by=paid_by,
+                group=group,
+                frequency=frequency,
+                split_type=split_type,
+                next_due_date=next_due_date
+            )
+            # Resolve the split now, so generating the expense later is a plain apply step
+            try:
+                compile_posted_split_plan(recurring_expense, request.POST, participants)
+            except ValidationError as e:
+                messages.error(request, e.messages[0])
+                return render(request, 'expenses/add_recurring_expense.html', {'form': form})
+
             try:
                 with transaction.atomic():
                     # Create the recurring expense
-                    recurring_expense = RecurringExpense.objects.create(
-                        title=title,
-                        amount=amount,
-                        paid_by=paid_by,
-                        group=group,
-                        frequency=frequency,
-                        split_type=split_type,
-                        next_due_date=next_due_date
-                    )
+                    recurring_expense.save()
                     
                     # Add participants
                     recurring_expense.participants.set(participants)
                     
-                    # Handle different split types for future reference
-                    if split_type == 'PERCENTAGE':
-                        # Store percentages as metadata
-                        percentages = {}
-                        for participant in participants:
-                            percentage_key = f'percentage_{participant.id}'
-                            if percentage_key in request.POST:
-                                percentages[str(participant.id)] = request.POST[percentage_key]
-                        
-                        # Save percentages as JSON in a new field or related model
-                        # This is a simplified approach - you might want to create a proper model
-                        recurring_expense.split_details = json.dumps(percentages)
-                        recurring_expense.save()
-                        
-                    elif split_type == 'DIRECT':
-                        # Store direct amounts as metadata
-                        direct_amounts = {}
-                        for participant in participants:
-                            amount_key = f'amount_{participant.id}'
-                            if amount_key in request.POST:
-                                direct_amounts[str(participant.id)] = request.POST[amount_key]
-                        
-                        # Save direct amounts as JSON
-                        recurring_expense.split_details = json.dumps(direct_amounts)
-                        recurring_expense.save()
-                    
                     messages.success(request, f"Recurring expense '{title}' was added successfully!")
                     return redirect('recurring_expenses')
             
@@ -467,6 +328,14 @@ def edit_recurring_expense(request, expense_id):
                 participants = list(participants)
                 participants.append(recurring_expense.paid_by)
             
+            # Resolve the split now, so generating the expense later is a plain apply step
+            try:
+                # form.is_valid() already copied the new values onto the instance
+                compile_posted_split_plan(recurring_expense, request.POST, participants)
+            except ValidationError as e:
+                messages.error(request, e.messages[0])
+                return render(request, 'expenses/edit_recurring_expense.html', {'form': form, 'expense': recurring_expense})
+
             try:
                 with transaction.atomic():
                     # Update the recurring expense
@@ -475,32 +344,6 @@ def edit_recurring_expense(request, expense_id):
                     # Update participants
                     recurring_expense.participants.set(participants)
                     
-                    # Handle different split types for future reference
-                    split_type = form.cleaned_data['split_type']
-                    if split_type == 'PERCENTAGE':
-                        # Store percentages as metadata
-                        percentages = {}
-                        for participant in participants:
-                            percentage_key = f'percentage_{participant.id}'
-                            if percentage_key in request.POST:
-                                percentages[str(participant.id)] = request.POST[percentage_key]
-                        
-                        # Save percentages as JSON
-                        recurring_expense.split_details = json.dumps(percentages)
-                        recurring_expense.save()
-                        
-                    elif split_type == 'DIRECT':
-                        # Store direct amounts as metadata
-                        direct_amounts = {}
-                        for participant in participants:
-                            amount_key = f'amount_{participant.id}'
-                            if amount_key in request.POST:
-                                direct_amounts[str(participant.id)] = request.POST[amount_key]
-                        
-                        # Save direct amounts as JSON
-                        recurring_expense.split_details = json.dumps(direct_amounts)
-                        recurring_expense.save()
-                    
                     messages.success(request, f"Recurring expense '{recurring_expense.title}' was updated successfully!")
                     return redirect('recurring_expenses')
             
@@ -558,71 +401,6 @@ def generate_recurring_expense_now(request, expense_id):
     
     return redirect('recurring_expenses')
 
-def generate_expense_from_recurring(recurring_expense):
-    """Generate a new expense from a recurring expense"""
-    with transaction.atomic():
-        # Create the expense
-        expense = Expense.objects.create(
-            title=f"{recurring_expense.title} (Recurring: {recurring_expense.get_frequency_display()})",
-            amount=recurring_expense.amount,
-            paid_by=recurring_expense.paid_by,
-            group=recurring_expense.group,
-            split_type=recurring_expense.split_type
-        )
-        
-        # Get participants
-        participants = recurring_expense.participants.all()
-        
-        # Handle different split types
-        if recurring_expense.split_type == 'EQUAL':
-            handle_equal_split(expense, participants)
-        elif recurring_expense.split_type == 'PERCENTAGE':
-            # Get percentages from stored metadata
-            try:
-                percentages = json.loads(recurring_expense.split_details)
-                percentage_dict = {int(k): Decimal(v) for k, v in percentages.items()}
-                handle_percentage_split(expense, participants, percentage_dict)
-            except (json.JSONDecodeError, AttributeError):
-                # Fallback to equal split if percentages are not available
-                handle_equal_split(expense, participants)
-        elif recurring_expense.split_type == 'DIRECT':
-            # Get direct amounts from stored metadata
-            try:
-                direct_amounts = json.loads(recurring_expense.split_details)
-                amount_dict = {int(k): Decimal(v) for k, v in direct_amounts.items()}
-                handle_direct_split(expense, participants, amount_dict)
-            except (json.JSONDecodeError, AttributeError):
-                # Fallback to equal split if direct amounts are not available
-                handle_equal_split(expense, participants)
-        
-        return expense
-
-def update_next_due_date(recurring_expense):
-    """Update the next due date based on frequency"""
-    current_date = recurring_expense.next_due_date
-    
-    if recurring_expense.frequency == 'DAILY':
-        next_date = current_date + timezone.timedelta(days=1)
-    elif recurring_expense.frequency == 'WEEKLY':
-        next_date = current_date + timezone.timedelta(weeks=1)
-    elif recurring_expense.frequency == 'MONTHLY':
-        # Add one month (handle month boundaries)
-        month = current_date.month + 1
-        year = current_date.year
-        if month > 12:
-            month = 1
-            year += 1
-        
-        # Handle different month lengths
-        day = min(current_date.day, [31, 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month-1])
-        next_date = timezone.datetime(year, month, day).date()
-    else:
-        # Default to one month if frequency is unknown
-        next_date = current_date + timezone.timedelta(days=30)
-    
-    recurring_expense.next_due_date = next_date
-    recurring_expense.save()
-
 @login_required
 def settle_up(request):
     user = request.user
@@ -3,106 +3,120 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
-from django.db.models import Sum, Q, F, Case, When, DecimalField, Value
-from django.db.models.functions import Coalesce
+from django.db.models import Sum, Q, F, Case, When, DecimalField, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
 from django.contrib.auth.models import User
 from collections import defaultdict
+from decimal import Decimal
 from .models import Expense, Debt, Group, Profile
+from .expense_utils import flush_pending_ledger_writes
+from .balance_cache import user_group_summaries, user_group_ids, balance_etag
+from .ledger import open_debts_of
 from django.http import JsonResponse
+from django.views.decorators.http import condition
 # Add this import for ProfileForm
 from .forms import ProfileForm, CURRENCY_CHOICES
 
 def home(request):
     return render(request, 'expenses/home.html')
 
+def dashboard_etag(request):
+    """The dashboard only changes when one of the user's groups does."""
+    # Queued changes are applied first so they show up in the versions
+    flush_pending_ledger_writes(request)
+    return balance_etag(request, user_group_ids(request.user))
+
 @login_required
+@condition(etag_func=dashboard_etag)
 def dashboard(request):
+    # Apply this user's queued ledger changes before reading balances
+    flush_pending_ledger_writes(request)
+    
     user = request.user
     
-    # Calculate total amount owed (where user is debtor)
-    total_owed = Debt.objects.filter(
-        debtor=user, 
-        is_settled=False
-    ).aggregate(
-        total=Coalesce(Sum('amount', output_field=DecimalField()), Value(0, output_field=DecimalField()))
-    )['total']
-    
-    # Calculate total amount to receive (where user is creditor)
-    total_to_receive = Debt.objects.filter(
-        creditor=user, 
-        is_settled=False
-    ).aggregate(
-        total=Coalesce(Sum('amount', output_field=DecimalField()), Value(0, output_field=DecimalField()))
-    )['total']
+    # Get all groups the user belongs to
+    user_groups = list(Group.objects.filter(members=user))
+    
+    # Per-group positions come from the balance cache (MemberBalance on a miss)
+    balances = user_group_summaries(user, [group.id for group in user_groups])
+    
+    # Calculate total amount owed and to receive across all groups
+    total_owed = sum((balance['owed'] for balance in balances.values()), Decimal('0.00'))
+    total_to_receive = sum((balance['to_receive'] for balance in balances.values()), Decimal('0.00'))
     
     # Calculate net balance
     net_balance = total_to_receive - total_owed
     
-    # Get all groups the user belongs to
-    user_groups = Group.objects.filter(members=user)
+    # Five most recent expenses of every group in one query, ranked per group
+    recent_by_group = defaultdict(list)
+    recent_expenses = Expense.objects.filter(
+        group__members=user
+    ).select_related('paid_by').annotate(
+        recent_rank=Window(
+            RowNumber(),
+            partition_by=F('group_id'),
+            order_by=[F('created_at').desc(), F('id').desc()]
+        )
+    ).filter(recent_rank__lte=5).order_by('group_id', 'recent_rank')
+    for expense in recent_expenses:
+        recent_by_group[expense.group_id].append(expense)
     
     # Group summary data
     group_summary = []
     for group in user_groups:
-        # Amount owed in this group
-        group_owed = Debt.objects.filter(
-            debtor=user,
-            expense__group=group,
-            is_settled=False
-        ).aggregate(
-            total=Coalesce(Sum('amount', output_field=DecimalField()), Value(0, output_field=DecimalField()))
-        )['total']
-        
-        # Amount to receive in this group
-        group_to_receive = Debt.objects.filter(
-            creditor=user,
-            expense__group=group,
-            is_settled=False
-        ).aggregate(
-            total=Coalesce(Sum('amount', output_field=DecimalField()), Value(0, output_field=DecimalField()))
-        )['total']
-        
-        # Recent expenses in this group (limit to 5)
-        recent_expenses = Expense.objects.filter(
-            group=group
-        ).order_by('-created_at')[:5]
+        group_owed = balances[group.id]['owed']
+        group_to_receive = balances[group.id]['to_receive']
         
         group_summary.append({
             'group': group,
             'owed': group_owed,
             'to_receive': group_to_receive,
             'net': group_to_receive - group_owed,
-            'recent_expenses': recent_expenses
+            'recent_expenses': recent_by_group[group.id]
         })
     
     # User breakdown - who owes you and whom you owe
+    # Both directions come from one query, totalled per counterparty
+    zero = Value(Decimal('0.00'), output_field=DecimalField())
+    open_debts = Debt.objects.filter(
+        open_debts_of(user)
+    ).annotate(
+        counterparty=Case(When(creditor=user, then=F('debtor')), default=F('creditor'))
+    )
+    counterparties = open_debts.values('counterparty').annotate(
+        owes_you=Coalesce(Sum('amount', filter=Q(creditor=user)), zero),
+        you_owe=Coalesce(Sum('amount', filter=Q(debtor=user)), zero)
+    ).order_by()
+    counterparties = list(counterparties)
+    
+    # Enhance the user data with actual user objects, all fetched at once
+    # (a subquery rather than an id list, which SQLite would split into batches)
+    users = {
+        counterparty.pk: counterparty
+        for counterparty in User.objects.filter(pk__in=open_debts.values('counterparty'))
+    }
+    
     # People who owe you
-    creditor_summary = Debt.objects.filter(
-        creditor=user,
-        is_settled=False
-    ).values('debtor').annotate(
-        total_amount=Sum('amount', output_field=DecimalField())
-    ).order_by('-total_amount')
+    creditor_summary = sorted(
+        [
+            {'debtor': row['counterparty'], 'user': users[row['counterparty']], 'total_amount': row['owes_you']}
+            for row in counterparties if row['owes_you']
+        ],
+        key=lambda item: item['total_amount'], reverse=True
+    )
     
     # People you owe
-    debtor_summary = Debt.objects.filter(
-        debtor=user,
-        is_settled=False
-    ).values('creditor').annotate(
-        total_amount=Sum('amount', output_field=DecimalField())
-    ).order_by('-total_amount')
-    
-    # Enhance the user data with actual user objects
-    for summary in creditor_summary:
-        summary['user'] = User.objects.get(pk=summary['debtor'])
-    
-    for summary in debtor_summary:
-        summary['user'] = User.objects.get(pk=summary['creditor'])
+    debtor_summary = sorted(
+        [
+            {'creditor': row['counterparty'], 'user': users[row['counterparty']], 'total_amount': row['you_owe']}
+            for row in counterparties if row['you_owe']
+        ],
+        key=lambda item: item['total_amount'], reverse=True
+    )
     
     # Get unsettled debts for the current user (for settle up functionality)
     unsettled_debts = Debt.objects.filter(
-        Q(debtor=user) | Q(creditor=user),
-        is_settled=False
+        open_debts_of(user)
     ).select_related('debtor', 'creditor', 'expense')
     
     context = {
@@ -2,14 +2,20 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
-from django.db.models import Q  # Add this import for Q objects
 from django.core.paginator import Paginator
 from datetime import datetime
 import csv
 from django.http import HttpResponse
-from decimal import Decimal
-from .models import Expense, Split, Debt, Group
+from django.views.decorators.http import condition
+from django.utils import timezone
+from decimal import Decimal, InvalidOperation
+from .models import Expense, Split, SplitArchive, Debt, Group
 from .forms import ExpenseForm
+from .expense_utils import handle_equal_split, handle_percentage_split, handle_direct_split, update_debt
+from .expense_utils import remember_pending_ledger_writes, update_expense, delete_expense as remove_expense
+from .expense_utils import flush_pending_ledger_writes
+from .balance_cache import user_group_ids, balance_etag
+from .archive import expense_splits, user_expenses_filter, attach_splits, reaches_archive
 
 @login_required
 def add_expense(request):
@@ -75,12 +81,16 @@ def add_expense(request):
                         
                         handle_direct_split(expense, participants, direct_amounts)
                     
+                    remember_pending_ledger_writes(request, group)
                     messages.success(request, f"Expense '{title}' was added successfully!")
                     return redirect('dashboard')
             
             except ValueError as e:
                 messages.error(request, str(e))
                 return render(request, 'expenses/add_expense.html', {'form': form})
+            except InvalidOperation:
+                messages.error(request, "Please enter a valid number for every share.")
+                return render(request, 'expenses/add_expense.html', {'form': form})
         
         else:
             messages.error(request, "Please correct the errors below.")
@@ -89,136 +99,111 @@ def add_expense(request):
     
     return render(request, 'expenses/add_expense.html', {'form': form})
 
-def handle_equal_split(expense, participants):
-    """Handle equal splitting of an expense among participants."""
-    total_participants = len(participants)
-    amount_per_person = expense.amount / Decimal(total_participants)
+@login_required
+def edit_expense(request, expense_id):
+    """View to edit an expense, only the net change in debts is applied"""
+    expense = get_object_or_404(Expense.objects.select_related('group'), id=expense_id)
     
-    # Create splits and update debts
-    for participant in participants:
-        # If this participant paid, they don't owe anything
-        if participant == expense.paid_by:
-            # Create a split record with 0 amount owed
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=Decimal('0.00')
-            )
-        else:
-            # Create a split record
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=amount_per_person
-            )
-            
-            # Update debt records
-            update_debt(expense.paid_by, participant, amount_per_person, expense.group)
-
-def handle_percentage_split(expense, participants, percentages):
-    """Handle percentage-based splitting of an expense."""
-    for participant in participants:
-        percentage = percentages.get(participant.id, Decimal('0'))
-        amount_owed = (percentage / Decimal('100')) * expense.amount
-        
-        # If this participant paid, they don't owe anything
-        if participant == expense.paid_by:
-            # Create a split record with 0 amount owed
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=Decimal('0.00'),
-                percentage=percentage
-            )
-        else:
-            # Create a split record
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=amount_owed,
-                percentage=percentage
-            )
-            
-            # Update debt records
-            update_debt(expense.paid_by, participant, amount_owed, expense.group)
-
-def handle_direct_split(expense, participants, direct_amounts):
-    """Handle direct amount splitting of an expense."""
-    for participant in participants:
-        amount_owed = direct_amounts.get(participant.id, Decimal('0'))
+    # Check if user has permission to edit
+    if expense.paid_by != request.user:
+        messages.error(request, "You don't have permission to edit this expense.")
+        return redirect('group_detail', group_id=expense.group_id)
+    
+    splits = expense_splits(expense)
+    initial_shares = {
+        split.user_id: str(split.percentage if expense.split_type == 'PERCENTAGE' else split.amount_owed)
+        for split in splits
+    }
+    
+    if request.method == 'POST':
+        form = ExpenseForm(request.POST, instance=expense, user=request.user)
         
-        # If this participant paid, they don't owe anything
-        if participant == expense.paid_by:
-            # Create a split record with 0 amount owed
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=Decimal('0.00')
-            )
-        else:
-            # Create a split record
-            Split.objects.create(
-                expense=expense,
-                user=participant,
-                amount_owed=amount_owed
-            )
+        if form.is_valid():
+            amount = form.cleaned_data['amount']
+            paid_by = form.cleaned_data['paid_by']
+            split_type = form.cleaned_data['split_type']
+            participants = form.cleaned_data['participants']
             
-            # Update debt records
-            update_debt(expense.paid_by, participant, amount_owed, expense.group)
-
-def update_debt(creditor, debtor, amount, group):
-    """Update or create a debt record between two users."""
-    # Check if there's an existing debt in the opposite direction
-    try:
-        reverse_debt = Debt.objects.get(creditor=debtor, debtor=creditor, group=group)
-        
-        # If the reverse debt is greater, reduce it
-        if reverse_debt.amount > amount:
-            reverse_debt.amount -= amount
-            reverse_debt.save()
-            return
-        # If the reverse debt is equal, delete it
-        elif reverse_debt.amount == amount:
-            reverse_debt.delete()
-            return
-        # If the reverse debt is less, delete it and create a new debt in the opposite direction
-        else:
-            new_amount = amount - reverse_debt.amount
-            reverse_debt.delete()
+            # Validate participants
+            if not participants:
+                messages.error(request, "You must select at least one participant.")
+                return render(request, 'expenses/edit_expense.html', {'form': form, 'expense': expense, 'initial_shares': initial_shares})
             
-            debt, created = Debt.objects.get_or_create(
-                creditor=creditor,
-                debtor=debtor,
-                group=group,
-                defaults={'amount': new_amount}
-            )
+            # Ensure payer is in participants
+            if paid_by not in participants:
+                participants = list(participants)
+                participants.append(paid_by)
             
-            if not created:
-                debt.amount += new_amount
-                debt.save()
+            try:
+                shares = {}
+                if split_type == 'PERCENTAGE':
+                    for participant in participants:
+                        percentage_key = f'percentage_{participant.id}'
+                        if percentage_key in request.POST:
+                            shares[participant.id] = Decimal(request.POST[percentage_key])
+                    
+                    # Validate percentages
+                    if sum(shares.values()) != Decimal('100'):
+                        raise ValueError("Percentages must sum to 100%")
+                elif split_type == 'DIRECT':
+                    for participant in participants:
+                        amount_key = f'amount_{participant.id}'
+                        if amount_key in request.POST:
+                            shares[participant.id] = Decimal(request.POST[amount_key])
+                    
+                    # Validate direct amounts
+                    if sum(shares.values()) != amount:
+                        raise ValueError("Direct amounts must sum to the total expense amount")
+                
+                # form.is_valid() already copied the new values onto the instance,
+                # so the old values are re-read inside update_expense
+                changes = {field: form.cleaned_data[field] for field in ('title', 'amount', 'paid_by', 'group', 'split_type')}
+                expense = update_expense(expense, changes, [participant.id for participant in participants], shares)
+                
+                remember_pending_ledger_writes(request, expense.group)
+                messages.success(request, f"Expense '{expense.title}' was updated successfully!")
+                return redirect('group_detail', group_id=expense.group_id)
             
-            return
-    
-    except Debt.DoesNotExist:
-        # No reverse debt exists, so create or update a direct debt
-        debt, created = Debt.objects.get_or_create(
-            creditor=creditor,
-            debtor=debtor,
-            group=group,
-            defaults={'amount': amount}
-        )
+            except ValueError as e:
+                messages.error(request, str(e))
+                return render(request, 'expenses/edit_expense.html', {'form': form, 'expense': expense, 'initial_shares': initial_shares})
+            except InvalidOperation:
+                messages.error(request, "Please enter a valid number for every share.")
+                return render(request, 'expenses/edit_expense.html', {'form': form, 'expense': expense, 'initial_shares': initial_shares})
         
-        if not created:
-            debt.amount += amount
-            debt.save()
+        else:
+            messages.error(request, "Please correct the errors below.")
+    else:
+        form = ExpenseForm(instance=expense, user=request.user)
+        
+        # Pre-select participants
+        form.fields['participants'].initial = [split.user_id for split in splits]
+    
+    return render(request, 'expenses/edit_expense.html', {'form': form, 'expense': expense, 'initial_shares': initial_shares})
+
+@login_required
+def delete_expense(request, expense_id):
+    """View to delete an expense and reverse the debts it created"""
+    expense = get_object_or_404(Expense.objects.select_related('group', 'paid_by'), id=expense_id)
+    
+    # Check if user has permission to delete
+    if expense.paid_by != request.user:
+        messages.error(request, "You don't have permission to delete this expense.")
+        return redirect('group_detail', group_id=expense.group_id)
+    
+    if request.method == 'POST':
+        remove_expense(expense)
+        remember_pending_ledger_writes(request, expense.group)
+        messages.success(request, f"Expense '{expense.title}' was deleted successfully!")
+        return redirect('group_detail', group_id=expense.group_id)
+    
+    return render(request, 'expenses/delete_expense.html', {'expense': expense})
 
 @login_required
 def expense_list(request):
     """View for listing all expenses"""
     user = request.user
-    expenses = Expense.objects.filter(
-        Q(paid_by=user) | Q(splits__user=user)
-    ).distinct().order_by('-created_at')
+    expenses = Expense.objects.filter(user_expenses_filter(user)).order_by('-created_at')
     
     return render(request, 'expenses/expense_list.html', {
         'expenses': expenses
@@ -230,7 +215,7 @@ def expense_detail(request, expense_id):
     expense = get_object_or_404(Expense, id=expense_id)
     
     # Check if user is authorized to view this expense
-    if request.user != expense.paid_by and not expense.splits.filter(user=request.user).exists():
+    if request.user != expense.paid_by and request.user.id not in {split.user_id for split in expense_splits(expense)}:
         messages.error(request, "You don't have permission to view this expense.")
         return redirect('dashboard')
     
@@ -238,24 +223,85 @@ def expense_detail(request, expense_id):
         'expense': expense
     })
 
+def user_history_etag(request):
+    """The user's history only changes when a group they have expenses in does."""
+    flush_pending_ledger_writes(request)
+    # Groups the user has left still hold their old expenses, which can be edited
+    expense_group_ids = Expense.objects.filter(
+        user_expenses_filter(request.user)
+    ).values_list('group_id', flat=True).distinct()
+    return balance_etag(request, set(user_group_ids(request.user)).union(expense_group_ids))
+
 @login_required
+@condition(etag_func=user_history_etag)
 def user_expense_history(request):
-    # Get expenses where the user is either the payer or a participant
-    expenses = Expense.objects.filter(
-        Q(splits__user=request.user) | Q(paid_by=request.user)
-    ).distinct().order_by('-created_at')
+    """Expenses the user paid for or has a share in, across all groups"""
+    user = request.user
+    
+    # Get filter parameters
+    filter_form = {
+        key: request.GET.get(key, '')
+        for key in ('date_from', 'date_to', 'group_id', 'expense_type', 'sort_by')
+    }
+    sort_by = filter_form['sort_by'] if filter_form['sort_by'] in ('created_at', '-amount', 'amount') else '-created_at'
+    try:
+        date_from, date_to = (
+            timezone.make_aware(datetime.strptime(filter_form[key], '%Y-%m-%d')) if filter_form[key] else None
+            for key in ('date_from', 'date_to')
+        )
+    except ValueError:
+        date_from = date_to = None
+    
+    # Archived splits are only searched when the range reaches back into the archive
+    include_archive = reaches_archive(date_from)
+    expenses = Expense.objects.filter(user_expenses_filter(user, include_archive))
     
-    return render(request, 'expenses/user_expense_history.html', {'expenses': expenses})
+    # Apply filters if provided
+    if date_from:
+        expenses = expenses.filter(created_at__gte=date_from)
+    if date_to:
+        expenses = expenses.filter(created_at__lte=date_to)
+    if filter_form['group_id'].isdigit():
+        expenses = expenses.filter(group_id=filter_form['group_id'])
+    if filter_form['expense_type'] == 'basic':
+        expenses = expenses.filter(parent_expense__isnull=True, recurring_expense__isnull=True)
+    elif filter_form['expense_type'] == 'child':
+        expenses = expenses.filter(parent_expense__isnull=False)
+    elif filter_form['expense_type'] == 'recurring':
+        expenses = expenses.filter(recurring_expense__isnull=False)
+    
+    expenses = expenses.select_related('paid_by', 'group', 'parent_expense', 'recurring_expense').order_by(sort_by)
+    
+    # Pagination
+    paginator = Paginator(expenses, 15)
+    page_obj = paginator.get_page(request.GET.get('page'))
+    
+    # Splits for this page only, with the user's own figures worked out from them
+    page_obj.object_list = attach_splits(page_obj.object_list, include_archive)
+    for expense in page_obj.object_list:
+        expense.user_paid = expense.amount if expense.paid_by_id == user.id else Decimal('0.00')
+        expense.user_owes = sum(
+            (split.amount_owed for split in expense.all_splits if split.user_id == user.id), Decimal('0.00')
+        )
+        expense.net_contribution = expense.user_paid - expense.user_owes
+    
+    return render(request, 'expenses/user_expense_history.html', {
+        'page_obj': page_obj,
+        'filter_form': filter_form,
+        'user_groups': Group.objects.filter(members=user),
+    })
 
 @login_required
 def export_user_expenses(request):
     """Export all user expenses as CSV"""
     user = request.user
     
-    # Get all expenses where the user is a participant
-    expenses = Expense.objects.filter(
-        Q(expenseparticipant__user=user) | Q(paid_by=user)
-    ).distinct().order_by('-created_at')
+    # Get all expenses where the user is a participant, archived ones included
+    expenses = Expense.objects.filter(user_expenses_filter(user)).select_related('group', 'paid_by').order_by('-created_at')
+    
+    # The user's share of each, from the live and archived splits
+    shares = dict(Split.objects.filter(user=user).values_list('expense_id', 'amount_owed'))
+    shares.update(SplitArchive.objects.filter(user=user).values_list('expense_id', 'amount_owed'))
     
     # Create the HttpResponse with CSV header
     response = HttpResponse(content_type='text/csv')
@@ -273,11 +319,7 @@ def export_user_expenses(request):
     # Write expense data
     for expense in expenses:
         # Calculate user's share
-        try:
-            user_split = Split.objects.get(expense=expense, user=user)
-            user_share = user_split.amount_owed
-        except Split.DoesNotExist:
-            user_share = 0
+        user_share = shares.get(expense.id, 0)
         
         # Calculate user's payment
         user_payment = expense.amount if expense.paid_by == user else 0
@@ -1,78 +1,54 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Sum, Count, F, Case, When, Value, DecimalField
-from django.db.models.functions import Coalesce
+from django.db import transaction
+from django.db.models import Q, Case, When, Value
 from django.core.paginator import Paginator
 from django.http import HttpResponseForbidden, HttpResponse
+from django.views.decorators.http import condition
 from django.contrib.auth.models import User
-from .models import Group, Expense, Split, Debt
+from .models import Group, Expense, Debt, MemberBalance, UserStats
+from .expense_utils import flush_pending_ledger_writes
+from .balance_cache import bump_group_version, cached_group_member_balances, user_group_summaries, balance_etag
+from .ledger import build_settlement_plan, refresh_user_stats
+from .archive import user_expenses_filter, attach_splits, reaches_archive
 from .forms import GroupForm  # Add this import
 from datetime import datetime
+from decimal import Decimal
 import csv
 
+def group_etag(request, group_id):
+    """Group pages only change when the group's balance version does."""
+    # Non-members get no ETag, so they always reach the view's membership check
+    # instead of a 304
+    if not Group.members.through.objects.filter(group_id=group_id, user_id=request.user.id).exists():
+        return None
+    # Queued changes are applied first so they show up in the version
+    flush_pending_ledger_writes(request)
+    return balance_etag(request, [group_id])
+
 @login_required
 def group_list(request):
     """
     Display all groups the logged-in user is a member of
     """
+    # Apply this user's queued ledger changes before reading balances
+    flush_pending_ledger_writes(request)
+    
     user = request.user
     
-    # Get all groups the user is a member of using raw SQL to avoid admin field issues
-    from django.db import connection
-    with connection.cursor() as cursor:
-        cursor.execute("""
-            SELECT g.id, g.name, g.description, g.created_at
-            FROM expenses_group g
-            INNER JOIN expenses_group_members gm ON g.id = gm.group_id
-            WHERE gm.user_id = %s
-        """, [user.id])
-        group_data = cursor.fetchall()
-    
-    # Create Group objects from raw data
-    groups = []
-    for row in group_data:
-        group = Group(id=row[0], name=row[1], description=row[2], created_at=row[3])
-        
-        # Member count
-        group.member_count = Group.objects.get(id=group.id).members.count()
-        
-        # Expense count and total
-        expenses = Expense.objects.filter(group_id=group.id)
-        group.expense_count = expenses.count()
-        group.total_expenses = expenses.aggregate(total=Coalesce(Sum('amount', output_field=DecimalField()), Value(0, output_field=DecimalField())))['total']
-        
-        # Calculate user's balance in this group
-        # Amount owed by this user
-        user_owes = Debt.objects.filter(
-            debtor=user,
-            expense__group_id=group.id,
-            is_settled=False
-        ).aggregate(
-            total=Coalesce(Sum('amount', output_field=DecimalField()), Value(0, output_field=DecimalField()))
-        )['total']
-        
-        # Amount to be received by this user
-        user_owed = Debt.objects.filter(
-            creditor=user,
-            expense__group_id=group.id,
-            is_settled=False
-        ).aggregate(
-            total=Coalesce(Sum('amount', output_field=DecimalField()), Value(0, output_field=DecimalField()))
-        )['total']
-        
-        # Calculate net balance
-        group.user_owes = user_owes
-        group.user_owed = user_owed
-        group.net_balance = user_owed - user_owes
-        
-        # Set is_admin attribute to False by default
-        group.is_admin = False
-        
-        groups.append(group)
+    # Member and expense figures are counters stored on the group
+    groups = list(Group.objects.filter(members=user).annotate(
+        is_admin=Case(When(admin=user, then=Value(True)), default=Value(False)),
+    ).order_by('name', 'id'))
     
-    # Sort groups by name
-    groups = sorted(groups, key=lambda g: g.name)
+    # User's balance in each group, from the balance cache
+    summaries = user_group_summaries(user, [group.id for group in groups])
+    for group in groups:
+        summary = summaries[group.id]
+        group.user_owes = summary['owed']
+        group.user_owed = summary['to_receive']
+        group.net_balance = summary['net']
     
     context = {
         'groups': groups
@@ -81,6 +57,7 @@ def group_list(request):
     return render(request, 'expenses/group_list.html', context)
 
 @login_required
+@condition(etag_func=group_etag)
 def group_expense_history(request, group_id):
     """
     Display expense history for a specific group
@@ -129,14 +106,17 @@ def group_expense_history(request, group_id):
     
     # Prefetch related data to optimize queries
     expenses = expenses.select_related('paid_by', 'group', 'parent_expense', 'recurring_expense')
-    # Fix: Use the correct related name for splits and debts
-    expenses = expenses.prefetch_related('splits__user', 'debt_set__debtor', 'debt_set__creditor')
+    expenses = expenses.prefetch_related('debt_set__debtor', 'debt_set__creditor')
     
     # Pagination
     paginator = Paginator(expenses, 10)  # Show 10 expenses per page
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
+    # Splits for this page, from the archive too when the range reaches back into it
+    include_archive = reaches_archive(date_from if isinstance(date_from, datetime) else None)
+    page_obj.object_list = attach_splits(page_obj.object_list, include_archive)
+    
     # Export to CSV if requested
     if request.GET.get('export') == 'csv':
         response = HttpResponse(content_type='text/csv')
@@ -286,61 +266,39 @@ def user_expense_history(request):
     return render(request, 'expenses/user_expense_history.html', context)
 
 @login_required
+@condition(etag_func=group_etag)
 def group_detail(request, group_id):
     """View to display details of a specific group"""
+    # Apply this user's queued ledger changes before reading balances
+    flush_pending_ledger_writes(request)
+    
     try:
         # Try to get the group using the ORM first
         group = get_object_or_404(Group, pk=group_id)
         
+        # Every member's position, from one grouped query
+        member_balances = cached_group_member_balances(group)
+        members = [member for member, row in member_balances.items() if row['is_member']]
+        
         # Check if user is a member of the group
-        if request.user not in group.members.all():
+        if request.user not in members:
             messages.error(request, "You don't have permission to view this group.")
             return redirect('group_list')
-        
-        # Get all members of the group
-        members = group.members.all()
+        group.net_balance = member_balances[request.user]['net_balance']
         
         # Get all expenses in this group
         expenses = Expense.objects.filter(group=group).order_by('-created_at')[:10]
         
-        # Calculate balances for each member
-        member_balances = {}
-        for member in members:
-            # Amount paid by this member
-            paid_amount = Expense.objects.filter(
-                group=group,
-                paid_by=member
-            ).aggregate(
-                total=Coalesce(Sum('amount', output_field=DecimalField()), Value(0, output_field=DecimalField()))
-            )['total']
-            
-            # Amount owed by this member
-            owed_amount = Debt.objects.filter(
-                debtor=member,
-                expense__group=group,
-                is_settled=False
-            ).aggregate(
-                total=Coalesce(Sum('amount', output_field=DecimalField()), Value(0, output_field=DecimalField()))
-            )['total']
-            
-            # Amount to be received by this member
-            to_receive_amount = Debt.objects.filter(
-                creditor=member,
-                expense__group=group,
-                is_settled=False
-            ).aggregate(
-                total=Coalesce(Sum('amount', output_field=DecimalField()), Value(0, output_field=DecimalField()))
-            )['total']
-            
-            # Calculate net balance
-            net_balance = to_receive_amount - owed_amount
-            
-            member_balances[member] = {
-                'paid': paid_amount,
-                'owed': owed_amount,
-                'to_receive': to_receive_amount,
-                'net_balance': net_balance
-            }
+        # Settlement plan built from the same balances
+        try:
+            simplified_debts = [
+                (payment['from_user'], payment['to_user'], payment['amount'])
+                for payment in build_settlement_plan(member_balances)
+            ]
+        except ValueError:
+            # Balances that don't net to zero shouldn't take the whole page down
+            messages.error(request, "The settlement plan for this group can't be worked out right now.")
+            simplified_debts = []
         
         # Set is_admin attribute safely - avoid using the admin field directly
         is_admin = False
@@ -350,6 +308,7 @@ def group_detail(request, group_id):
             'members': members,
             'expenses': expenses,
             'member_balances': member_balances,
+            'simplified_debts': simplified_debts,
             'is_admin': is_admin
         }
         
@@ -436,6 +395,9 @@ def edit_group(request, group_id):
                 if member != group.admin:
                     group.members.remove(member)
             
+            # The member list is part of the cached balances
+            bump_group_version(group.id)
+            
             messages.success(request, f"Group '{group.name}' was updated successfully!")
             return redirect('group_detail', group_id=group.id)
     else:
@@ -462,7 +424,11 @@ def delete_group(request, group_id):
     
     if request.method == 'POST':
         group_name = group.name
-        group.delete()
+        with transaction.atomic():
+            # The group's balances and debts go with it, so recount its users' stats
+            user_ids = list(MemberBalance.objects.filter(group=group).values_list('user_id', flat=True))
+            group.delete()
+            refresh_user_stats(user_ids)
         messages.success(request, f"Group '{group_name}' was deleted successfully!")
         return redirect('group_list')
     
@@ -499,6 +465,7 @@ def add_group_members(request, group_id):
         for user in users_to_add:
             if user not in group.members.all():
                 group.members.add(user)
+        bump_group_version(group.id)
         
         messages.success(request, f"{len(users_to_add)} members were added to the group successfully!")
         return redirect('group_detail', group_id=group.id)
@@ -528,9 +495,7 @@ def export_group_expenses(request, group_id):
     # Get all expenses in this group
     expenses = Expense.objects.filter(group=group).order_by('-created_at')
     
-    # Prefetch related data to optimize queries
     expenses = expenses.select_related('paid_by', 'group')
-    expenses = expenses.prefetch_related('split_set__user')
     
     # Create the HTTP response with CSV content
     response = HttpResponse(content_type='text/csv')
@@ -569,97 +534,41 @@ def export_group_expenses(request, group_id):
 @login_required
 def group_settlement_summary(request, group_id):
     """View to display settlement summary for a group"""
+    # Apply this user's queued ledger changes before reading balances
+    flush_pending_ledger_writes(request)
+    
     group = get_object_or_404(Group, id=group_id)
     
+    # Every member's position, from one grouped query
+    member_balances = cached_group_member_balances(group)
+    
     # Check if user is a member of the group
-    if request.user not in group.members.all():
+    if not member_balances.get(request.user, {}).get('is_member'):
         messages.error(request, "You don't have permission to view this group's settlements.")
         return redirect('group_list')
     
-    # Get all members of the group
-    members = group.members.all()
-    
-    # Calculate net balances for each member
-    member_balances = {}
-    for member in members:
-        # Amount paid by this member
-        paid_amount = Expense.objects.filter(
-            group=group,
-            paid_by=member
-        ).aggregate(
-            total=Coalesce(Sum('amount', output_field=DecimalField()), 0)
-        )['total']
-        
-        # Amount owed by this member
-        owed_amount = Debt.objects.filter(
-            debtor=member,
-            expense__group=group,
-            is_settled=False
-        ).aggregate(
-            total=Coalesce(Sum('amount', output_field=DecimalField()), 0)
-        )['total']
-        
-        # Amount to be received by this member
-        to_receive_amount = Debt.objects.filter(
-            creditor=member,
-            expense__group=group,
-            is_settled=False
-        ).aggregate(
-            total=Coalesce(Sum('amount', output_field=DecimalField()), 0)
-        )['total']
-        
-        # Calculate net balance
-        net_balance = to_receive_amount - owed_amount
-        
-        member_balances[member] = {
-            'paid': paid_amount,
-            'owed': owed_amount,
-            'to_receive': to_receive_amount,
-            'net_balance': net_balance
-        }
-    
     # Generate settlement plan
-    settlement_plan = []
-    
-    # Separate members into debtors and creditors
-    debtors = [(m, b['net_balance']) for m, b in member_balances.items() if b['net_balance'] < 0]
-    creditors = [(m, b['net_balance']) for m, b in member_balances.items() if b['net_balance'] > 0]
+    try:
+        settlement_plan = build_settlement_plan(member_balances)
+    except ValueError:
+        messages.error(request, "The settlement plan for this group can't be worked out right now.")
+        settlement_plan = []
     
-    # Sort by absolute amount (largest first)
-    debtors.sort(key=lambda x: x[1])
-    creditors.sort(key=lambda x: x[1], reverse=True)
-    
-    # Generate settlement transactions
-    i, j = 0, 0
-    while i < len(debtors) and j < len(creditors):
-        debtor, debt = debtors[i]
-        creditor, credit = creditors[j]
-        
-        # The amount to settle is the minimum of the absolute values
-        amount = min(abs(debt), credit)
-        
-        if amount > 0:
-            settlement_plan.append({
-                'from_user': debtor,
-                'to_user': creditor,
-                'amount': amount
-            })
-        
-        # Update balances
-        debtors[i] = (debtor, debt + amount)
-        creditors[j] = (creditor, credit - amount)
-        
-        # Move to next user if their balance is settled
-        if abs(debtors[i][1]) < 0.01:  # Using a small threshold to handle floating point errors
-            i += 1
-        if abs(creditors[j][1]) < 0.01:
-            j += 1
+    # Open debts in this group, split into the user's own debts and credits
+    debts = list(Debt.objects.filter(group=group, is_settled=False).select_related('debtor', 'creditor'))
+    user_debts = [debt for debt in debts if debt.debtor_id == request.user.id]
+    user_credits = [debt for debt in debts if debt.creditor_id == request.user.id]
     
     context = {
         'group': group,
         'member_balances': member_balances,
         'settlement_plan': settlement_plan,
-        'is_admin': group.admin == request.user
+        'debts': debts,
+        'user_debts': user_debts,
+        'user_credits': user_credits,
+        'total_debt': sum((debt.amount for debt in user_debts), Decimal('0.00')),
+        'total_credit': sum((debt.amount for debt in user_credits), Decimal('0.00')),
+        'is_admin': group.admin_id == request.user.id
     }
     
     return render(request, 'expenses/group_settlement_summary.html', context)
@@ -694,6 +603,7 @@ def invite_to_group(request, group_id):
             
             # Add user to the group
             group.members.add(user)
+            bump_group_version(group.id)
             messages.success(request, f"{user.username} has been added to the group.")
             
         except User.DoesNotExist:
@@ -714,47 +624,33 @@ def invite_to_group(request, group_id):
 @login_required
 def user_profile(request):
     """View to display and edit user profile"""
+    # Apply this user's queued ledger changes before reading balances
+    flush_pending_ledger_writes(request)
+    
     user = request.user
     
     # Get all groups the user is a member of
     user_groups = Group.objects.filter(members=user)
     
-    # Get user's expense statistics
-    total_paid = Expense.objects.filter(paid_by=user).aggregate(
-        total=Coalesce(Sum('amount', output_field=DecimalField()), Value(0, output_field=DecimalField()))
-    )['total']
-    
-    # Amount owed by this user across all groups
-    user_owes = Debt.objects.filter(
-        debtor=user,
-        is_settled=False
-    ).aggregate(
-        total=Coalesce(Sum('amount', output_field=DecimalField()), Value(0, output_field=DecimalField()))
-    )['total']
-    
-    # Amount to be received by this user across all groups
-    user_owed = Debt.objects.filter(
-        creditor=user,
-        is_settled=False
-    ).aggregate(
-        total=Coalesce(Sum('amount', output_field=DecimalField()), Value(0, output_field=DecimalField()))
-    )['total']
+    # Lifetime figures are kept up to date in the user's UserStats row
+    stats = UserStats.objects.filter(user=user).first() or UserStats(user=user)
     
     # Calculate net balance
-    net_balance = user_owed - user_owes
+    net_balance = stats.to_receive - stats.owed
     
-    # Get recent expenses - change 'split__user' to 'splits__user'
-    recent_expenses = Expense.objects.filter(
-        Q(paid_by=user) | Q(splits__user=user)
-    ).distinct().order_by('-created_at')[:5]
+    # Recent expenses the user paid for or has a share in
+    # (an IN subquery rather than a join, so no DISTINCT is needed)
+    recent_expenses = Expense.objects.filter(user_expenses_filter(user)).order_by('-created_at')[:5]
     
     context = {
         'user': user,
         'user_groups': user_groups,
-        'total_paid': total_paid,
-        'user_owes': user_owes,
-        'user_owed': user_owed,
+        'stats': stats,
+        'total_paid': stats.total_paid,
+        'user_owes': stats.owed,
+        'user_owed': stats.to_receive,
         'net_balance': net_balance,
+        'settled_debts_count': stats.settled_debt_count,
         'recent_expenses': recent_expenses
     }
     
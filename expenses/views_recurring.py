@@ -4,11 +4,10 @@ from django.contrib import messages
 from django.db import transaction
 from django.utils import timezone
 from django.db.models import Q  # Add this import
-from decimal import Decimal
-import json
-from .models import RecurringExpense, Expense
+from django.core.exceptions import ValidationError
+from .models import RecurringExpense
 from .forms import RecurringExpenseForm
-from .views_expense import handle_equal_split, handle_percentage_split, handle_direct_split
+from .expense_utils import compile_posted_split_plan, generate_expense_from_recurring, update_next_due_date
 
 @login_required
 def recurring_expenses(request):
@@ -49,48 +48,30 @@ def add_recurring_expense(request):
                 participants = list(participants)
                 participants.append(paid_by)
             
+            recurring_expense = RecurringExpense(
+                title=title,
+                amount=amount,
+                paid_by=paid_by,
+                group=group,
+                frequency=frequency,
+                split_type=split_type,
+                next_due_date=next_due_date
+            )
+            # Resolve the split now, so generating the expense later is a plain apply step
+            try:
+                compile_posted_split_plan(recurring_expense, request.POST, participants)
+            except ValidationError as e:
+                messages.error(request, e.messages[0])
+                return render(request, 'expenses/add_recurring_expense.html', {'form': form})
+
             try:
                 with transaction.atomic():
                     # Create the recurring expense
-                    recurring_expense = RecurringExpense.objects.create(
-                        title=title,
-                        amount=amount,
-                        paid_by=paid_by,
-                        group=group,
-                        frequency=frequency,
-                        split_type=split_type,
-                        next_due_date=next_due_date
-                    )
+                    recurring_expense.save()
                     
                     # Add participants
                     recurring_expense.participants.set(participants)
                     
-                    # Handle different split types for future reference
-                    if split_type == 'PERCENTAGE':
-                        # Store percentages as metadata
-                        percentages = {}
-                        for participant in participants:
-                            percentage_key = f'percentage_{participant.id}'
-                            if percentage_key in request.POST:
-                                percentages[str(participant.id)] = request.POST[percentage_key]
-                        
-                        # Save percentages as JSON in a new field or related model
-                        # This is a simplified approach - you might want to create a proper model
-                        recurring_expense.split_details = json.dumps(percentages)
-                        recurring_expense.save()
-                        
-                    elif split_type == 'DIRECT':
-                        # Store direct amounts as metadata
-                        direct_amounts = {}
-                        for participant in participants:
-                            amount_key = f'amount_{participant.id}'
-                            if amount_key in request.POST:
-                                direct_amounts[str(participant.id)] = request.POST[amount_key]
-                        
-                        # Save direct amounts as JSON
-                        recurring_expense.split_details = json.dumps(direct_amounts)
-                        recurring_expense.save()
-                    
                     messages.success(request, f"Recurring expense '{title}' was added successfully!")
                     return redirect('recurring_expenses')
             
@@ -132,6 +113,14 @@ def edit_recurring_expense(request, expense_id):
                 participants = list(participants)
                 participants.append(recurring_expense.paid_by)
             
+            # Resolve the split now, so generating the expense later is a plain apply step
+            try:
+                # form.is_valid() already copied the new values onto the instance
+                compile_posted_split_plan(recurring_expense, request.POST, participants)
+            except ValidationError as e:
+                messages.error(request, e.messages[0])
+                return render(request, 'expenses/edit_recurring_expense.html', {'form': form, 'expense': recurring_expense})
+
             try:
                 with transaction.atomic():
                     # Update the recurring expense
@@ -140,32 +129,6 @@ def edit_recurring_expense(request, expense_id):
                     # Update participants
                     recurring_expense.participants.set(participants)
                     
-                    # Handle different split types for future reference
-                    split_type = form.cleaned_data['split_type']
-                    if split_type == 'PERCENTAGE':
-                        # Store percentages as metadata
-                        percentages = {}
-                        for participant in participants:
-                            percentage_key = f'percentage_{participant.id}'
-                            if percentage_key in request.POST:
-                                percentages[str(participant.id)] = request.POST[percentage_key]
-                        
-                        # Save percentages as JSON
-                        recurring_expense.split_details = json.dumps(percentages)
-                        recurring_expense.save()
-                        
-                    elif split_type == 'DIRECT':
-                        # Store direct amounts as metadata
-                        direct_amounts = {}
-                        for participant in participants:
-                            amount_key = f'amount_{participant.id}'
-                            if amount_key in request.POST:
-                                direct_amounts[str(participant.id)] = request.POST[amount_key]
-                        
-                        # Save direct amounts as JSON
-                        recurring_expense.split_details = json.dumps(direct_amounts)
-                        recurring_expense.save()
-                    
                     messages.success(request, f"Recurring expense '{recurring_expense.title}' was updated successfully!")
                     return redirect('recurring_expenses')
             
@@ -223,40 +186,3 @@ def generate_recurring_expense_now(request, expense_id):
     
     return redirect('recurring_expenses')
 
-def generate_expense_from_recurring(recurring_expense):
-    """Generate a new expense from a recurring expense"""
-    with transaction.atomic():
-        # Create the expense
-        expense = Expense.objects.create(
-            title=f"{recurring_expense.title} (Recurring: {recurring_expense.get_frequency_display()})",
-            amount=recurring_expense.amount,
-            paid_by=recurring_expense.paid_by,
-            group=recurring_expense.group,
-            split_type=recurring_expense.split_type
-        )
-        
-        # Get participants
-        participants = recurring_expense.participants.all()
-        
-        # Handle different split types
-        if recurring_expense.split_type == 'EQUAL':
-            handle_equal_split(expense, participants)
-        elif recurring_expense.split_type == 'PERCENTAGE':
-            # Get percentages from stored metadata
-            try:
-                percentages = json.loads(recurring_expense.split_details)
-                percentage_dict = {int(k): Decimal(v) for k, v in percentages.items()}
-                handle_percentage_split(expense, participants, percentage_dict)
-            except Exception as e:
-                # Handle the exception properly
-                # We can't use messages or redirect here since this is not a view function
-                # Just re-raise the exception to be caught by the calling view
-                raise Exception(f"Error processing percentage split: {str(e)}")
-        elif recurring_expense.split_type == 'DIRECT':
-            # Similar handling for direct split
-            try:
-                direct_amounts = json.loads(recurring_expense.split_details)
-                direct_dict = {int(k): Decimal(v) for k, v in direct_amounts.items()}
-                handle_direct_split(expense, participants, direct_dict)
-            except Exception as e:
-                raise Exception(f"Error processing direct split: {str(e)}")
\ No newline at end of file
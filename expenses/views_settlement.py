@@ -2,8 +2,20 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db import transaction
-from .models import Group, User, Expense, Debt
-from decimal import Decimal
+from django.db.models import Q
+from .models import Group, User, Debt
+from .expense_utils import settle_debts, settle_payment, settle_group
+from .expense_utils import flush_pending_ledger_writes
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+from .balance_cache import user_group_summaries, cached_group_member_balances
+from .ledger import open_debts_of
+from .settlement_engine import net_across_groups, from_cents, to_cents, BalanceSheet
+from decimal import Decimal, InvalidOperation
+import json
+from collections import defaultdict
+from django.core.exceptions import ValidationError
+import hashlib
 
 @login_required
 def settle_up_redirect(request):
@@ -13,14 +25,26 @@ def settle_up_redirect(request):
 @login_required
 def settlement_summary(request):
     """View to display settlement summary for the user"""
-    # Get debts where the user is the creditor (others owe them)
-    credits = Debt.objects.filter(creditor=request.user, is_settled=False)
+    # Apply this user's queued ledger changes before reading balances
+    flush_pending_ledger_writes(request)
     
-    # Get debts where the user is the debtor (they owe others)
-    debts = Debt.objects.filter(debtor=request.user, is_settled=False)
+    user = request.user
     
     # Get groups the user is a member of
-    groups = Group.objects.filter(members=request.user)
+    groups = list(Group.objects.filter(members=user))
+    
+    # Open debts in those groups come from the balance cache
+    credits, debts = [], []
+    for summary in user_group_summaries(user, [group.id for group in groups]).values():
+        credits.extend(summary['credits'])
+        debts.extend(summary['debts'])
+    
+    # Debts outside the user's current groups are read directly
+    other_debts = Debt.objects.filter(
+        open_debts_of(user)
+    ).exclude(group__in=groups).select_related('creditor', 'debtor', 'group')
+    for debt in other_debts:
+        (credits if debt.creditor_id == user.id else debts).append(debt)
     
     context = {
         'credits': credits,
@@ -32,9 +56,134 @@ def settlement_summary(request):
     
     return render(request, 'expenses/settlement_summary.html', context)
 
+def debts_token(debts):
+    """Fingerprint of a set of debts, to spot changes between showing a plan and recording it."""
+    rows = ','.join(f'{debt.pk}:{debt.amount}' for debt in sorted(debts, key=lambda debt: debt.pk))
+    return hashlib.md5(rows.encode()).hexdigest()
+
+@login_required
+def network_settlement(request):
+    """
+    Opt-in settlement across all of the user's groups: debts with each person are
+    netted into one payment, and recording it settles every underlying group debt.
+    """
+    # Apply this user's queued ledger changes before reading balances
+    flush_pending_ledger_writes(request)
+    
+    user = request.user
+    open_debts = Debt.objects.filter(
+        open_debts_of(user)
+    ).select_related('creditor', 'debtor', 'group')
+    
+    if request.method == 'POST':
+        with transaction.atomic():
+            debts = list(open_debts.select_for_update())
+            # Only record the plan the user actually saw
+            if not debts or debts_token(debts) != request.POST.get('plan'):
+                messages.error(request, "Your balances changed since the plan was shown. Please review the new plan.")
+                return redirect('network_settlement')
+            transfers = net_across_groups(user.id, debts)
+            settled = settle_debts([debt.pk for debt in debts])
+        
+        # Each group's ledger takes its own debts' payments, so there is a Payment
+        # row per debt; the netted transfers are what actually changes hands
+        transfer_count = sum(1 for transfer in transfers if transfer['cents'])
+        messages.success(
+            request,
+            f"Recorded {len(settled)} payment(s) across "
+            f"{len({payment.group_id for payment in settled})} group(s), "
+            f"which come down to {transfer_count} transfer(s) between people."
+        )
+        return redirect('settlement_summary')
+    
+    debts = list(open_debts)
+    
+    # Resolve ids back to users and amounts back to Decimals for display
+    people = {}
+    for debt in debts:
+        people[debt.creditor_id] = debt.creditor
+        people[debt.debtor_id] = debt.debtor
+    transfers = [
+        {
+            'counterparty': people[transfer['counterparty_id']],
+            'from_user': people[transfer['payer_id']],
+            'to_user': people[transfer['payee_id']],
+            'amount': from_cents(transfer['cents']),
+            'allocations': [
+                {'debt': debt, 'amount': from_cents(cents), 'offset': offset}
+                for debt, cents, offset in transfer['allocations']
+            ],
+        }
+        for transfer in net_across_groups(user.id, debts)
+    ]
+    
+    context = {
+        'transfers': transfers,
+        'plan': debts_token(debts),
+        'debt_count': len(debts),
+        'group_count': len({debt.group_id for debt in debts}),
+        'payment_count': sum(1 for transfer in transfers if transfer['amount']),
+    }
+    
+    return render(request, 'expenses/network_settlement.html', context)
+
+@login_required
+@require_POST
+def simulate_settlement(request, group_id):
+    """
+    What-if API: apply proposed payments to the group's current balances in
+    memory and return the balances and settlement plan they would leave.
+    Nothing is written. Expects a JSON body like
+    {"payments": [{"from": <user id>, "to": <user id>, "amount": "12.50"}, ...]}.
+    """
+    group = get_object_or_404(Group, id=group_id)
+    
+    # Every member's position, from the balance cache
+    member_balances = cached_group_member_balances(group)
+    members = {member.id: member for member in member_balances}
+    if not member_balances.get(request.user, {}).get('is_member'):
+        return JsonResponse({'error': "You must be a member of the group."}, status=403)
+    
+    try:
+        proposed = json.loads(request.body or b'{}').get('payments', [])
+        payments = [(int(payment['from']), int(payment['to']), Decimal(str(payment['amount']))) for payment in proposed]
+    except (ValueError, TypeError, KeyError, AttributeError, InvalidOperation):
+        return JsonResponse(
+            {'error': 'Expected {"payments": [{"from": user_id, "to": user_id, "amount": "0.00"}]}.'}, status=400
+        )
+    
+    sheet = BalanceSheet({member.id: to_cents(row['net_balance']) for member, row in member_balances.items()})
+    for position, (payer_id, payee_id, amount) in enumerate(payments):
+        if payer_id not in sheet or payee_id not in sheet or payer_id == payee_id:
+            return JsonResponse({'error': f"Payment {position + 1} must be between two different group members."}, status=400)
+        if amount <= 0 or from_cents(to_cents(amount)) != amount:
+            return JsonResponse({'error': f"Payment {position + 1} must be a positive amount in whole cents."}, status=400)
+        sheet.pay(payer_id, payee_id, to_cents(amount))
+    
+    try:
+        plan = sheet.settlement_plan()
+    except ValueError as e:
+        return JsonResponse({'error': f"The group's balances can't be settled right now: {str(e)}"}, status=409)
+    
+    return JsonResponse({
+        'group': group.id,
+        'payments_applied': len(payments),
+        'balances': [
+            {'user_id': user_id, 'username': members[user_id].username, 'net_balance': from_cents(cents)}
+            for user_id, cents in sheet.balances().items()
+        ],
+        'settlement_plan': [
+            {'from_user_id': payer_id, 'to_user_id': payee_id, 'amount': from_cents(cents)}
+            for payer_id, payee_id, cents in plan
+        ],
+    })
+
 @login_required
 def record_settlement(request):
     """View to record a settlement between users"""
+    # Apply this user's queued ledger changes before checking what is owed
+    flush_pending_ledger_writes(request)
+    
     if request.method == 'POST':
         creditor_id = request.POST.get('creditor')
         debtor_id = request.POST.get('debtor')
@@ -46,24 +195,14 @@ def record_settlement(request):
             debtor = User.objects.get(id=debtor_id)
             group = Group.objects.get(id=group_id) if group_id else None
             
-            # Find the debt record
-            debt = get_object_or_404(
-                Debt, 
-                creditor=creditor, 
-                debtor=debtor, 
-                group=group, 
-                is_settled=False
-            )
-            
-            # Mark as settled
-            with transaction.atomic():
-                debt.is_settled = True
-                debt.save()
-                
-                messages.success(request, f"Settlement of ${amount} recorded successfully!")
+            # One payment row; the ledger takes it off what the debtor owes
+            payment = settle_payment(debtor, creditor, amount, group=group)
+            messages.success(request, f"Settlement of ${payment.amount} recorded successfully!")
             
             return redirect('settlement_summary')
             
+        except ValidationError as e:
+            messages.error(request, f"Error recording settlement: {e.messages[0]}")
         except Exception as e:
             messages.error(request, f"Error recording settlement: {str(e)}")
     
@@ -84,36 +223,70 @@ def settle_up(request, group_id=None, creditor_id=None):
         messages.error(request, "You must be a member of the group to settle debts.")
         return redirect('group_detail', group_id=group_id)
     
-    if creditor_id:
-        creditor = get_object_or_404(User, id=creditor_id)
-        # Logic for settling with a specific user
-    else:
-        # Logic for settling all debts
-        pass
-        
+    # Apply this user's queued ledger changes before reading or paying off debts
+    flush_pending_ledger_writes(request)
+    
+    user = request.user
+    
     if request.method == 'POST':
-        amount = Decimal(request.POST.get('amount', 0))
-        description = request.POST.get('description', f"Settlement from {request.user.username}")
+        settlement_type = request.POST.get('settlement_type')
         
-        # Create a settlement expense
-        settlement = Expense.objects.create(
-            title=f"Settlement: {description}",
-            amount=amount,
-            paid_by=request.user,
-            group=group,
-            split_type='settlement'
-        )
+        # Settle every balance in the group in one go
+        if settlement_type == 'settle_all':
+            if group.admin_id != user.id:
+                messages.error(request, "Only the group admin can settle all balances in the group.")
+                return redirect('settle_up', group_id=group_id)
+            settled = settle_group(group)
+            messages.success(request, f"Settled all balances in {group.name} ({settled} payments).")
+            return redirect('group_detail', group_id=group_id)
         
-        if creditor_id:
-            settlement.participants.add(creditor)
-            messages.success(request, f"You've settled up with {creditor.username}.")
+        # User is paying someone else, or recording a payment they received
+        if settlement_type == 'pay':
+            counterparty = get_object_or_404(User, id=request.POST.get('creditor_id'))
+            debtor, creditor = user, counterparty
+        elif settlement_type == 'receive':
+            counterparty = get_object_or_404(User, id=request.POST.get('debtor_id'))
+            debtor, creditor = counterparty, user
         else:
-            # Add all members who the user owes money to
-            messages.success(request, "You've settled up with the group.")
+            messages.error(request, "Unknown settlement type.")
+            return redirect('settle_up', group_id=group_id)
         
+        try:
+            payment = settle_payment(debtor, creditor, request.POST.get('amount', '0'), group=group)
+        except (InvalidOperation, ValidationError) as e:
+            error = e.messages[0] if isinstance(e, ValidationError) else "Please enter a valid amount."
+            messages.error(request, error)
+            return redirect('settle_up', group_id=group_id)
+        
+        if settlement_type == 'pay':
+            messages.success(request, f"Successfully paid ${payment.amount} to {creditor.username}.")
+        else:
+            messages.success(request, f"Successfully recorded ${payment.amount} payment from {debtor.username}.")
         return redirect('group_detail', group_id=group_id)
     
-    return render(request, 'expenses/settle_up.html', {
+    # Open debts between the user and the rest of the group
+    debts = Debt.objects.filter(
+        open_debts_of(user),
+        group=group
+    ).select_related('creditor', 'debtor', 'expense', 'group')
+    if creditor_id:
+        debts = debts.filter(Q(creditor_id=creditor_id) | Q(debtor_id=creditor_id))
+    
+    # Group debts by counterparty, with a total for each
+    debts_by_creditor, debts_by_debtor = defaultdict(list), defaultdict(list)
+    for debt in debts:
+        if debt.debtor_id == user.id:
+            debts_by_creditor[debt.creditor].append(debt)
+        else:
+            debts_by_debtor[debt.debtor].append(debt)
+    
+    context = {
         'group': group,
-        'creditor': get_object_or_404(User, id=creditor_id) if creditor_id else None
-    })
\ No newline at end of file
+        'is_admin': group.admin_id == user.id,
+        'debts_by_creditor': dict(debts_by_creditor),
+        'creditor_totals': {creditor: sum(debt.amount for debt in owed) for creditor, owed in debts_by_creditor.items()},
+        'debts_by_debtor': dict(debts_by_debtor),
+        'debtor_totals': {debtor: sum(debt.amount for debt in owed) for debtor, owed in debts_by_debtor.items()},
+    }
+    
+    return render(request, 'expenses/settle_up.html', context)
\ No newline at end of file
@@ -0,0 +1,47 @@
+"""
+Process pools for the management commands that take --workers.
+
+Where fork isn't available (Windows) or isn't the default (macOS), workers
+start as fresh interpreters that have to import the function they run, and
+the command modules import models at the top. So this module imports nothing
+from the app: the pool's initializer sets Django up first, and the task
+functions are only unpickled, and their modules imported, after that.
+
+Fresh interpreters also read the settings module again, so database names and
+caches the parent changed at runtime (the test runner does both) are handed
+over explicitly.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.conf import settings
+from django.db import connections
+
+
+def parent_settings():
+    """The database names and caches this process actually uses, for init_worker."""
+    return {
+        'databases': {alias: connections[alias].settings_dict['NAME'] for alias in connections},
+        'caches': settings.CACHES,
+    }
+
+def init_worker(parent):
+    """Set Django up in the worker like the parent, and give it its own database connection."""
+    for alias, name in parent['databases'].items():
+        settings.DATABASES[alias]['NAME'] = name
+    settings.CACHES = parent['caches']
+    django.setup()
+    connections.close_all()
+
+def process_pool(workers):
+    """
+    A ProcessPoolExecutor of `workers` processes, forked where the platform
+    allows it and spawned elsewhere.
+    """
+    # Children must not share the parent's connection
+    connections.close_all()
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(parent_settings(),),
+        mp_context=multiprocessing.get_context(method)
+    )
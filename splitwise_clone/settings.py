@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -79,9 +80,46 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts so concurrent expense
+            # posts wait for each other instead of failing with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file rather than SQLite's shared in-memory database, whose table locks
+        # fail concurrent writers at once instead of waiting; the ledger's
+        # concurrency tests need the real locking behaviour
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Balances are cached with a version per group that every write bumps, so the
+# cache must be shared by all server processes: a bump made in one process has
+# to reach the others. The file cache is shared by every process on this host;
+# with servers on several hosts use RedisCache. A per-process backend such as
+# LocMemCache fails the expenses.E001 system check. The test runner moves the
+# tests to a cache of their own, see splitwise_clone/test_runner.py.
+# The file cache culls a third of its entries whenever it holds MAX_ENTRIES,
+# so that is set well above the groups and users with entries at any one time.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'splitwise-balances'),
+        'KEY_PREFIX': 'splitwise',
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+        },
     }
 }
 
+TEST_RUNNER = 'splitwise_clone.test_runner.SplitwiseTestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -129,3 +167,20 @@ LOGIN_URL = 'login'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Queue debt changes from add_expense and apply them with the drain_ledger_queue
+# worker instead of inside the request. Expenses and splits are still saved immediately.
+LEDGER_ASYNC_POSTING = False
+
+# Cache holding computed group balances and per-user summaries (see expenses/balance_cache.py),
+# and how many seconds an entry is kept. Entries are invalidated by version, not by expiry.
+BALANCE_CACHE_ALIAS = 'default'
+BALANCE_CACHE_TIMEOUT = 300
+
+# Groups with at most this many members owing or owed money get an exact
+# fewest-payments settlement plan, larger ones a fast heuristic (expenses/settlement_engine.py)
+SETTLEMENT_EXACT_LIMIT = 14
+
+# Default age in days after which archive_settled_history moves payments and the
+# splits of fully settled expenses into the archive tables (expenses/archive.py)
+ARCHIVE_AFTER_DAYS = 365
@@ -0,0 +1,35 @@
+"""
+Test runner that keeps the test run out of the server's cache.
+
+The balance cache is a file cache shared by every process on the host, so
+without this the tests' cache.clear() would wipe the dev server's entries and
+balances cached by the tests could be served to it. The test run gets its own
+directory and key prefix instead; it's still a shared backend, so the
+expenses.E001 check holds under test too.
+"""
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+FILE_CACHE = 'django.core.cache.backends.filebased.FileBasedCache'
+
+
+def test_caches():
+    """settings.CACHES with every cache moved out of the way of the server's."""
+    caches = {}
+    for alias, config in settings.CACHES.items():
+        config = {**config, 'KEY_PREFIX': f"{config.get('KEY_PREFIX', '')}test"}
+        if config['BACKEND'] == FILE_CACHE:
+            config['LOCATION'] = f"{config['LOCATION']}-test"
+        caches[alias] = config
+    return caches
+
+class SplitwiseTestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_override = override_settings(CACHES=test_caches())
+        self.cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_override.disable()
+        super().teardown_test_environment(**kwargs)